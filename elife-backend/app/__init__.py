@@ -15,9 +15,15 @@ migrate = Migrate()
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
-def create_app():
+def create_app(config_object=None):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_object or Config)
+
+    from app.logs import init_logging
+    init_logging(app)
+
+    from app.json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
 
     CORS(app)
 
@@ -28,15 +34,37 @@ def create_app():
     login_manager.login_view = 'auth.login'
 
     firebase_key_path = os.path.join(os.getcwd(), "firebase", "serviceAccountKey.json")
-    if os.path.exists(firebase_key_path):
-        cred = credentials.Certificate(firebase_key_path)
-        firebase_admin.initialize_app(cred, {
-            'storageBucket': 'elife-9730a'
-        })
-    else:
-        raise FileNotFoundError("Firebase service account key not found. Expected at: firebase/serviceAccountKey.json")
+    if not app.testing:
+        if os.path.exists(firebase_key_path):
+            cred = credentials.Certificate(firebase_key_path)
+            firebase_admin.initialize_app(cred, {
+                'storageBucket': 'elife-9730a'
+            })
+        else:
+            raise FileNotFoundError("Firebase service account key not found. Expected at: firebase/serviceAccountKey.json")
 
     from app.views import auth
     app.register_blueprint(auth)
 
+    from app.audit import audit_writer
+    audit_writer.init_app(app)
+
+    from app.compression import init_compression
+    init_compression(app)
+
+    from app.querystats import init_query_stats
+    init_query_stats(app)
+
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    from app.tracing import init_tracing
+    init_tracing(app)
+
+    from app.profiling import init_profiling
+    init_profiling(app)
+
+    from app.commands import register_commands
+    register_commands(app)
+
     return app
@@ -0,0 +1,272 @@
+"""
+Write-behind buffer for append-only audit records such as login sessions and notifications.
+
+Request handlers enqueue rows instead of committing them one by one. A background thread
+groups queued rows per table and writes them with one multi-row INSERT per group when the
+batch fills up or the flush interval passes. When the queue is full the caller writes its
+row synchronously.
+
+A batch that fails to write is retried with backoff, AUDIT_WRITE_ATTEMPTS times in total
+(once for synchronous writes). If it still fails, its rows are appended to the
+AUDIT_DEAD_LETTER_PATH file instead of being discarded, and `flask replay-audit-dead-letters`
+writes them back once the database is healthy again.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import DateTime, insert
+
+from app import db
+from app.bulk import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue of pending inserts drained in bulk by a background thread.
+
+    Args:
+        max_queue (int): Maximum number of pending rows before callers write synchronously.
+        batch_size (int): Rows that trigger an immediate flush.
+        flush_interval (float): Maximum seconds a row waits before it is written.
+        write_attempts (int): Tries per batch before its rows are dead-lettered.
+        dead_letter_path (str, optional): JSON-lines file receiving rows that could not be written.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=1.0, write_attempts=3,
+                 dead_letter_path=None):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_attempts = write_attempts
+        self.dead_letter_path = dead_letter_path
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._insert_hooks = {}
+        self._conflict_keys = {}
+        self._dead_letter_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Bind the buffer to the app and read its limits from config.
+
+        Args:
+            app (Flask): Application instance.
+        """
+        self._app = app
+        self.max_queue = app.config.get('AUDIT_QUEUE_SIZE', self.max_queue)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_SECONDS', self.flush_interval)
+        self.write_attempts = app.config.get('AUDIT_WRITE_ATTEMPTS', self.write_attempts)
+        self.dead_letter_path = app.config.get('AUDIT_DEAD_LETTER_PATH') or os.path.join(
+            os.getcwd(), 'data', 'audit-dead-letter.jsonl'
+        )
+        atexit.register(self.shutdown)
+
+    def register_insert_hook(self, model, hook):
+        """
+        Run `hook(connection, rows)` in the same transaction as each bulk insert into a table,
+        e.g. to maintain counters that ORM events would otherwise update.
+
+        Args:
+            model (db.Model): Mapped class of the audit table.
+            hook (callable): Called with the connection and the inserted row dicts.
+        """
+        self._insert_hooks.setdefault(model, []).append(hook)
+
+    def register_conflict_key(self, model, index_elements, update_columns):
+        """
+        Write rows of a table as upserts, for tables whose rows may already have been created
+        synchronously, e.g. a logout recorded before the buffered login row was written.
+
+        Args:
+            model (db.Model): Mapped class of the audit table.
+            index_elements (list): Columns of the unique constraint rows collide on.
+            update_columns (list): Columns the buffered row overwrites on an existing row.
+        """
+        self._conflict_keys[model] = (list(index_elements), list(update_columns))
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so each worker process owns its thread.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def add(self, model, **values):
+        """
+        Queue a row for insertion.
+
+        Args:
+            model (db.Model): Mapped class of the audit table.
+            **values: Column values for the row.
+
+        Returns:
+            bool: True if the row was queued, False if it was written synchronously.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((model, values))
+            return True
+        except queue.Full:
+            self._write([(model, values)], attempts=1)
+            return False
+
+    def flush(self):
+        """Write every queued row now, in the calling thread."""
+        if self._queue is None:
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the background thread and drain the queue."""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch, attempts=None):
+        attempts = attempts or self.write_attempts
+        for attempt in range(1, attempts + 1):
+            try:
+                self._write_batch(batch)
+                return True
+            except Exception:
+                if attempt == attempts:
+                    logger.exception("Failed to write %d audit rows after %d attempts", len(batch), attempts)
+                else:
+                    logger.warning("Failed to write %d audit rows, retrying", len(batch), exc_info=True)
+                    time.sleep(min(0.5 * 2 ** (attempt - 1), 5.0))
+        self._dead_letter(batch)
+        return False
+
+    def _write_batch(self, batch):
+        groups = {}
+        for model, values in batch:
+            groups.setdefault((model, tuple(sorted(values))), []).append(values)
+
+        with self._write_lock, self._app.app_context():
+            with db.engine.begin() as conn:
+                for (model, _), rows in groups.items():
+                    conn.execute(self._insert_statement(conn, model), rows)
+                    for hook in self._insert_hooks.get(model, []):
+                        hook(conn, rows)
+
+    def _insert_statement(self, conn, model):
+        if model not in self._conflict_keys:
+            return insert(model.__table__)
+        index_elements, update_columns = self._conflict_keys[model]
+        stmt = dialect_insert(conn, model)
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+
+    def _dead_letter(self, batch):
+        try:
+            with self._dead_letter_lock:
+                os.makedirs(os.path.dirname(self.dead_letter_path) or '.', exist_ok=True)
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                    for model, values in batch:
+                        f.write(json.dumps({'table': model.__tablename__, 'values': values}, default=_encode) + '\n')
+        except OSError:
+            logger.exception("Could not dead-letter %d audit rows to %s", len(batch), self.dead_letter_path)
+
+    def replay_dead_letters(self, batch_size=None):
+        """
+        Write dead-lettered rows back to the database. Rows that fail again are dead-lettered
+        again, so the command can be re-run.
+
+        Args:
+            batch_size (int, optional): Rows per transaction; defaults to the buffer's batch size.
+
+        Returns:
+            tuple: (rows written, rows that failed again).
+        """
+        path = self.dead_letter_path
+        if not path or not os.path.exists(path):
+            return 0, 0
+        # Take the file over first, so rows dead-lettered meanwhile go to a fresh one.
+        replaying = f"{path}.{os.getpid()}.replay"
+        with self._dead_letter_lock:
+            os.replace(path, replaying)
+
+        models = {mapper.class_.__tablename__: mapper.class_ for mapper in db.Model.registry.mappers}
+        batch = []
+        with open(replaying, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    model = models[entry['table']]
+                    batch.append((model, _decode(model, entry['values'])))
+
+        written = failed = 0
+        size = batch_size or self.batch_size
+        for start in range(0, len(batch), size):
+            chunk = batch[start:start + size]
+            if self._write(chunk, attempts=1):
+                written += len(chunk)
+            else:
+                failed += len(chunk)
+        os.remove(replaying)
+        return written, failed
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _decode(model, values):
+    # JSON has no datetime type; restore DateTime columns from their ISO strings.
+    columns = model.__table__.columns
+    return {
+        key: datetime.fromisoformat(value) if isinstance(value, str) and isinstance(columns[key].type, DateTime) else value
+        for key, value in values.items()
+    }
+
+audit_writer = WriteBehindBuffer()
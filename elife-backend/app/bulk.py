@@ -0,0 +1,80 @@
+"""
+Dialect-aware helpers for set-based writes on PostgreSQL and SQLite.
+"""
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def dialect_name(bind):
+    """
+    Args:
+        bind: SQLAlchemy connection, engine or session.
+
+    Returns:
+        str: Dialect name, e.g. 'postgresql' or 'sqlite'.
+    """
+    if hasattr(bind, 'dialect'):
+        return bind.dialect.name
+    return bind.get_bind().dialect.name
+
+
+def dialect_insert(bind, table):
+    """
+    Build an INSERT that supports ON CONFLICT on the bind's dialect.
+
+    Args:
+        bind: SQLAlchemy connection, engine or session.
+        table (Table or mapped class): Target table.
+
+    Returns:
+        Insert: Dialect-specific insert construct.
+
+    Raises:
+        NotImplementedError: For dialects without ON CONFLICT support.
+    """
+    table = getattr(table, '__table__', table)
+    name = dialect_name(bind)
+    if name == 'postgresql':
+        return postgresql_insert(table)
+    if name == 'sqlite':
+        return sqlite_insert(table)
+    raise NotImplementedError(f"ON CONFLICT is not supported for dialect {name}")
+
+
+def insert_ignore(bind, table, rows, index_elements):
+    """
+    Insert rows, skipping those that collide with an existing unique key.
+
+    Inserted rows are reported through RETURNING: with executemany, `rowcount` is not
+    reliable on every driver (psycopg2 reports only the last batch).
+
+    Args:
+        bind: SQLAlchemy connection or session.
+        table (Table or mapped class): Target table.
+        rows (list): Dicts of column values.
+        index_elements (list): Columns of the unique constraint to check.
+
+    Returns:
+        list: Primary key rows of the inserted rows; skipped rows are left out.
+    """
+    if not rows:
+        return []
+    table = getattr(table, '__table__', table)
+    stmt = dialect_insert(bind, table).on_conflict_do_nothing(index_elements=index_elements)
+    return bind.execute(stmt.returning(*table.primary_key.columns), rows).all()
+
+
+def chunked(items, size):
+    """
+    Split a sequence into lists of at most `size` items.
+
+    Args:
+        items (Sequence): Items to split.
+        size (int): Chunk size.
+
+    Yields:
+        list: Consecutive chunks.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -1,13 +1,15 @@
-import traceback
+import logging
 import json
-import hashlib
 from datetime import datetime
 from flask import Blueprint, jsonify, request
-from app.models import User, ProofSubmission, DigitalCertificate, QuarterVerification
+from app.models import User, DigitalCertificate
 from app import db, csrf
 from app.views import token_required
+from app.issuance import current_quarter, issue_certificate, latest_approved_submission_query
+from app.quarters import upsert_quarter_verification
 
 certificate_bp = Blueprint('certificate', __name__)
+logger = logging.getLogger(__name__)
 
 def json_response(success, message, status_code=200, **kwargs):
     response = {"success": success, "message": message}
@@ -46,11 +48,13 @@ def get_certificate(current_user, certificate_id):
             "quarter": certificate.quarter,
             "timestamp": certificate.timestamp.isoformat(),
             "digital_signature_hash": certificate.digital_signature_hash,
+            "signature": certificate.signature,
+            "key_id": certificate.key_id,
             "content_snapshot": parse_content_snapshot(certificate.content_snapshot)
         }), 200
 
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Get certificate failed")
         return json_response(False, "Failed to retrieve certificate", 500, error=str(e))
 
 
@@ -60,97 +64,44 @@ def get_certificate(current_user, certificate_id):
 def generate_certificate(current_user):
     try:
         data = request.get_json()
-        quarter = data.get('quarter') or generate_current_quarter()
+        quarter = data.get('quarter') or current_quarter()
 
-        proof_submission = ProofSubmission.query.filter_by(
-            user_id=current_user.id, status='approved'
-        ).order_by(ProofSubmission.verified_at.desc()).first()
+        proof_submission = db.session.execute(latest_approved_submission_query(current_user.id)).scalar()
 
         if not proof_submission:
             return json_response(False, "No approved verification found", 404)
 
-        existing_cert = DigitalCertificate.query.filter_by(
-            proof_submission_id=proof_submission.id
-        ).first()
-
-        if existing_cert:
-            return json_response(True, "Certificate already exists", certificate={
-                "id": existing_cert.id,
-                "user_id": existing_cert.user_id,
-                "proof_submission_id": existing_cert.proof_submission_id,
-                "quarter": existing_cert.quarter,
-                "timestamp": existing_cert.timestamp.isoformat(),
-                "digital_signature_hash": existing_cert.digital_signature_hash,
-                "content_snapshot": parse_content_snapshot(existing_cert.content_snapshot)
-            })
-
         user_details = current_user.user_details
         if not user_details:
             return json_response(False, "User details not found", 400)
 
-        content = {
-            "pensioner_number": current_user.pensioner_number,
-            "user_id": current_user.id,
-            "fullName": f"{user_details.firstname} {user_details.lastname}",
-            "dob": user_details.dob.strftime('%Y-%m-%d') if user_details.dob else None,
-            "trn": user_details.trn,
-            "verification_method": "Facial Recognition & ID Verification",
-            "quarter": quarter,
-            "issue_date": datetime.utcnow().isoformat(),
-            "expiry_date": None
-        }
-
-        digital_signature = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
-
-        new_certificate = DigitalCertificate(
-            user_id=current_user.id,
-            proof_submission_id=proof_submission.id,
-            certificate_filename=f"certificate_{current_user.id}_{quarter}.json",
-            content_snapshot=json.dumps(content),
-            digital_signature_hash=digital_signature,
-            quarter=quarter
-        )
-        db.session.add(new_certificate)
-
         quarter_num, year = extract_quarter(quarter)
         if not quarter_num or not year:
             return json_response(False, "Invalid quarter format", 400)
 
-        quarter_verification = QuarterVerification.query.filter_by(
-            user_id=current_user.id, quarter=quarter_num, year=year
-        ).first()
-
-        if quarter_verification:
-            quarter_verification.status = 'completed'
-            quarter_verification.verified_at = datetime.utcnow()
-            quarter_verification.proof_submission_id = proof_submission.id
-        else:
-            quarter_verification = QuarterVerification(
-                user_id=current_user.id,
-                quarter=quarter_num,
-                year=year,
-                status='completed',
-                verified_at=datetime.utcnow(),
-                proof_submission_id=proof_submission.id,
-                due_date=datetime.utcnow()
-            )
-            db.session.add(quarter_verification)
-
+        certificate, created = issue_certificate(current_user, user_details, proof_submission, quarter)
         db.session.commit()
 
-        return json_response(True, "Certificate generated successfully", 201, certificate={
-            "id": new_certificate.id,
-            "user_id": new_certificate.user_id,
-            "proof_submission_id": new_certificate.proof_submission_id,
-            "quarter": new_certificate.quarter,
-            "timestamp": new_certificate.timestamp.isoformat(),
-            "digital_signature_hash": new_certificate.digital_signature_hash,
-            "content_snapshot": content
-        })
+        return json_response(
+            True,
+            "Certificate generated successfully" if created else "Certificate already exists",
+            201 if created else 200,
+            certificate={
+                "id": certificate.id,
+                "user_id": certificate.user_id,
+                "proof_submission_id": certificate.proof_submission_id,
+                "quarter": certificate.quarter,
+                "timestamp": certificate.timestamp.isoformat(),
+                "digital_signature_hash": certificate.digital_signature_hash,
+                "signature": certificate.signature,
+                "key_id": certificate.key_id,
+                "content_snapshot": parse_content_snapshot(certificate.content_snapshot)
+            }
+        )
 
     except Exception as e:
         db.session.rollback()
-        traceback.print_exc()
+        logger.exception("Certificate generation failed")
         return json_response(False, "Failed to generate certificate", 500, error=str(e))
 
 
@@ -171,27 +122,11 @@ def update_quarter_verification(current_user):
         if not quarter_num or not year:
             return json_response(False, "Invalid quarter format. Expected 'Q1-2025'", 400)
 
-        quarter_verification = QuarterVerification.query.filter_by(
-            user_id=current_user.id, quarter=quarter_num, year=year
-        ).first()
-
-        if not quarter_verification:
-            quarter_verification = QuarterVerification(
-                user_id=current_user.id,
-                quarter=quarter_num,
-                year=year,
-                status=status,
-                due_date=datetime.utcnow(),
-                proof_submission_id=proof_submission_id
-            )
-            db.session.add(quarter_verification)
-        else:
-            quarter_verification.status = status
-            quarter_verification.proof_submission_id = proof_submission_id
-
-        if status == 'completed':
-            quarter_verification.verified_at = datetime.utcnow()
-
+        quarter_verification = upsert_quarter_verification(
+            current_user.id, quarter_num, year, status,
+            proof_submission_id=proof_submission_id,
+            verified_at=datetime.utcnow() if status == 'completed' else None
+        )
         db.session.commit()
 
         return json_response(True, "Quarter verification updated", quarter_verification={
@@ -204,12 +139,5 @@ def update_quarter_verification(current_user):
 
     except Exception as e:
         db.session.rollback()
-        traceback.print_exc()
+        logger.exception("Update quarter verification failed")
         return json_response(False, "Failed to update quarter verification", 500, error=str(e))
-
-
-def generate_current_quarter():
-    now = datetime.utcnow()
-    year = now.year
-    quarter = (now.month - 1) // 3 + 1
-    return f"Q{quarter}-{year}"
@@ -0,0 +1,444 @@
+"""
+Flask CLI commands for maintenance jobs and benchmarks.
+
+Run with `flask <command>`; see `flask --help` for the list.
+"""
+
+import os
+import time
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+
+
+@click.command("bench-face-index")
+@click.option("--sizes", default="1000,10000,100000", help="Comma-separated index sizes to test.")
+@click.option("--queries", default=200, help="Queries per index size.")
+@click.option("--dim", default=512, help="Embedding dimension.")
+@click.option("--nlist", default=0, help="Also benchmark an IVF index with this many partitions.")
+@click.option("--nprobe", default=8, help="Partitions scanned per IVF query.")
+def bench_face_index(sizes, queries, dim, nlist, nprobe):
+    """Report duplicate-face query latency against index size."""
+    from app.services.face_index import FaceIndex
+
+    rng = np.random.default_rng(0)
+    click.echo(f"{'mode':<6} {'size':>10} {'p50 ms':>10} {'p99 ms':>10} {'qps':>10}")
+
+    for size in [int(s) for s in sizes.split(",") if s]:
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        probes = vectors[rng.integers(0, size, queries)] + 0.1 * rng.standard_normal((queries, dim), dtype=np.float32)
+
+        modes = [("flat", FaceIndex(dim=dim))]
+        if nlist:
+            modes.append(("ivf", FaceIndex(dim=dim, nlist=nlist, nprobe=nprobe)))
+
+        for mode, index in modes:
+            index.add_many(np.arange(size), vectors)
+            if mode == "ivf":
+                index.train()
+
+            timings = []
+            for probe in probes:
+                start = time.perf_counter()
+                index.search(probe, k=5, exclude=[0])
+                timings.append((time.perf_counter() - start) * 1000)
+
+            timings = np.array(timings)
+            click.echo(
+                f"{mode:<6} {size:>10} {np.percentile(timings, 50):>10.3f} "
+                f"{np.percentile(timings, 99):>10.3f} {1000 / timings.mean():>10.0f}"
+            )
+
+
+@click.command("compact-embeddings")
+def compact_embeddings():
+    """Drop superseded and deleted rows from the face embedding store."""
+    from app.services.embedding_store import get_embedding_store
+
+    store = get_embedding_store()
+    reclaimed = store.compact()
+    click.echo(f"Compacted embedding store: {len(store)} live rows, {reclaimed} reclaimed")
+
+
+@click.command("reverify-submissions")
+@click.option("--quarter", help="Quarter to re-score, e.g. Q1-2025.")
+@click.option("--start", type=click.DateTime(), help="Earliest submission date (inclusive).")
+@click.option("--end", type=click.DateTime(), help="Latest submission date (exclusive).")
+@click.option("--workers", type=int, default=os.cpu_count(), help="Worker processes.")
+@click.option("--batch-size", default=16, help="Submissions per model forward pass.")
+@click.option("--chunk-size", default=512, help="Submissions committed per checkpoint.")
+@click.option("--checkpoint", default="reverify-checkpoint.json", help="Checkpoint file.")
+@click.option("--resume/--restart", default=True, help="Continue from the checkpoint.")
+@click.option("--apply-status", is_flag=True, help="Also recompute approved/flagged status.")
+@click.option("--cosine-threshold", type=float, help="Override FACE_MATCH_COSINE_THRESHOLD.")
+@click.option("--distance-threshold", type=float, help="Override FACE_MATCH_DISTANCE_THRESHOLD.")
+@click.option("--deepfake-threshold", type=float, help="Override DEEPFAKE_SCORE_THRESHOLD.")
+@with_appcontext
+def reverify_submissions(quarter, start, end, workers, batch_size, chunk_size, checkpoint, resume,
+                         apply_status, cosine_threshold, distance_threshold, deepfake_threshold):
+    """Re-score stored proof submissions with the current models and thresholds."""
+    from app.services.reverification import run_reverification
+    from app.utils import quarter_date_range
+
+    if quarter:
+        try:
+            start, end = quarter_date_range(quarter)
+        except ValueError:
+            raise click.BadParameter("Expected a quarter like Q1-2025", param_hint="--quarter")
+
+    thresholds = {
+        'cosine_threshold': cosine_threshold,
+        'distance_threshold': distance_threshold,
+        'deepfake_threshold': deepfake_threshold,
+    }
+    totals = run_reverification(
+        start=start, end=end, workers=workers, batch_size=batch_size, chunk_size=chunk_size,
+        checkpoint_path=checkpoint, resume=resume, apply_status=apply_status,
+        thresholds=thresholds, echo=click.echo
+    )
+    rate = totals['processed'] / totals['seconds'] if totals['seconds'] else 0
+    click.echo(f"Done: {totals['processed']} processed, {totals['failed']} failed, {rate:.1f} submissions/s")
+
+
+@click.command("bench-password-hashing")
+@click.option("--methods", default="scrypt:32768:8:1,scrypt:16384:8:1,pbkdf2:sha256:600000",
+              help="Comma-separated Werkzeug hash methods to compare.")
+@click.option("--workers", type=int, default=os.cpu_count(), help="Hashing pool size.")
+@click.option("--seconds", default=3.0, help="Duration per method.")
+def bench_password_hashing(methods, workers, seconds):
+    """Report login verifications/sec, total and per core, for each hash setting."""
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    from app.passwords import PasswordHasher
+
+    click.echo(f"{'method':<28} {'workers':>8} {'logins/s':>10} {'per core':>10} {'ms/login':>10}")
+    for method in [m for m in methods.split(",") if m]:
+        hasher = PasswordHasher(method, workers=workers, max_pending=workers * 2)
+        pwhash = hasher.hash("correct horse battery staple")
+
+        done = 0
+        deadline = time.perf_counter() + seconds
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers * 2) as clients:
+            pending = {clients.submit(hasher.verify, pwhash, "correct horse battery staple") for _ in range(workers * 2)}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += len(finished)
+                if time.perf_counter() < deadline:
+                    pending |= {clients.submit(hasher.verify, pwhash, "correct horse battery staple") for _ in finished}
+        elapsed = time.perf_counter() - started
+
+        rate = done / elapsed
+        click.echo(f"{method:<28} {workers:>8} {rate:>10.1f} {rate / workers:>10.1f} {1000 * elapsed * workers / done:>10.1f}")
+
+
+@click.command("replay-audit-dead-letters")
+@with_appcontext
+def replay_audit_dead_letters():
+    """Write audit rows that failed to insert back to the database."""
+    from app.audit import audit_writer
+
+    written, failed = audit_writer.replay_dead_letters()
+    click.echo(f"Replayed {written} audit rows, {failed} failed again")
+    if failed:
+        raise click.ClickException(f"{failed} rows are still in {audit_writer.dead_letter_path}")
+
+
+@click.command("schedule-quarters")
+@click.option("--year", type=int, help="Year to schedule; defaults to the current year.")
+@click.option("--batch-size", default=1000, help="Users per INSERT.")
+@with_appcontext
+def schedule_quarters(year, batch_size):
+    """Create Q1-Q4 verification rows for all active pensioners."""
+    from datetime import datetime
+    from app.quarters import schedule_quarters as schedule
+
+    year = year or datetime.utcnow().year
+    started = time.perf_counter()
+    created = schedule(year, batch_size=batch_size, echo=click.echo)
+    click.echo(f"Scheduled {year}: {created} rows created in {time.perf_counter() - started:.1f}s")
+
+
+@click.command("sweep-missed-quarters")
+@click.option("--date", "today", type=click.DateTime(formats=["%Y-%m-%d"]), help="Sweep as of this date; defaults to today.")
+@with_appcontext
+def sweep_missed_quarters(today):
+    """Mark overdue pending quarters as missed. Run nightly."""
+    from datetime import datetime
+    from app.quarters import sweep_missed_quarters as sweep
+
+    today = (today or datetime.utcnow()).date()
+    click.echo(f"Marked {sweep(today)} quarters missed as of {today}")
+
+
+@click.command("send-reminders")
+@click.option("--days", type=int, help="Remind about quarters due within this many days; defaults to REMINDER_DAYS_AHEAD.")
+@click.option("--chunk-size", default=1000, help="Reminders per transaction.")
+@with_appcontext
+def send_reminders(days, chunk_size):
+    """Notify pensioners whose quarter verification is due soon and queue push deliveries."""
+    from datetime import datetime
+    from app.config import app_config
+    from app.notifications import send_deadline_reminders
+
+    started = time.perf_counter()
+    sent = send_deadline_reminders(
+        datetime.utcnow().date(), days or app_config.REMINDER_DAYS_AHEAD, chunk_size=chunk_size, echo=click.echo
+    )
+    elapsed = time.perf_counter() - started
+    click.echo(f"Sent {sent} reminders in {elapsed:.1f}s ({sent / elapsed if elapsed else 0:.0f}/s)")
+
+
+@click.command("rebuild-notification-counters")
+@click.option("--chunk-size", default=1000, help="Users per transaction.")
+@with_appcontext
+def rebuild_notification_counters(chunk_size):
+    """Recount unread notifications for every user. Run once after deploying the counters."""
+    from app.notifications import rebuild_unread_counters
+
+    click.echo(f"Recounted unread notifications for {rebuild_unread_counters(chunk_size)} users")
+
+
+@click.command("dispatch-outbox")
+@click.option("--sink", "sink_name", help="Sink to deliver to; defaults to OUTBOX_SINK.")
+@click.option("--batch-size", type=int, help="Tasks per batch; defaults to OUTBOX_BATCH_SIZE.")
+@click.option("--follow", is_flag=True, help="Keep polling for new tasks.")
+@click.option("--interval", default=2.0, help="Seconds between polls with --follow.")
+@with_appcontext
+def dispatch_outbox(sink_name, batch_size, follow, interval):
+    """Deliver pending outbox tasks in batches."""
+    from app.outbox import drain, get_sink
+
+    try:
+        sink = get_sink(sink_name)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--sink")
+
+    while True:
+        delivered = drain(sink, batch_size)
+        if delivered:
+            click.echo(f"Delivered {delivered} tasks")
+        if not follow:
+            break
+        time.sleep(interval)
+
+
+@click.command("issue-certificates")
+@click.option("--quarter", required=True, help="Quarter to issue, e.g. Q1-2025.")
+@click.option("--chunk-size", default=500, help="Pensioners per transaction.")
+@with_appcontext
+def issue_certificates(quarter, chunk_size):
+    """Issue certificates for every approved submission in a quarter that has none."""
+    from app.issuance import issue_quarter_certificates
+
+    started = time.perf_counter()
+    try:
+        issued = issue_quarter_certificates(quarter, chunk_size=chunk_size, echo=click.echo)
+    except ValueError:
+        raise click.BadParameter("Expected a quarter like Q1-2025", param_hint="--quarter")
+    elapsed = time.perf_counter() - started
+    click.echo(f"Issued {issued} certificates for {quarter} in {elapsed:.1f}s ({issued / elapsed if elapsed else 0:.0f}/s)")
+
+
+@click.command("bench-certificate-signing")
+@click.option("--count", default=5000, help="Certificates per run.")
+def bench_certificate_signing(count):
+    """Report Ed25519 certificate signatures/sec and verifications/sec."""
+    from datetime import datetime
+    from types import SimpleNamespace
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from app.issuance import certificate_content, serialize_content, content_hash
+    from app.signing import CertificateSigner
+
+    signer = CertificateSigner(Ed25519PrivateKey.generate())
+    now = datetime.utcnow()
+    contents = [
+        serialize_content(certificate_content(
+            SimpleNamespace(id=i, pensioner_number=f"P{i:07d}"),
+            SimpleNamespace(firstname="Test", lastname=f"Pensioner{i}", dob=None, trn=f"{i:09d}"),
+            "Q1-2025", now
+        )).encode('utf-8')
+        for i in range(count)
+    ]
+
+    started = time.perf_counter()
+    hashes = [content_hash(c.decode('utf-8')) for c in contents]
+    hash_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    signatures = signer.sign_many(contents)
+    sign_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = signer.verify_many((c, s, signer.key_id) for c, s in zip(contents, signatures))
+    verify_seconds = time.perf_counter() - started
+
+    assert all(results) and len(hashes) == count
+    click.echo(f"{'operation':<12} {'count':>8} {'per sec':>12} {'us each':>10}")
+    for name, seconds in (("sha256", hash_seconds), ("sign", sign_seconds), ("verify", verify_seconds)):
+        click.echo(f"{name:<12} {count:>8} {count / seconds:>12.0f} {1e6 * seconds / count:>10.1f}")
+
+
+@click.command("render-certificates")
+@click.option("--quarter", required=True, help="Quarter to render, e.g. Q1-2025.")
+@click.option("--format", "fmt", type=click.Choice(["png", "pdf"]), default="pdf", help="Output format.")
+@click.option("--out", "out_dir", default="rendered-certificates", help="Output directory.")
+@click.option("--workers", type=int, default=os.cpu_count(), help="Worker processes.")
+@with_appcontext
+def render_certificates(quarter, fmt, out_dir, workers):
+    """Render a quarter's certificates to files in parallel."""
+    from app.rendering import render_quarter_certificates
+
+    started = time.perf_counter()
+    written = render_quarter_certificates(quarter, fmt, out_dir, workers=workers, echo=click.echo)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Rendered {written} certificates in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f}/s)")
+
+
+@click.command("bench-json")
+@click.option("--iterations", default=200, help="Serializations per payload.")
+@with_appcontext
+def bench_json(iterations):
+    """Compare serialization time and bytes on the wire per endpoint payload."""
+    import json
+    from datetime import datetime, timedelta
+    from flask import current_app
+    from app.compression import available_encodings, compress
+    from app.json_provider import FastJSONProvider, _default
+
+    rng = np.random.default_rng(0)
+    now = datetime.utcnow()
+    landmarks = (rng.random((478, 2)) * [640, 480]).astype(int)
+    payloads = {
+        "/detect-face": {
+            "success": True, "face_count": 1,
+            "faces": [{
+                "landmark_count": len(landmarks),
+                "landmarks": [{"x": int(x), "y": int(y)} for x, y in landmarks],
+                "bounding_box": {"x_min": 120, "y_min": 80, "x_max": 420, "y_max": 400},
+            }],
+        },
+        "/verify-images": {
+            "success": np.bool_(True), "match": np.bool_(True), "deepfake_detected": np.bool_(False),
+            "similarity": np.float32(0.734), "deepfake_score": np.float32(0.12),
+            "image_urls": [f"https://storage.googleapis.com/bucket/verification_images/{i}.jpg" for i in range(8)],
+        },
+        "/verify-id-upload": {
+            "message": "ID verification failed. Please try again or contact support.",
+            "ocr_result": " ".join(f"TOKEN{i}" for i in range(400)),
+            "name_match": False, "id_match": False, "expiry_valid": True, "id_type_detected": "national_id",
+        },
+        "/notifications": [
+            {"id": i, "type": "deadline_reminder", "message": f"Your verification for Q{i % 4 + 1}-2025 is due",
+             "sent_at": now - timedelta(hours=i), "is_read": bool(i % 3)}
+            for i in range(200)
+        ],
+    }
+
+    fast = FastJSONProvider(current_app._get_current_object())
+    encodings = available_encodings()
+    header = f"{'payload':<18} {'stdlib us':>10} {'fast us':>10} {'bytes':>8}" + "".join(f" {e:>8}" for e in encodings)
+    click.echo(header)
+    for name, payload in payloads.items():
+        timings = []
+        for dumps in (
+            lambda: json.dumps(payload, default=_default, sort_keys=True).encode(),
+            lambda: fast.dumps_bytes(payload),
+        ):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                body = dumps()
+            timings.append(1e6 * (time.perf_counter() - started) / iterations)
+        sizes = "".join(f" {len(compress(body, e)):>8}" for e in encodings)
+        click.echo(f"{name:<18} {timings[0]:>10.1f} {timings[1]:>10.1f} {len(body):>8}{sizes}")
+
+
+@click.command("check-query-plans")
+@click.option("--database-url", help="Database to seed and explain against; defaults to a temporary SQLite file.")
+@click.option("--users", default=50000, help="Users to seed.")
+@click.option("--notifications-per-user", default=10, help="Notifications seeded per user.")
+@click.option("--no-seed", is_flag=True, help="Explain against --database-url as it is.")
+@click.option("--max-cost", type=float, help="Planner cost budget per query (PostgreSQL).")
+@click.option("--max-ms", type=float, default=25.0, help="Median execution time budget per query.")
+@click.option("--verbose", is_flag=True, help="Print every plan, not only failing ones.")
+@with_appcontext
+def check_query_plans(database_url, users, notifications_per_user, no_seed, max_cost, max_ms, verbose):
+    """Seed a production-sized database and fail if a hot query plan scans or goes over budget."""
+    import tempfile
+    from flask import current_app
+    from sqlalchemy import create_engine
+    from app.queryplans import seed_database, check_plans
+
+    scratch = None
+    if not database_url:
+        scratch = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        scratch.close()
+        database_url = f"sqlite:///{scratch.name}"
+    elif not no_seed and database_url == current_app.config.get("SQLALCHEMY_DATABASE_URI"):
+        raise click.UsageError("Refusing to seed the application database; pass --no-seed to explain it as is.")
+
+    engine = create_engine(database_url)
+    try:
+        if not no_seed:
+            started = time.perf_counter()
+            seed_database(engine, users, notifications_per_user, echo=click.echo)
+            click.echo(f"Seeded {users} users in {time.perf_counter() - started:.1f}s")
+
+        results = check_plans(engine, max_cost=max_cost, max_ms=max_ms)
+    finally:
+        engine.dispose()
+        if scratch:
+            os.unlink(scratch.name)
+
+    click.echo(f"{'query':<32} {'endpoint':<34} {'cost':>10} {'ms':>8}  result")
+    for result in results:
+        cost = f"{result.cost:.1f}" if result.cost is not None else "-"
+        status = "ok" if not result.problems else "FAIL: " + "; ".join(result.problems)
+        click.echo(f"{result.name:<32} {result.endpoint:<34} {cost:>10} {result.ms:>8.2f}  {status}")
+        if verbose or result.problems:
+            for line in result.plan:
+                click.echo(f"    {line}")
+
+    failed = [result.name for result in results if result.problems]
+    if failed:
+        raise click.ClickException(f"{len(failed)} query plan(s) failed: {', '.join(failed)}")
+
+
+@click.command("profile-token")
+@click.option("--ttl", default=600, help="Seconds the token stays valid.")
+@click.option("--path", help="Only profile requests to this path, e.g. /verify-images.")
+@with_appcontext
+def profile_token(ttl, path):
+    """Print a signed X-Profile header value that profiles matching requests."""
+    from flask import current_app
+    from app.profiling import HEADER, make_profile_token
+
+    secret = current_app.config.get("PROFILE_SECRET") or current_app.config.get("SECRET_KEY")
+    if not secret:
+        raise click.ClickException("Set PROFILE_SECRET or SECRET_KEY to sign profiling tokens.")
+    click.echo(f"{HEADER}: {make_profile_token(secret, ttl, path)}")
+
+
+def register_commands(app):
+    """
+    Register the CLI commands on the Flask app.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    app.cli.add_command(bench_face_index)
+    app.cli.add_command(compact_embeddings)
+    app.cli.add_command(reverify_submissions)
+    app.cli.add_command(bench_password_hashing)
+    app.cli.add_command(replay_audit_dead_letters)
+    app.cli.add_command(schedule_quarters)
+    app.cli.add_command(sweep_missed_quarters)
+    app.cli.add_command(send_reminders)
+    app.cli.add_command(rebuild_notification_counters)
+    app.cli.add_command(dispatch_outbox)
+    app.cli.add_command(issue_certificates)
+    app.cli.add_command(bench_certificate_signing)
+    app.cli.add_command(render_certificates)
+    app.cli.add_command(bench_json)
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(profile_token)
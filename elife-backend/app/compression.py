@@ -0,0 +1,93 @@
+"""
+Negotiated response compression.
+
+Responses with a compressible content type and a body of at least COMPRESS_MIN_BYTES are
+compressed with Brotli when the client accepts it and the `brotli` package is installed,
+otherwise with gzip. Smaller bodies are sent as is, since compressing them costs more CPU
+than it saves on the wire.
+"""
+
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'image/svg+xml',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/plain',
+}
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    """
+    Args:
+        data (bytes): Body to compress.
+        encoding (str): 'br' or 'gzip'.
+        gzip_level (int): gzip compression level.
+        brotli_quality (int): Brotli quality.
+
+    Returns:
+        bytes: Compressed body.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def available_encodings():
+    """
+    Returns:
+        list: Supported encodings in order of preference.
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def init_compression(app):
+    """
+    Register the compression hook on the app.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    min_bytes = app.config.get('COMPRESS_MIN_BYTES', 1024)
+    gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+    encodings = available_encodings()
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or not 200 <= response.status_code < 300
+            or response.status_code in (204, 206)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+        ):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        if not encoding:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+
+        response.set_data(compress(data, encoding, gzip_level, brotli_quality))
+        response.headers['Content-Encoding'] = encoding
+        # The bytes differ per encoding, so only a weak validator still applies.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -10,15 +10,73 @@ class Config:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dfiojvbhuisarhfgweu8rtg7893eyt89y3w498ry98whtgufsuivbdfuygb') 
     JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', '24'))
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '0')) or None
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '0')) or None
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+    REVOCATION_REFRESH_SECONDS = float(os.getenv('REVOCATION_REFRESH_SECONDS', '5'))
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '1.0'))
+    AUDIT_WRITE_ATTEMPTS = int(os.getenv('AUDIT_WRITE_ATTEMPTS', '3'))
+    AUDIT_DEAD_LETTER_PATH = os.getenv('AUDIT_DEAD_LETTER_PATH', os.path.join(os.getcwd(), 'data', 'audit-dead-letter.jsonl'))
+    CERTIFICATE_SIGNING_KEY_PATH = os.getenv('CERTIFICATE_SIGNING_KEY_PATH', os.path.join(os.getcwd(), 'data', 'certificate-signing-key.pem'))
+    CERTIFICATE_VERIFY_KEY_PATHS = [path for path in os.getenv('CERTIFICATE_VERIFY_KEY_PATHS', '').split(',') if path]
+    CERTIFICATE_TEMPLATE_PATH = os.getenv('CERTIFICATE_TEMPLATE_PATH')
+    CERTIFICATE_RENDER_CACHE_BYTES = int(os.getenv('CERTIFICATE_RENDER_CACHE_BYTES', str(64 * 1024 * 1024)))
+    CERTIFICATE_CACHE_SIZE = int(os.getenv('CERTIFICATE_CACHE_SIZE', '10000'))
+    COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+    QUERY_STATS_ENABLED = os.getenv('QUERY_STATS_ENABLED', 'true').lower() == 'true'
+    QUERY_STATS_HEADERS = os.getenv('QUERY_STATS_HEADERS', 'false').lower() == 'true'
+    QUERY_COUNT_WARN = int(os.getenv('QUERY_COUNT_WARN', '30'))
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # /metrics is only served when set
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+    TRACE_PATH = os.getenv('TRACE_PATH', os.path.join(os.getcwd(), 'data', 'traces.jsonl'))
+    TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(100 * 1024 * 1024)))
+    TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '1000'))
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'true').lower() == 'true'
+    PROFILE_SECRET = os.getenv('PROFILE_SECRET')  # falls back to SECRET_KEY
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.getcwd(), 'data', 'profiles'))
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '50'))
+    PROFILE_SETTINGS_REFRESH_SECONDS = float(os.getenv('PROFILE_SETTINGS_REFRESH_SECONDS', '5'))
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.getenv('LOG_LEVELS', '')  # e.g. "app.views=DEBUG,sqlalchemy.engine=WARNING"
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    REMINDER_DAYS_AHEAD = int(os.getenv('REMINDER_DAYS_AHEAD', '14'))
+    OUTBOX_SINK = os.getenv('OUTBOX_SINK', 'local')
+    OUTBOX_LOCAL_PATH = os.getenv('OUTBOX_LOCAL_PATH', os.path.join(os.getcwd(), 'data', 'outbox.jsonl'))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '500'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+    IDENTITY_CACHE_TTL_SECONDS = float(os.getenv('IDENTITY_CACHE_TTL_SECONDS', '30'))
+    IDENTITY_CACHE_MAXSIZE = int(os.getenv('IDENTITY_CACHE_MAXSIZE', '10000'))
+    FACE_MATCH_COSINE_THRESHOLD = float(os.getenv('FACE_MATCH_COSINE_THRESHOLD', '0.1'))
+    FACE_MATCH_DISTANCE_THRESHOLD = float(os.getenv('FACE_MATCH_DISTANCE_THRESHOLD', '1.5'))
+    DEEPFAKE_SCORE_THRESHOLD = float(os.getenv('DEEPFAKE_SCORE_THRESHOLD', '0.5'))
+    FACE_DUPLICATE_THRESHOLD = float(os.getenv('FACE_DUPLICATE_THRESHOLD', '0.8'))
+    FACE_INDEX_NLIST = int(os.getenv('FACE_INDEX_NLIST', '0'))
+    FACE_INDEX_NPROBE = int(os.getenv('FACE_INDEX_NPROBE', '8'))
+    FACE_INDEX_MIN_TRAIN_PER_LIST = int(os.getenv('FACE_INDEX_MIN_TRAIN_PER_LIST', '39'))  # vectors per IVF partition before training
+    FACENET_MODEL_VERSION = os.getenv('FACENET_MODEL_VERSION', 'keras-facenet-0.3.2')
+    EMBEDDING_STORE_PATH = os.getenv('EMBEDDING_STORE_PATH', os.path.join(os.getcwd(), 'data', 'embeddings'))
+    EMBEDDING_STORE_DTYPE = os.getenv('EMBEDDING_STORE_DTYPE', 'float16')
 
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
+    QUERY_STATS_HEADERS = True
 
 class TestingConfig(Config):
     DEBUG = False
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    QUERY_STATS_HEADERS = True
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -0,0 +1,252 @@
+"""
+Identity resolution and session revocation for token-authenticated requests.
+
+`token_required` needs the user row and, in most handlers, its `user_details`. Both are
+loaded together in one query and a column snapshot is kept in a short-TTL, size-bounded
+cache. On a hit the snapshot is rebuilt into session-attached instances without touching
+the database, so handlers can still modify and commit them as usual.
+"""
+
+import copy
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from app import db
+from app.audit import audit_writer
+from app.bulk import dialect_insert
+from app.config import app_config
+from app.models import User, UserDetails, LoginSession, IdentityDocument, pensioner_number_key
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityCache:
+    """
+    Thread-safe TTL cache of (user columns, details columns) snapshots keyed by user id.
+
+    Args:
+        maxsize (int): Maximum number of cached users.
+        ttl (float): Seconds an entry stays valid. Bounds staleness across worker processes.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._cache.get(user_id)
+
+    def put(self, user_id, entry):
+        with self._lock:
+            self._cache[user_id] = entry
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+identity_cache = IdentityCache(app_config.IDENTITY_CACHE_MAXSIZE, app_config.IDENTITY_CACHE_TTL_SECONDS)
+
+
+def _snapshot(instance):
+    return {attr.key: copy.deepcopy(getattr(instance, attr.key)) for attr in inspect(type(instance)).column_attrs}
+
+
+def _attach(model, columns):
+    """Turn a column snapshot into a persistent instance in the current session, without a query."""
+    existing = db.session.identity_map.get(identity_key(model, columns['id']))
+    if existing is not None:
+        return existing
+    instance = model(**copy.deepcopy(columns))
+    make_transient_to_detached(instance)
+    db.session.add(instance)
+    return instance
+
+
+def resolve_identity(user_id):
+    """
+    Load a user and its details for the current request.
+
+    Args:
+        user_id (int): Id from the JWT payload.
+
+    Returns:
+        User or None: Session-attached user with `user_details` already populated.
+    """
+    entry = identity_cache.get(user_id)
+    if entry is not None:
+        user_columns, details_columns = entry
+        user = _attach(User, user_columns)
+        details = _attach(UserDetails, details_columns) if details_columns else None
+        set_committed_value(user, 'user_details', details)
+        if details is not None:
+            set_committed_value(details, 'user', user)
+        return user
+
+    user = User.query.options(joinedload(User.user_details)).filter_by(id=user_id).first()
+    if user is not None:
+        details = user.user_details
+        identity_cache.put(user_id, (_snapshot(user), _snapshot(details) if details else None))
+    return user
+
+
+def invalidate_identity(user_id):
+    """
+    Drop a cached identity. Call after committing changes to a user's profile,
+    permissions, status or password.
+
+    Args:
+        user_id (int): User whose cached row is stale.
+    """
+    identity_cache.invalidate(user_id)
+
+
+def login_query(pensioner_number):
+    """
+    Args:
+        pensioner_number (str): Number as entered at login, with dashes and whitespace removed.
+
+    Returns:
+        Select: The matching user, found through `ix_users_pensioner_number_key`.
+    """
+    return select(User).where(pensioner_number_key(User.pensioner_number) == pensioner_number).limit(1)
+
+
+def latest_identity_document_query(user_id):
+    """
+    Args:
+        user_id (int): Document owner.
+
+    Returns:
+        Select: The user's most recently uploaded identity document.
+    """
+    return select(IdentityDocument).where(
+        IdentityDocument.user_id == user_id
+    ).order_by(IdentityDocument.id.desc()).limit(1)
+
+
+class RevocationFilter:
+    """
+    In-memory set of logged-out session ids, refreshed incrementally from `login_sessions`.
+
+    A token can only be valid for JWT_EXPIRATION_HOURS after its session started, so
+    sessions closed longer ago than that are pruned and the set stays small. Logouts in
+    other worker processes become visible within `refresh_seconds`.
+
+    Args:
+        refresh_seconds (float): Minimum interval between database refreshes.
+        retention (timedelta): How long a closed session stays in the set.
+        slack (timedelta): Overlap applied to the refresh watermark to tolerate clock skew
+            and late commits between app servers.
+    """
+
+    def __init__(self, refresh_seconds, retention, slack=timedelta(seconds=60)):
+        self.refresh_seconds = refresh_seconds
+        self.retention = retention
+        self.slack = slack
+        self._revoked = {}
+        self._watermark = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def revoke(self, session_id, logout_time=None):
+        """
+        Record a logout made by this process.
+
+        Args:
+            session_id (str): LoginSession token id.
+            logout_time (datetime, optional): Defaults to now.
+        """
+        with self._lock:
+            self._revoked[session_id] = logout_time or datetime.utcnow()
+
+    def is_revoked(self, session_id):
+        """
+        Args:
+            session_id (str): Session id from the token.
+
+        Returns:
+            bool: True if the session has been logged out.
+        """
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        return session_id in self._revoked
+
+    def refresh(self):
+        """Load sessions closed since the last refresh. Concurrent callers skip the refresh."""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = datetime.utcnow()
+            since = self._watermark - self.slack if self._watermark else now - self.retention
+            rows = db.session.execute(
+                select(LoginSession.token_id, LoginSession.logout_time).where(
+                    LoginSession.logout_time >= since,
+                    LoginSession.token_id.isnot(None)
+                )
+            ).all()
+
+            horizon = now - self.retention
+            self._revoked = {sid: at for sid, at in self._revoked.items() if at >= horizon}
+            for session_id, logout_time in rows:
+                self._revoked[session_id] = logout_time
+                if self._watermark is None or logout_time > self._watermark:
+                    self._watermark = logout_time
+            if self._watermark is None:
+                self._watermark = since
+        except Exception:
+            logger.exception("Failed to refresh session revocations")
+            # On PostgreSQL a failed statement aborts the transaction; without a rollback
+            # every later query in this request would fail too.
+            db.session.rollback()
+        finally:
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+            self._lock.release()
+
+
+revocations = RevocationFilter(
+    app_config.REVOCATION_REFRESH_SECONDS,
+    timedelta(hours=app_config.JWT_EXPIRATION_HOURS)
+)
+
+# The login row is buffered, so a logout can reach the database first. Whichever write comes
+# second fills in its own columns on the same token_id row.
+audit_writer.register_conflict_key(LoginSession, ['token_id'], ['login_time', 'ip_address', 'user_agent'])
+
+
+def end_session(session_id, user_id, logout_time=None):
+    """
+    Close a login session and revoke its tokens, whether or not its buffered login row has
+    been written yet. Commits the current session.
+
+    The row is upserted by token_id with logout_time set, so the logout is durable in the
+    database straight away and other workers pick it up on their next revocation refresh.
+
+    Args:
+        session_id (str): LoginSession token id from the JWT.
+        user_id (int): Owner of the session.
+        logout_time (datetime, optional): Defaults to now.
+    """
+    logout_time = logout_time or datetime.utcnow()
+    stmt = dialect_insert(db.session, LoginSession).values(
+        token_id=session_id, user_id=user_id, login_time=logout_time, logout_time=logout_time
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['token_id'],
+        set_={'logout_time': stmt.excluded.logout_time},
+        where=LoginSession.logout_time.is_(None)
+    ))
+    db.session.commit()
+    revocations.revoke(session_id, logout_time)
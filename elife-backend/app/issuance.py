@@ -0,0 +1,456 @@
+"""
+Digital certificate issuance.
+
+A certificate is issued at most once per approved proof submission, enforced by
+`uq_certificate_proof_submission`. Issuing is a single INSERT ... ON CONFLICT DO NOTHING plus
+an upsert of the quarter row, in the caller's transaction, so concurrent retries neither
+fail nor duplicate rows.
+
+`issue_quarter_certificates` issues a whole quarter in chunks: each chunk's snapshots and
+hashes are built in memory and written with one multi-row INSERT and one quarter upsert.
+
+Each certificate is signed with Ed25519 (see `app.signing`); its SHA-256 remains the public
+lookup key. Certificates never change once issued, so parsed snapshots and public verification views
+are kept in process-local LRU caches.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+from datetime import datetime
+
+from cachetools import LRUCache
+from sqlalchemy import and_, exists, select, tuple_
+
+from app import db
+from app.bulk import dialect_insert
+from app.config import app_config
+from app.models import User, UserDetails, ProofSubmission, DigitalCertificate
+from app.quarters import complete_quarters, upsert_quarter_verification
+from app.signing import get_signer
+from app.utils import decode_cursor, quarter_date_range
+
+logger = logging.getLogger(__name__)
+
+
+def current_quarter(now=None):
+    """
+    Args:
+        now (datetime, optional): Defaults to the current UTC time.
+
+    Returns:
+        str: Quarter in 'Q1-2025' format.
+    """
+    now = now or datetime.utcnow()
+    return f"Q{(now.month - 1) // 3 + 1}-{now.year}"
+
+
+def parse_quarter(quarter):
+    """
+    Args:
+        quarter (str): Quarter in 'Q1-2025' format.
+
+    Returns:
+        tuple: (quarter_num, year), or (None, None) if the string is malformed.
+    """
+    try:
+        quarter_num, year = quarter.split('-')
+        return quarter_num, int(year)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def certificate_content(user, user_details, quarter, issued_at=None):
+    """
+    Build the snapshot stored with a certificate.
+
+    Args:
+        user (User): Certificate holder.
+        user_details (UserDetails): Holder's profile.
+        quarter (str): Quarter in 'Q1-2025' format.
+        issued_at (datetime, optional): Defaults to now.
+
+    Returns:
+        dict: Certificate content.
+    """
+    return {
+        "pensioner_number": user.pensioner_number,
+        "user_id": user.id,
+        "fullName": f"{user_details.firstname} {user_details.lastname}",
+        "dob": user_details.dob.strftime('%Y-%m-%d') if user_details.dob else None,
+        "trn": user_details.trn,
+        "verification_method": "Facial Recognition & ID Verification",
+        "quarter": quarter,
+        "issue_date": (issued_at or datetime.utcnow()).isoformat(),
+        "expiry_date": None
+    }
+
+
+def serialize_content(content):
+    """
+    Args:
+        content (dict): Certificate content.
+
+    Returns:
+        str: Canonical JSON text (sorted keys, no whitespace) that is stored, hashed and
+        signed as UTF-8.
+    """
+    return json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def content_hash(content_str):
+    """
+    Args:
+        content_str (str): Serialized certificate content.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    return hashlib.sha256(content_str.encode('utf-8')).hexdigest()
+
+
+def certificate_values(user, user_details, proof_submission_id, quarter, issued_at):
+    """
+    Column values for a new certificate row.
+
+    Args:
+        user: User, or any row with `id` and `pensioner_number`.
+        user_details: UserDetails, or any row with the profile fields used in the snapshot.
+        proof_submission_id (int): Approved submission the certificate is for.
+        quarter (str): Quarter in 'Q1-2025' format.
+        issued_at (datetime): Issue time.
+
+    Returns:
+        dict: Values for `digital_certificates`.
+    """
+    content_str = serialize_content(certificate_content(user, user_details, quarter, issued_at))
+    signature, key_id = get_signer().sign(content_str.encode('utf-8'))
+    return {
+        'user_id': user.id,
+        'proof_submission_id': proof_submission_id,
+        'certificate_filename': f"certificate_{user.id}_{quarter}.json",
+        'content_snapshot': content_str,
+        'digital_signature_hash': content_hash(content_str),
+        'signature': signature,
+        'key_id': key_id,
+        'quarter': quarter,
+        'timestamp': issued_at
+    }
+
+
+def latest_approved_submission_query(user_id):
+    """
+    Args:
+        user_id (int): Submission owner.
+
+    Returns:
+        Select: The user's most recently verified approved proof submission.
+    """
+    return select(ProofSubmission).where(
+        ProofSubmission.user_id == user_id, ProofSubmission.status == 'approved'
+    ).order_by(ProofSubmission.verified_at.desc()).limit(1)
+
+
+def certificate_for_submission_query(proof_submission_id):
+    """
+    Args:
+        proof_submission_id (int): Submission the certificate was issued for.
+
+    Returns:
+        Select: The certificate on `uq_certificate_proof_submission`, if any.
+    """
+    return select(DigitalCertificate).where(DigitalCertificate.proof_submission_id == proof_submission_id)
+
+
+def issue_certificate(user, user_details, proof_submission, quarter):
+    """
+    Insert the certificate for a proof submission and mark its quarter completed.
+
+    Does not commit; the caller owns the transaction.
+
+    Args:
+        user (User): Certificate holder.
+        user_details (UserDetails): Holder's profile.
+        proof_submission (ProofSubmission): Approved submission the certificate is for.
+        quarter (str): Quarter in 'Q1-2025' format.
+
+    Returns:
+        tuple: (DigitalCertificate, created). `created` is False when a certificate for the
+        submission already existed, e.g. from a concurrent retry.
+
+    Raises:
+        ValueError: If the quarter string is malformed.
+    """
+    quarter_num, year = parse_quarter(quarter)
+    if not quarter_num:
+        raise ValueError(f"Invalid quarter: {quarter}")
+
+    now = datetime.utcnow()
+    connection = db.session.connection()
+
+    certificate_id = connection.execute(
+        dialect_insert(connection, DigitalCertificate).values(
+            **certificate_values(user, user_details, proof_submission.id, quarter, now)
+        ).on_conflict_do_nothing(
+            index_elements=['proof_submission_id']
+        ).returning(DigitalCertificate.id)
+    ).scalar()
+
+    created = certificate_id is not None
+    if created:
+        upsert_quarter_verification(
+            user.id, quarter_num, year, 'completed',
+            proof_submission_id=proof_submission.id, verified_at=now
+        )
+        certificate = db.session.get(DigitalCertificate, certificate_id)
+    else:
+        certificate = db.session.execute(certificate_for_submission_query(proof_submission.id)).scalar_one()
+    return certificate, created
+
+
+def issue_quarter_certificates(quarter, chunk_size=500, echo=None):
+    """
+    Issue certificates for every pensioner with an approved submission in the quarter and
+    no certificate for it yet.
+
+    Users are walked in id order, `chunk_size` per transaction. Each user's most recently
+    verified submission in the quarter that has no certificate yet is used. Re-running the
+    job only picks up users it has not issued for.
+
+    Args:
+        quarter (str): Quarter in 'Q1-2025' format.
+        chunk_size (int): Users per transaction.
+        echo (callable, optional): Progress callback taking a message string.
+
+    Returns:
+        int: Number of certificates issued.
+
+    Raises:
+        ValueError: If the quarter string is malformed.
+    """
+    quarter_num, year = parse_quarter(quarter)
+    if not quarter_num:
+        raise ValueError(f"Invalid quarter: {quarter}")
+    start, end = quarter_date_range(quarter)
+
+    # A submission can back only one certificate. One that already has a certificate under
+    # another quarter label would be skipped on conflict on every run, so leave it out.
+    has_certificate = exists().where(DigitalCertificate.proof_submission_id == ProofSubmission.id)
+    in_quarter = and_(
+        ProofSubmission.status == 'approved',
+        ProofSubmission.verified_at >= start,
+        ProofSubmission.verified_at < end,
+        ~has_certificate
+    )
+    already_issued = exists().where(
+        DigitalCertificate.user_id == ProofSubmission.user_id,
+        DigitalCertificate.quarter == quarter
+    )
+
+    issued = 0
+    conflicts = 0
+    last_user_id = 0
+    while True:
+        user_ids = db.session.execute(
+            select(ProofSubmission.user_id).where(
+                in_quarter, ProofSubmission.user_id > last_user_id, ~already_issued
+            ).group_by(ProofSubmission.user_id).order_by(ProofSubmission.user_id).limit(chunk_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        candidates = db.session.execute(
+            select(
+                User.id, User.pensioner_number,
+                UserDetails.firstname, UserDetails.lastname, UserDetails.dob, UserDetails.trn,
+                ProofSubmission.id.label('proof_submission_id')
+            ).join(
+                UserDetails, UserDetails.user_id == User.id
+            ).join(
+                ProofSubmission, ProofSubmission.user_id == User.id
+            ).where(
+                User.id.in_(user_ids), in_quarter
+            ).order_by(User.id, ProofSubmission.verified_at.desc(), ProofSubmission.id.desc())
+        ).all()
+
+        now = datetime.utcnow()
+        rows = {}
+        for candidate in candidates:
+            if candidate.id not in rows:
+                rows[candidate.id] = certificate_values(
+                    candidate, candidate, candidate.proof_submission_id, quarter, now
+                )
+
+        if rows:
+            connection = db.session.connection()
+            inserted = connection.execute(
+                dialect_insert(connection, DigitalCertificate).on_conflict_do_nothing(
+                    index_elements=['proof_submission_id']
+                ).returning(DigitalCertificate.user_id, DigitalCertificate.proof_submission_id),
+                list(rows.values())
+            ).all()
+            complete_quarters([tuple(row) for row in inserted], quarter_num, year, now)
+            issued += len(inserted)
+            conflicts += len(rows) - len(inserted)
+        db.session.commit()
+
+        if echo:
+            echo(f"Issued {issued} certificates (through user {last_user_id})")
+
+    if conflicts:
+        # Certificates issued concurrently for the same submissions, e.g. by /generate-certificate.
+        logger.warning("Skipped %d submissions that already had a certificate", conflicts)
+        if echo:
+            echo(f"Skipped {conflicts} submissions that already had a certificate")
+    return issued
+
+
+# =======================
+# Verification
+# =======================
+
+SIGNATURE_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+_cache_lock = threading.Lock()
+_snapshot_cache = LRUCache(maxsize=app_config.CERTIFICATE_CACHE_SIZE)
+_verification_cache = LRUCache(maxsize=app_config.CERTIFICATE_CACHE_SIZE)
+
+
+def parsed_snapshot(certificate_id, content_snapshot):
+    """
+    Parse a certificate's stored snapshot, caching the result by certificate id.
+
+    Args:
+        certificate_id (int): Certificate the snapshot belongs to.
+        content_snapshot (str): Stored JSON text.
+
+    Returns:
+        dict or str or None: Parsed content, the raw text if it is not valid JSON, or None.
+    """
+    if not content_snapshot:
+        return None
+    with _cache_lock:
+        cached = _snapshot_cache.get(certificate_id)
+    if cached is not None:
+        return cached
+    try:
+        parsed = json.loads(content_snapshot)
+    except ValueError:
+        parsed = content_snapshot
+    with _cache_lock:
+        _snapshot_cache[certificate_id] = parsed
+    return parsed
+
+
+def certificate_history_query(user_id, since, limit, cursor=None):
+    """
+    Args:
+        user_id (int): Certificate holder.
+        since (datetime): Oldest issue time to include.
+        limit (int): Page size; one extra row is fetched to detect a next page.
+        cursor (str, optional): Cursor returned with the previous page.
+
+    Returns:
+        Select: One page of the user's certificates, newest first, on
+        `ix_digital_certificates_user_timestamp`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query = select(
+        DigitalCertificate.id, DigitalCertificate.timestamp, DigitalCertificate.quarter
+    ).where(
+        DigitalCertificate.user_id == user_id,
+        DigitalCertificate.timestamp >= since
+    ).order_by(
+        DigitalCertificate.timestamp.desc(), DigitalCertificate.id.desc()
+    ).limit(limit + 1)
+
+    if cursor:
+        query = query.where(tuple_(DigitalCertificate.timestamp, DigitalCertificate.id) < decode_cursor(cursor))
+    return query
+
+
+def certificates_by_hash_query(signature_hashes):
+    """
+    Args:
+        signature_hashes (Iterable[str]): Hashes printed on the certificates.
+
+    Returns:
+        Select: Columns needed to verify each matching certificate.
+    """
+    return select(
+        DigitalCertificate.id, DigitalCertificate.quarter, DigitalCertificate.timestamp,
+        DigitalCertificate.content_snapshot, DigitalCertificate.digital_signature_hash,
+        DigitalCertificate.signature, DigitalCertificate.key_id
+    ).where(DigitalCertificate.digital_signature_hash.in_(list(signature_hashes)))
+
+
+def verify_certificate_hashes(signature_hashes):
+    """
+    Look up certificates by signature hash and check each against its stored content and
+    Ed25519 signature. Cache misses are loaded with one query.
+
+    Args:
+        signature_hashes (Iterable[str]): Hashes printed on the certificates.
+
+    Returns:
+        dict: hash -> minimal public view; hashes with no certificate are left out.
+    """
+    views = {}
+    missing = []
+    with _cache_lock:
+        for signature_hash in set(signature_hashes):
+            cached = _verification_cache.get(signature_hash)
+            if cached is not None:
+                views[signature_hash] = cached
+            else:
+                missing.append(signature_hash)
+    if not missing:
+        return views
+
+    certificates = db.session.execute(certificates_by_hash_query(missing)).all()
+
+    signed = [c for c in certificates if c.signature and c.content_snapshot]
+    signature_ok = dict(zip(
+        [c.id for c in signed],
+        get_signer().verify_many((c.content_snapshot.encode(), c.signature, c.key_id) for c in signed)
+    ))
+
+    loaded = {}
+    for certificate in certificates:
+        content = parsed_snapshot(certificate.id, certificate.content_snapshot)
+        if not isinstance(content, dict):
+            content = {}
+        hash_ok = bool(certificate.content_snapshot) and \
+            content_hash(certificate.content_snapshot) == certificate.digital_signature_hash
+        loaded[certificate.digital_signature_hash] = {
+            "valid": hash_ok and signature_ok.get(certificate.id, not certificate.signature),
+            "signed": bool(certificate.signature),
+            "key_id": certificate.key_id,
+            "certificate_id": certificate.id,
+            "quarter": certificate.quarter,
+            "issued_at": certificate.timestamp.isoformat() if certificate.timestamp else None,
+            "holder": content.get("fullName"),
+            "pensioner_number": content.get("pensioner_number"),
+            "verification_method": content.get("verification_method")
+        }
+
+    with _cache_lock:
+        _verification_cache.update(loaded)
+    views.update(loaded)
+    return views
+
+
+def verify_certificate_hash(signature_hash):
+    """
+    Args:
+        signature_hash (str): Hash printed on the certificate.
+
+    Returns:
+        dict or None: Minimal public view of the certificate, or None if there is none.
+    """
+    return verify_certificate_hashes([signature_hash]).get(signature_hash)
@@ -0,0 +1,92 @@
+"""
+JSON provider used for every response and request body.
+
+Uses orjson when it is installed and falls back to the standard library otherwise. Both
+paths serialize NumPy scalars and arrays, datetimes (ISO 8601), dates, Decimals, UUIDs and
+sets, so handlers can return model outputs without casting them first.
+"""
+
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime, time
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(obj):
+    """Convert values neither serializer handles natively."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Drop-in replacement for Flask's provider. `sort_keys` and the debug-mode pretty
+    printing behave as in the default provider.
+    """
+
+    def _orjson_options(self, indent=False):
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        """
+        Args:
+            obj: Value to serialize.
+            indent (bool): Pretty-print with two-space indentation.
+
+        Returns:
+            bytes: UTF-8 JSON.
+        """
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=self._orjson_options(indent))
+        return json.dumps(
+            obj, default=_default, sort_keys=self.sort_keys, ensure_ascii=False,
+            indent=2 if indent else None, separators=None if indent else (',', ':')
+        ).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = self.dumps_bytes(obj, indent=indent)
+        return self._app.response_class(body + b"\n" if indent else body, mimetype=self.mimetype)
@@ -0,0 +1,210 @@
+"""
+Structured, non-blocking logging.
+
+Handlers never write from the request thread. `init_logging` puts a single QueueHandler on
+the root logger, and a QueueListener thread does the formatting and output. When the
+queue is full, records are dropped and counted rather than blocking the request.
+
+Each record is written as one JSON object: its message, logger name, level, the trace id
+of the request when tracing, and any `extra={...}` fields. Before a record is queued, PII
+fields (names, pensioner numbers, OCR text, tokens, ID numbers) are replaced, and emails and
+JWTs are masked inside the message text. Pensioner numbers and user names become a short
+stable fingerprint, so one person's events can still be correlated.
+
+Levels are set per logger with LOG_LEVELS, e.g. "app.views=DEBUG,sqlalchemy.engine=WARNING",
+on top of LOG_LEVEL for everything else.
+"""
+
+import atexit
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+from datetime import datetime, timezone
+
+from app.tracing import current_trace
+
+REDACTED = '[redacted]'
+
+# Dropped entirely.
+PII_FIELDS = {
+    'password', 'token', 'authorization', 'ocr_text', 'extracted_text', 'tokens', 'normalized_text',
+    'firstname', 'lastname', 'full_name', 'dob', 'trn', 'nids_num', 'passport_num', 'address',
+    'contact_num', 'email', 'id_number',
+}
+# Replaced by a fingerprint so events for one person can still be grouped.
+FINGERPRINT_FIELDS = {'pensioner_number', 'username'}
+
+_EMAIL = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+_JWT = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+')
+
+# Keyed so fingerprints of short identifiers cannot be reversed by brute force; set from
+# SECRET_KEY by init_logging.
+_fingerprint_key = os.urandom(32)
+
+# Attributes every LogRecord has; anything else came from `extra`.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'trace_id'}
+
+
+def fingerprint(value):
+    """
+    Args:
+        value: Identifier to mask.
+
+    Returns:
+        str: Short stable hash of the value.
+    """
+    return 'fp:' + hmac.new(_fingerprint_key, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+
+def scrub(text):
+    """
+    Args:
+        text (str): Free-form message.
+
+    Returns:
+        str: The text with emails and JWTs masked.
+    """
+    return _JWT.sub(REDACTED, _EMAIL.sub(REDACTED, text))
+
+
+class RedactingFilter(logging.Filter):
+    """Replaces PII `extra` fields and masks emails and JWTs in the message."""
+
+    def filter(self, record):
+        for key in list(vars(record)):
+            if key in PII_FIELDS:
+                setattr(record, key, REDACTED)
+            elif key in FINGERPRINT_FIELDS and getattr(record, key) is not None:
+                setattr(record, key, fingerprint(getattr(record, key)))
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'trace_id', None):
+            entry['trace_id'] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full, and restarts its listener in a
+    forked worker.
+    """
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._handlers = handlers
+        self._listener = None
+        self._pid = None
+        self.addFilter(RedactingFilter())
+        self.start()
+
+    def start(self):
+        self._listener = logging.handlers.QueueListener(self.queue, *self._handlers, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            try:
+                self._listener.stop()
+            except queue.Full:
+                pass  # no room for the stop sentinel; the daemon thread exits with the process
+            self._listener = None
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, since args and exc_info may not survive
+        # the hand-off, but leave the JSON formatting to the listener thread.
+        record = copy.copy(record)
+        record.msg = scrub(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        trace = current_trace()
+        record.trace_id = trace.trace_id if trace is not None else None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            # Threads do not survive fork; each worker needs its own listener.
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(spec):
+    """
+    Args:
+        spec (str): Comma-separated logger=LEVEL pairs.
+
+    Returns:
+        dict: Logger name -> level name.
+    """
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def init_logging(app):
+    """
+    Route all logging through the background queue and apply the configured levels.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    global _fingerprint_key
+    if app.config.get('SECRET_KEY'):
+        _fingerprint_key = hashlib.sha256(b'log-fingerprint:' + app.config['SECRET_KEY'].encode('utf-8')).digest()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            return  # already set up, e.g. a second app in the same process
+
+    output = logging.StreamHandler(sys.stdout)
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000)), [output])
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(app.config.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    # Flask's app.logger propagates to the root handler instead of writing directly.
+    app.logger.handlers.clear()
+    atexit.register(handler.stop)
@@ -0,0 +1,243 @@
+"""
+In-process latency histograms and outcome counters, exported in the Prometheus text format.
+
+Every request is timed by endpoint, method and status. The verification endpoints also time
+each pipeline stage with `stage()` (decode, Haar detection, deepfake inference, OCR,
+FaceNet, storage, database) and count outcomes with `outcome()`. Recording one observation
+costs a lock and a bisect, so collection stays on in production. Metrics live in the
+process that recorded them: with several workers, scrape each one or aggregate in
+Prometheus.
+"""
+
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, abort, has_request_context, request
+
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        labelnames (tuple): Label names, passed to `inc` as keyword arguments.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        """
+        Returns:
+            list: Exposition lines for every label set.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        labelnames (tuple): Label names, passed to `observe` as keyword arguments.
+        buckets (tuple): Upper bounds, ascending; +Inf is added.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        """
+        Returns:
+            list: Exposition lines (_bucket, _sum, _count) for every label set.
+        """
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'elife_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method', 'status')
+)
+REQUEST_DB_SECONDS = Histogram(
+    'elife_request_db_seconds', 'Time spent in database queries per request.', ('endpoint',)
+)
+STAGE_SECONDS = Histogram(
+    'elife_verification_stage_seconds', 'Verification pipeline latency by stage.', ('endpoint', 'stage')
+)
+OUTCOMES = Counter(
+    'elife_verification_outcomes_total', 'Verification results by outcome.', ('endpoint', 'outcome')
+)
+
+REGISTRY = [REQUEST_SECONDS, REQUEST_DB_SECONDS, STAGE_SECONDS, OUTCOMES]
+
+
+def _endpoint():
+    # Work done outside a request (batch re-verification, CLI jobs) is grouped as 'batch'.
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'batch'
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Time the block as one verification pipeline stage of the current endpoint. The block
+    is also traced as a span carrying `attributes`.
+
+    Args:
+        name (str): Stage name, e.g. 'ocr' or 'facenet'.
+        **attributes: Span attributes, e.g. image size or batch size.
+
+    Yields:
+        Span: The stage's trace span, for adding attributes.
+    """
+    started = time.perf_counter()
+    try:
+        with span(name, **attributes) as current:
+            yield current
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, endpoint=_endpoint(), stage=name)
+
+
+def outcome(name):
+    """
+    Count one verification outcome for the current endpoint.
+
+    Args:
+        name (str): Outcome, e.g. 'deepfake_rejected' or 'name_mismatch'.
+    """
+    OUTCOMES.inc(endpoint=_endpoint(), outcome=name)
+
+
+def render_metrics(registry=REGISTRY):
+    """
+    Args:
+        registry (list): Metrics to export.
+
+    Returns:
+        str: Prometheus text exposition.
+    """
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """
+    Time every request and serve GET /metrics.
+
+    Scrapes must send METRICS_TOKEN as a bearer token. The endpoint exposes traffic and
+    verification outcomes per endpoint, so it is not registered when no token is set.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.before_request
+    def _start_request_timer():
+        request.environ['app.metrics_start'] = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = request.environ.get('app.metrics_start')
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started, endpoint=endpoint, method=request.method, status=response.status_code
+        )
+        # Recorded by app.querystats for the same request, when enabled.
+        stats, _ = request.environ.get('app.query_stats', (None, None))
+        if stats is not None:
+            REQUEST_DB_SECONDS.observe(stats.seconds, endpoint=endpoint)
+        return response
+
+    if not token:
+        logger.warning("METRICS_TOKEN is not set; /metrics is disabled")
+        return
+
+    def metrics():
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
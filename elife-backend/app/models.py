@@ -1,8 +1,9 @@
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.passwords import password_hasher
 from datetime import datetime
 from enum import Enum
+from sqlalchemy import func, literal_column
 from sqlalchemy.dialects.postgresql import JSON
 
 class ProofStatus(Enum):
@@ -11,6 +12,12 @@ class ProofStatus(Enum):
     FLAGGED = 'flagged'
 
 
+def pensioner_number_key(column):
+    """Pensioner number with dashes and surrounding whitespace removed, as used at login."""
+    # Constants are inlined rather than bound so queries match the expression index text.
+    return func.trim(func.replace(column, literal_column("'-'"), literal_column("''")))
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -23,6 +30,7 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     terms_accepted = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)  
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     permissions = db.Column(JSON, default=lambda: ["view_certificate"])  
 
@@ -33,11 +41,19 @@ class User(UserMixin, db.Model):
     certificates = db.relationship('DigitalCertificate', backref='user', lazy=True, cascade='all, delete-orphan')
     identity_documents = db.relationship('IdentityDocument', backref='user', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # Expression index so login can match "123-456" against "123456" without a scan.
+        db.Index('ix_users_pensioner_number_key', pensioner_number_key(pensioner_number)),
+    )
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -56,6 +72,7 @@ class UserDetails(db.Model):
     passport_num = db.Column(db.String(50))
     contact_num = db.Column(db.String(20))
     address = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<UserDetails for {self.user_id}>'
@@ -73,8 +90,17 @@ class ProofSubmission(db.Model):
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     verified_at = db.Column(db.DateTime)
     notes = db.Column(db.Text)  
+    similarity_score = db.Column(db.Float)
+    face_distance = db.Column(db.Float)
+    deepfake_score = db.Column(db.Float)
+    scored_at = db.Column(db.DateTime)
     
     certificate = db.relationship('DigitalCertificate', backref='proof_submission', uselist=False)
+
+    __table_args__ = (
+        db.Index('ix_proof_submissions_status_verified', 'status', 'verified_at', 'user_id'),
+        db.Index('ix_proof_submissions_user_status_verified', 'user_id', 'status', 'verified_at'),
+    )
     
     def __repr__(self):
         return f'<ProofSubmission {self.id} by User {self.user_id}>'
@@ -90,7 +116,15 @@ class DigitalCertificate(db.Model):
     content_snapshot = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     digital_signature_hash = db.Column(db.String(512))
+    signature = db.Column(db.String(128))  # Ed25519 over content_snapshot, URL-safe base64
+    key_id = db.Column(db.String(16))
     quarter = db.Column(db.String(20)) 
+
+    __table_args__ = (
+        db.Index('ix_digital_certificates_user_timestamp', 'user_id', 'timestamp', 'id'),
+        db.UniqueConstraint('proof_submission_id', name='uq_certificate_proof_submission'),
+        db.Index('ix_digital_certificates_signature_hash', 'digital_signature_hash'),
+    )
     
     def __repr__(self):
         return f'<Certificate {self.id} for User {self.user_id}>'
@@ -106,13 +140,46 @@ class Notification(db.Model):
     target_quarter = db.Column(db.String(20))  
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
-      
 
+    __table_args__ = (
+        db.Index('ix_notifications_user_sent_id', 'user_id', 'sent_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<Notification {self.id} for User {self.user_id}>'
 
 
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    unread = db.Column(db.Integer, default=0, nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)  # bumped on every change to the user's notifications
+
+    def __repr__(self):
+        return f'<NotificationCounter {self.unread} unread for User {self.user_id}>'
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox_messages'
+
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)  # e.g. 'push'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    dispatched_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_outbox_messages_pending', 'dispatched_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} ({self.topic})>'
+
+
 class IdentityDocument(db.Model):
     __tablename__ = 'identity_documents'
 
@@ -123,6 +190,10 @@ class IdentityDocument(db.Model):
     image_url = db.Column(db.String(255))
     issue_date = db.Column(db.Date)
     expiry_date = db.Column(db.Date)
+
+    __table_args__ = (
+        db.Index('ix_identity_documents_user_id', 'user_id', 'id'),
+    )
     
     def __repr__(self):
         return f'<IdentityDocument {self.id} ({self.type}) for User {self.user_id}>'
@@ -132,6 +203,7 @@ class LoginSession(db.Model):
     __tablename__ = 'login_sessions'
     
     id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.String(32), unique=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     login_time = db.Column(db.DateTime, default=datetime.utcnow)
     logout_time = db.Column(db.DateTime)
@@ -139,6 +211,10 @@ class LoginSession(db.Model):
     user_agent = db.Column(db.String(255))
     
     user = db.relationship('User', backref=db.backref('login_sessions', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_login_sessions_logout_time', 'logout_time'),
+    )
     
     def __repr__(self):
         return f'<LoginSession {self.id} for User {self.user_id}>'
@@ -160,7 +236,29 @@ class QuarterVerification(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'quarter', 'year', name='uq_user_quarter_year'),
+        db.Index('ix_quarter_verifications_user_year_due', 'user_id', 'year', 'due_date'),
+        db.Index('ix_quarter_verifications_status_due', 'status', 'due_date', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<QuarterVerification {self.quarter}-{self.year} for User {self.user_id}>'
+
+
+class QuarterSummary(db.Model):
+    __tablename__ = 'quarter_summaries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    as_of = db.Column(db.Date)  # day the quarters were classified for; NULL means stale
+    active = db.Column(db.Boolean, default=True)
+    payload = db.Column(db.Text)  # JSON with current, upcoming, completed and missed entries
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year', name='uq_quarter_summary_user_year'),
     )
 
     def __repr__(self):
-        return f'<QuarterVerification {self.quarter}-{self.year} for User {self.user_id}>'
\ No newline at end of file
+        return f'<QuarterSummary {self.year} for User {self.user_id}>'
\ No newline at end of file
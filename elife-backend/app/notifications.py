@@ -0,0 +1,350 @@
+"""
+Notification reads, bulk mark-read and the per-user unread counter.
+
+`notification_counters` keeps one row per user with the unread count and a version that
+changes whenever the user's notifications do. ORM writes are counted after each flush;
+bulk statements call `adjust_unread` themselves.
+
+Deadline reminders are fanned out in chunks: each chunk's notifications, counter updates and
+push tasks are written in one transaction.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, cast, event, exists, func, insert, inspect, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.audit import audit_writer
+from app.bulk import dialect_insert
+from app.models import User, Notification, NotificationCounter, QuarterVerification
+from app.outbox import enqueue
+from app.utils import encode_cursor, decode_cursor
+
+
+# =======================
+# Unread counter
+# =======================
+
+def adjust_unread(connection, deltas):
+    """
+    Apply unread-count changes and bump the counter versions.
+
+    Missing counter rows are first created at zero, then every user in `deltas` gets the
+    same relative UPDATE. The seed never counts notifications, so it cannot miss rows
+    that a concurrent transaction has not committed yet. Counters for notifications that
+    predate the table are filled in once by `rebuild_unread_counters`.
+
+    Args:
+        connection: SQLAlchemy connection or session.
+        deltas (dict): user_id -> change in unread notifications (0 only bumps the version).
+    """
+    if not deltas:
+        return
+    counters = NotificationCounter.__table__
+
+    existing = set(connection.execute(
+        select(counters.c.user_id).where(counters.c.user_id.in_(list(deltas)))
+    ).scalars())
+    missing = [user_id for user_id in deltas if user_id not in existing]
+    if missing:
+        # A concurrent transaction may seed the same user first; the UPDATE below then
+        # applies this transaction's delta on top of its row.
+        connection.execute(
+            dialect_insert(connection, counters).on_conflict_do_nothing(index_elements=['user_id']),
+            [{'user_id': user_id, 'unread': 0, 'version': 0} for user_id in missing]
+        )
+
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in by_delta.items():
+        connection.execute(
+            update(counters)
+            .where(counters.c.user_id.in_(user_ids))
+            .values(unread=counters.c.unread + delta, version=counters.c.version + 1)
+        )
+
+
+def rebuild_unread_counters(chunk_size=1000):
+    """
+    Recount every user's unread notifications into their counter row. Run once when the
+    counters are introduced, or to repair them; counts are exact for notifications
+    committed before the call.
+
+    Args:
+        chunk_size (int): Users per transaction.
+
+    Returns:
+        int: Number of users recounted.
+    """
+    counters = NotificationCounter.__table__
+    notifications = Notification.__table__
+    users = User.__table__
+    unread = select(func.count(notifications.c.id)).where(
+        notifications.c.user_id == users.c.id,
+        notifications.c.is_read.isnot(True)
+    ).scalar_subquery()
+
+    recounted = 0
+    last_user_id = 0
+    while True:
+        rows = db.session.execute(
+            select(users.c.id, unread).where(users.c.id > last_user_id).order_by(users.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_user_id = rows[-1][0]
+        stmt = dialect_insert(db.session, counters)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={'unread': stmt.excluded.unread, 'version': counters.c.version + 1}
+            ),
+            [{'user_id': user_id, 'unread': count, 'version': 1} for user_id, count in rows]
+        )
+        db.session.commit()
+        recounted += len(rows)
+    return recounted
+
+
+def unread_counter(user_id):
+    """
+    Return the user's counter row, seeding it on first use.
+
+    Args:
+        user_id (int): Notification owner.
+
+    Returns:
+        NotificationCounter: Counter row.
+    """
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is None:
+        adjust_unread(db.session, {user_id: 0})
+        db.session.commit()
+        counter = db.session.get(NotificationCounter, user_id)
+    return counter
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed_notifications(session, flush_context):
+    # One aggregated call per flush instead of one UPDATE per notification.
+    deltas = Counter()
+    for instance in session.new:
+        if isinstance(instance, Notification):
+            deltas[instance.user_id] += 0 if instance.is_read else 1
+    for instance in session.dirty:
+        if isinstance(instance, Notification):
+            history = inspect(instance).attrs.is_read.history
+            if history.has_changes():
+                was_read = bool(history.deleted[0]) if history.deleted else False
+                if was_read != bool(instance.is_read):
+                    deltas[instance.user_id] += -1 if instance.is_read else 1
+    for instance in session.deleted:
+        if isinstance(instance, Notification):
+            deltas[instance.user_id] += 0 if instance.is_read else -1
+    if deltas:
+        adjust_unread(session.connection(), dict(deltas))
+
+
+def _count_bulk_inserted(connection, rows):
+    deltas = Counter()
+    for row in rows:
+        deltas[row['user_id']] += 0 if row.get('is_read') else 1
+    adjust_unread(connection, dict(deltas))
+
+
+audit_writer.register_insert_hook(Notification, _count_bulk_inserted)
+
+
+# =======================
+# Reads and mark-read
+# =======================
+
+def notifications_page_query(user_id, limit, cursor=None):
+    """
+    Args:
+        user_id (int): Notification owner.
+        limit (int): Page size; one extra row is fetched to detect a next page.
+        cursor (str, optional): Cursor returned with the previous page.
+
+    Returns:
+        Select: The page, newest first, on the (user_id, sent_at, id) index.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query = select(
+        Notification.id, Notification.type, Notification.message, Notification.sent_at, Notification.is_read
+    ).where(
+        Notification.user_id == user_id
+    ).order_by(
+        Notification.sent_at.desc(), Notification.id.desc()
+    ).limit(limit + 1)
+
+    if cursor:
+        query = query.where(tuple_(Notification.sent_at, Notification.id) < decode_cursor(cursor))
+    return query
+
+
+def list_notifications(user_id, limit, cursor=None):
+    """
+    One page of notifications, newest first, using the (user_id, sent_at, id) index.
+
+    Args:
+        user_id (int): Notification owner.
+        limit (int): Page size.
+        cursor (str, optional): Cursor returned with the previous page.
+
+    Returns:
+        tuple: (rows, next_cursor); next_cursor is None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    rows = db.session.execute(notifications_page_query(user_id, limit, cursor)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].sent_at, rows[-1].id)
+    return rows, None
+
+
+def mark_read(user_id, ids=None, up_to_id=None):
+    """
+    Mark notifications read with a single UPDATE.
+
+    Args:
+        user_id (int): Notification owner.
+        ids (list, optional): Specific notification ids.
+        up_to_id (int, optional): Mark this notification and every older one.
+            With neither argument, every notification is marked.
+
+    Returns:
+        int: Number of notifications that changed from unread to read.
+    """
+    stmt = update(Notification).where(
+        Notification.user_id == user_id,
+        Notification.is_read.isnot(True)
+    )
+
+    if ids is not None:
+        stmt = stmt.where(Notification.id.in_(ids))
+    elif up_to_id is not None:
+        position = db.session.execute(
+            select(Notification.sent_at, Notification.id).where(
+                Notification.id == up_to_id, Notification.user_id == user_id
+            )
+        ).first()
+        if position is None:
+            return 0
+        stmt = stmt.where(tuple_(Notification.sent_at, Notification.id) <= tuple(position))
+
+    changed = db.session.execute(
+        stmt.values(is_read=True).execution_options(synchronize_session=False)
+    ).rowcount
+    if changed:
+        adjust_unread(db.session, {user_id: -changed})
+    db.session.commit()
+    return changed
+
+
+# =======================
+# Deadline reminders
+# =======================
+
+REMINDER_TYPE = 'deadline_reminder'
+
+
+def reminder_candidates_query(today, days_ahead, limit, position=None):
+    """
+    Args:
+        today (date): First due date to include.
+        days_ahead (int): Window length in days.
+        limit (int): Rows per chunk.
+        position (tuple, optional): (due_date, id) of the last row of the previous chunk.
+
+    Returns:
+        Select: Pending quarters of active pensioners due in the window that have not been
+        reminded yet, in (due_date, id) order on `ix_quarter_verifications_status_due`.
+    """
+    qv = QuarterVerification.__table__
+    notifications = Notification.__table__
+    users = User.__table__
+    target_quarter = qv.c.quarter + '-' + cast(qv.c.year, String)
+
+    already_reminded = exists().where(
+        notifications.c.user_id == qv.c.user_id,
+        notifications.c.type == REMINDER_TYPE,
+        notifications.c.target_quarter == target_quarter
+    )
+    query = select(
+        qv.c.id, qv.c.user_id, qv.c.quarter, qv.c.year, qv.c.due_date
+    ).join(users, users.c.id == qv.c.user_id).where(
+        qv.c.status == 'pending',
+        qv.c.due_date >= today,
+        qv.c.due_date <= today + timedelta(days=days_ahead),
+        users.c.is_active.is_(True),
+        ~already_reminded
+    ).order_by(qv.c.due_date, qv.c.id).limit(limit)
+
+    if position is not None:
+        query = query.where(tuple_(qv.c.due_date, qv.c.id) > position)
+    return query
+
+
+def send_deadline_reminders(today, days_ahead, chunk_size=1000, echo=None):
+    """
+    Notify every active pensioner with a pending quarter due within `days_ahead` days.
+
+    Quarters are walked in (due_date, id) order on `ix_quarter_verifications_status_due`,
+    one chunk at a time, so memory stays flat. Users already reminded about a quarter are
+    skipped, which makes the job safe to re-run.
+
+    Args:
+        today (date): First due date to include.
+        days_ahead (int): Window length in days.
+        chunk_size (int): Quarters per transaction.
+        echo (callable, optional): Progress callback taking a message string.
+
+    Returns:
+        int: Number of reminders sent.
+    """
+    sent = 0
+    position = None
+    while True:
+        rows = db.session.execute(reminder_candidates_query(today, days_ahead, chunk_size, position)).all()
+        if not rows:
+            break
+        position = (rows[-1].due_date, rows[-1].id)
+
+        now = datetime.utcnow()
+        reminders = []
+        pushes = []
+        for row in rows:
+            quarter = f"{row.quarter}-{row.year}"
+            message = f"Your life certificate verification for {quarter} is due by {row.due_date.strftime('%B %d, %Y')}"
+            reminders.append({
+                'user_id': row.user_id,
+                'type': REMINDER_TYPE,
+                'message': message,
+                'target_quarter': quarter,
+                'sent_at': now,
+                'is_read': False
+            })
+            pushes.append({
+                'user_id': row.user_id,
+                'payload': {'type': REMINDER_TYPE, 'title': 'Verification due', 'body': message, 'quarter': quarter}
+            })
+
+        connection = db.session.connection()
+        connection.execute(insert(Notification.__table__), reminders)
+        adjust_unread(connection, Counter(row.user_id for row in rows))
+        enqueue(connection, 'push', pushes)
+        db.session.commit()
+
+        sent += len(rows)
+        if echo:
+            echo(f"Reminded {sent} pensioners (through {position[0]})")
+
+    return sent
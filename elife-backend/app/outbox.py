@@ -0,0 +1,182 @@
+"""
+Transactional outbox for push deliveries.
+
+Jobs that create notifications write the matching delivery tasks to `outbox_messages` in the
+same transaction, so a task exists exactly when its notification does. A dispatcher drains
+the table in batches and hands each batch to a sink. On PostgreSQL rows are claimed with
+SKIP LOCKED, so several dispatchers can run side by side.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+from app import db
+from app.bulk import chunked
+from app.config import app_config
+from app.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+# =======================
+# Sinks
+# =======================
+
+class LocalSink:
+    """
+    Stand-in push sink that keeps delivered messages in memory and, optionally, appends them
+    to a JSON-lines file. Used in development and tests.
+
+    Args:
+        path (str, optional): File to append delivered messages to.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.delivered = []
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        """
+        Deliver a batch.
+
+        Args:
+            messages (list): Dicts with id, topic, user_id and the decoded payload.
+        """
+        with self._lock:
+            self.delivered.extend(messages)
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a') as f:
+                    for message in messages:
+                        f.write(json.dumps(message) + '\n')
+
+
+SINKS = {
+    'local': lambda: LocalSink(app_config.OUTBOX_LOCAL_PATH),
+}
+
+
+def get_sink(name=None):
+    """
+    Args:
+        name (str, optional): Sink name; defaults to OUTBOX_SINK.
+
+    Returns:
+        object: Sink with a `send(messages)` method.
+
+    Raises:
+        ValueError: If the sink name is unknown.
+    """
+    name = name or app_config.OUTBOX_SINK
+    if name not in SINKS:
+        raise ValueError(f"Unknown outbox sink: {name}")
+    return SINKS[name]()
+
+
+# =======================
+# Enqueue and dispatch
+# =======================
+
+def enqueue(connection, topic, messages, chunk_size=1000):
+    """
+    Write delivery tasks with multi-row INSERTs. Call inside the transaction that creates
+    the records being delivered.
+
+    Args:
+        connection: SQLAlchemy connection or session.
+        topic (str): Delivery channel, e.g. 'push'.
+        messages (list): Dicts with user_id and payload (any JSON-serializable value).
+        chunk_size (int): Rows per INSERT.
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            'topic': topic,
+            'user_id': message['user_id'],
+            'payload': json.dumps(message['payload']),
+            'created_at': now,
+            'attempts': 0
+        }
+        for message in messages
+    ]
+    for chunk in chunked(rows, chunk_size):
+        connection.execute(insert(OutboxMessage.__table__), chunk)
+
+
+def dispatch_batch(sink, batch_size=None, max_attempts=None):
+    """
+    Claim one batch of pending tasks, send it and record the outcome.
+
+    Args:
+        sink: Object with a `send(messages)` method.
+        batch_size (int, optional): Defaults to OUTBOX_BATCH_SIZE.
+        max_attempts (int, optional): Tasks that failed this often are left for inspection.
+
+    Returns:
+        int: Number of tasks delivered.
+    """
+    batch_size = batch_size or app_config.OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or app_config.OUTBOX_MAX_ATTEMPTS
+    outbox = OutboxMessage.__table__
+
+    rows = db.session.execute(
+        select(outbox.c.id, outbox.c.topic, outbox.c.user_id, outbox.c.payload).where(
+            outbox.c.dispatched_at.is_(None),
+            outbox.c.attempts < max_attempts
+        ).order_by(outbox.c.id).limit(batch_size).with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    ids = [row.id for row in rows]
+    messages = [
+        {'id': row.id, 'topic': row.topic, 'user_id': row.user_id, 'payload': json.loads(row.payload)}
+        for row in rows
+    ]
+    try:
+        sink.send(messages)
+    except Exception as e:
+        logger.exception("Outbox delivery failed for %d tasks", len(ids))
+        db.session.execute(
+            update(outbox).where(outbox.c.id.in_(ids)).values(attempts=outbox.c.attempts + 1, last_error=str(e))
+        )
+        db.session.commit()
+        return 0
+
+    db.session.execute(
+        update(outbox).where(outbox.c.id.in_(ids)).values(
+            dispatched_at=datetime.utcnow(), attempts=outbox.c.attempts + 1
+        )
+    )
+    db.session.commit()
+    return len(ids)
+
+
+def drain(sink, batch_size=None, max_batches=None):
+    """
+    Dispatch batches until the outbox is empty or a batch fails.
+
+    Args:
+        sink: Object with a `send(messages)` method.
+        batch_size (int, optional): Tasks per batch.
+        max_batches (int, optional): Stop after this many batches.
+
+    Returns:
+        int: Number of tasks delivered.
+    """
+    delivered = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        sent = dispatch_batch(sink, batch_size)
+        if not sent:
+            break
+        delivered += sent
+        batches += 1
+    return delivered
@@ -0,0 +1,104 @@
+"""
+Password hashing on a dedicated, bounded executor.
+
+Werkzeug's scrypt and pbkdf2 implementations come from hashlib, which releases the GIL while
+hashing. Running them on a pool sized to the CPU count keeps login bursts from
+oversubscribing the cores, and the pending-work limit turns overload into a quick 503
+instead of a growing queue of request threads.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app.config import app_config
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashing jobs are already pending."""
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords on a thread pool.
+
+    Args:
+        method (str): Werkzeug hash method, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'.
+        workers (int, optional): Pool size; defaults to the CPU count.
+        max_pending (int, optional): Jobs allowed in flight before callers are rejected.
+        timeout (float): Seconds to wait for a free slot before raising PasswordHasherBusy.
+    """
+
+    def __init__(self, method, workers=None, max_pending=None, timeout=5.0):
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._prefix = None
+
+    def _pool(self):
+        # Created lazily, and again after a fork, since executor threads do not survive fork.
+        if self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hasher')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusy("Password hashing capacity exhausted")
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    @property
+    def prefix(self):
+        """Canonical 'method:params' prefix produced by the configured method."""
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def hash(self, password):
+        """
+        Args:
+            password (str): Plain-text password.
+
+        Returns:
+            str: Werkzeug password hash.
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """
+        Args:
+            pwhash (str): Stored hash.
+            password (str): Candidate password.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Args:
+            pwhash (str): Stored hash.
+
+        Returns:
+            bool: True if the hash was made with different method or cost parameters.
+        """
+        return pwhash.split('$', 1)[0] != self.prefix
+
+
+password_hasher = PasswordHasher(
+    app_config.PASSWORD_HASH_METHOD,
+    workers=app_config.PASSWORD_HASH_WORKERS,
+    max_pending=app_config.PASSWORD_HASH_MAX_PENDING,
+    timeout=app_config.PASSWORD_HASH_TIMEOUT
+)
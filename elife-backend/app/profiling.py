@@ -0,0 +1,327 @@
+"""
+Opt-in cProfile capture of individual requests.
+
+A request is profiled when it carries a valid signed `X-Profile` header (minted with
+`flask profile-token`), or when an admin has switched sampling on through
+PUT /admin/profiling. The switch is stored in a small settings file, so every worker sees it.
+It can be limited to some endpoints, samples a fraction of requests and expires on its own.
+
+Profiles are written after the response is sent. Each one is a pstats-compatible `.prof`
+file plus a `.json` sidecar with the endpoint, timing and the top functions, kept in a
+ring of at most PROFILE_MAX_FILES captures under PROFILE_DIR. cProfile allows one active
+profiler per process, so a request that arrives while another is being profiled runs
+unprofiled.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+
+from flask import request
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from app.tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+TOP_FUNCTIONS = 25
+
+_profiler_lock = threading.Lock()
+
+
+def _serializer(secret):
+    return URLSafeSerializer(secret, salt='request-profile')
+
+
+def make_profile_token(secret, ttl=600, path=None):
+    """
+    Args:
+        secret (str): PROFILE_SECRET.
+        ttl (int): Seconds the token stays valid.
+        path (str, optional): Only profile requests to this path.
+
+    Returns:
+        str: Value for the X-Profile header.
+    """
+    return _serializer(secret).dumps({'exp': int(time.time() + ttl), 'path': path})
+
+
+def check_profile_token(secret, token, path):
+    """
+    Args:
+        secret (str): PROFILE_SECRET.
+        token (str): X-Profile header value.
+        path (str): Request path.
+
+    Returns:
+        bool: True if the token is genuine, unexpired and matches the path.
+    """
+    try:
+        claims = _serializer(secret).loads(token)
+    except BadSignature:
+        return False
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time():
+        return False
+    return claims.get('path') in (None, path)
+
+
+# =======================
+# Admin toggle
+# =======================
+
+DEFAULT_SETTINGS = {'enabled': False, 'sample_rate': 0.0, 'endpoints': [], 'until': None}
+
+
+class ProfileSettings:
+    """
+    Sampling switch shared by all workers through a JSON file, re-read at most every
+    `refresh_seconds`.
+
+    Args:
+        path (str): Settings file.
+        refresh_seconds (float): How stale a worker's copy may be.
+    """
+
+    def __init__(self, path, refresh_seconds=5.0):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._loaded_at = 0.0
+        self._mtime = None
+
+    def get(self):
+        """
+        Returns:
+            dict: enabled, sample_rate, endpoints and until (epoch seconds or None).
+        """
+        now = time.monotonic()
+        if now - self._loaded_at >= self.refresh_seconds:
+            self._loaded_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime != self._mtime:
+                    with open(self.path, encoding='utf-8') as f:
+                        self._settings = dict(DEFAULT_SETTINGS, **json.load(f))
+                    self._mtime = mtime
+            except FileNotFoundError:
+                self._settings, self._mtime = dict(DEFAULT_SETTINGS), None
+            except (OSError, ValueError):
+                logger.exception("Could not read profiling settings from %s", self.path)
+        return self._settings
+
+    def save(self, enabled, sample_rate=0.0, endpoints=(), duration_seconds=None):
+        """
+        Replace the settings for every worker.
+
+        Args:
+            enabled (bool): Sample requests at all.
+            sample_rate (float): Fraction of matching requests to profile, 0 to 1.
+            endpoints (Iterable[str]): Endpoint names to sample; empty means all.
+            duration_seconds (int, optional): Switch off automatically after this long.
+
+        Returns:
+            dict: The saved settings.
+        """
+        settings = {
+            'enabled': bool(enabled),
+            'sample_rate': float(sample_rate),
+            'endpoints': list(endpoints),
+            'until': time.time() + duration_seconds if duration_seconds else None,
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(tmp, self.path)
+        self._settings, self._loaded_at, self._mtime = settings, time.monotonic(), os.path.getmtime(self.path)
+        return settings
+
+    def should_sample(self, endpoint):
+        """
+        Args:
+            endpoint (str): Flask endpoint of the request.
+
+        Returns:
+            bool: True if this request is picked by the admin sampling switch.
+        """
+        settings = self.get()
+        if not settings['enabled'] or settings['sample_rate'] <= 0:
+            return False
+        if settings['until'] and settings['until'] < time.time():
+            return False
+        if settings['endpoints'] and endpoint not in settings['endpoints']:
+            return False
+        return random.random() < settings['sample_rate']
+
+
+# =======================
+# Profile ring
+# =======================
+
+# Captures are named <start ms>-<endpoint>-<pid>; anything else in the directory is not ours.
+_NAME = re.compile(r'^\d+-[\w.-]+\.(prof|json)$')
+
+
+class ProfileRing:
+    """
+    Directory holding at most `max_files` captured profiles, oldest removed first.
+
+    Args:
+        directory (str): PROFILE_DIR.
+        max_files (int): Profiles kept.
+    """
+
+    def __init__(self, directory, max_files=50):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        """
+        Args:
+            name (str): File name from `list`.
+
+        Returns:
+            str: Path inside the ring, or None for names that are not ring files.
+        """
+        if not _NAME.match(name):
+            return None
+        return os.path.join(self.directory, name)
+
+    def save(self, profile, metadata):
+        """
+        Write a finished profile and its metadata, then trim the ring.
+
+        Args:
+            profile (cProfile.Profile): Disabled profiler.
+            metadata (dict): Endpoint, timing and trigger details.
+
+        Returns:
+            str: Base name of the saved profile.
+        """
+        name = f"{int(metadata['started_at'] * 1000)}-{metadata['endpoint']}-{os.getpid()}"
+        name = re.sub(r'[^\w.-]', '_', name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        profile.create_stats()
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        metadata = dict(metadata, name=name, total_calls=stats.total_calls, summary=summary.getvalue())
+
+        stats.dump_stats(os.path.join(self.directory, name + '.prof'))
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        self._trim()
+        return name
+
+    def _trim(self):
+        with self._lock:
+            names = sorted(n[:-5] for n in os.listdir(self.directory) if n.endswith('.prof') and _NAME.match(n))
+            for stale in names[:max(0, len(names) - self.max_files)]:
+                for suffix in ('.prof', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, stale + suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def list(self):
+        """
+        Returns:
+            list: Metadata of the kept profiles, newest first, without the text summary.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in sorted((n for n in os.listdir(self.directory) if n.endswith('.json') and _NAME.match(n)), reverse=True):
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            metadata.pop('summary', None)
+            entries.append(metadata)
+        return entries
+
+
+# =======================
+# Request hook
+# =======================
+
+def init_profiling(app):
+    """
+    Profile requests picked by a signed header or the admin sampling switch.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    if not app.config.get('PROFILING_ENABLED', True):
+        return
+    secret = app.config.get('PROFILE_SECRET') or app.config.get('SECRET_KEY')
+    directory = app.config.get('PROFILE_DIR') or os.path.join(os.getcwd(), 'data', 'profiles')
+    settings = ProfileSettings(
+        os.path.join(directory, 'settings.json'), app.config.get('PROFILE_SETTINGS_REFRESH_SECONDS', 5.0)
+    )
+    ring = ProfileRing(directory, app.config.get('PROFILE_MAX_FILES', 50))
+    app.extensions['profiling'] = (settings, ring)
+
+    @app.before_request
+    def _start_profile():
+        token = request.headers.get(HEADER)
+        if token and secret and check_profile_token(secret, token, request.path):
+            trigger = 'header'
+        elif settings.should_sample(request.endpoint):
+            trigger = 'sample'
+        else:
+            return
+        if not _profiler_lock.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        request.environ['app.profile'] = (profile, trigger, time.time(), time.perf_counter())
+        profile.enable()
+
+    @app.after_request
+    def _stop_profile(response):
+        entry = request.environ.pop('app.profile', None)
+        if entry is None:
+            return response
+        profile, trigger, started_at, started = entry
+        profile.disable()
+        _profiler_lock.release()
+        metadata = {
+            'endpoint': request.endpoint or 'unmatched',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(1000 * (time.perf_counter() - started), 3),
+            'started_at': started_at,
+            'trigger': trigger,
+        }
+        annotate(profiled=True)
+
+        def save():
+            try:
+                ring.save(profile, metadata)
+            except OSError:
+                logger.exception("Could not save profile for %s", metadata['endpoint'])
+
+        # Written once the response has gone out, so the client does not wait on pstats.
+        response.call_on_close(save)
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        # The view raised before after_request ran; stop profiling without saving.
+        entry = request.environ.pop('app.profile', None)
+        if entry is not None:
+            entry[0].disable()
+            _profiler_lock.release()
@@ -0,0 +1,368 @@
+"""
+Quarter verification bookkeeping: the per-user dashboard summary.
+
+The dashboard needs every quarter of the year classified against today's date. That
+classification is stored in `quarter_summaries`, one row per user and year, and rebuilt only
+when a quarter row changes or the day rolls over. Reads are a single lookup on
+`uq_quarter_summary_user_year`.
+
+Quarter rows for the whole pensioner base are created up front by `schedule_quarters`, and
+`sweep_missed_quarters` marks overdue rows as missed each night. Until the sweep has run,
+`classify_quarters` treats an overdue pending row as missed too.
+"""
+
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.bulk import chunked, dialect_insert, insert_ignore
+from app.models import User, QuarterVerification, QuarterSummary
+from app.utils import calculate_quarter_due_date
+
+QUARTERS = ('Q1', 'Q2', 'Q3', 'Q4')
+
+
+# =======================
+# Classification
+# =======================
+
+def classify_quarters(quarters, today):
+    """
+    Sort a year's quarter rows into dashboard buckets.
+
+    Args:
+        quarters (list): QuarterVerification rows ordered by due_date.
+        today (date): Date to classify against.
+
+    Returns:
+        dict: current, upcoming, completed and missed entries, and the active flag.
+    """
+    current = None
+    upcoming = []
+    completed = []
+    missed = []
+
+    for q in quarters:
+        entry = {
+            "quarter": q.quarter,
+            "year": q.year,
+            "status": q.status,
+            "due_date": q.due_date.strftime('%Y-%m-%d'),
+            "verified_at": q.verified_at.strftime('%Y-%m-%d') if q.verified_at else None,
+            "ref": q.proof_submission_id
+        }
+
+        if q.status == 'completed':
+            completed.append(entry)
+        elif q.status == 'missed':
+            missed.append(entry)
+        elif q.due_date >= today and not current:
+            current = entry
+        elif q.due_date > today:
+            upcoming.append(entry)
+        elif q.due_date < today and not q.verified_at:
+            # Overdue, but the nightly sweep has not marked it missed yet.
+            missed.append(entry)
+
+    return {
+        "active": not missed,
+        "current": current,
+        "completed": completed,
+        "upcoming": upcoming,
+        "missed": missed
+    }
+
+
+# =======================
+# Queries
+# =======================
+
+def quarters_query(user_id, year):
+    """
+    Args:
+        user_id (int): Pensioner.
+        year (int): Year of the quarters.
+
+    Returns:
+        Select: The user's quarter rows for the year, ordered by due date.
+    """
+    return select(QuarterVerification).where(
+        QuarterVerification.user_id == user_id, QuarterVerification.year == year
+    ).order_by(QuarterVerification.due_date)
+
+
+def quarter_query(user_id, quarter_num, year):
+    """
+    Args:
+        user_id (int): Pensioner.
+        quarter_num (str): Quarter, e.g. 'Q1'.
+        year (int): Year of the quarter.
+
+    Returns:
+        Select: The single row on `uq_user_quarter_year`, if any.
+    """
+    return select(QuarterVerification).where(
+        QuarterVerification.user_id == user_id,
+        QuarterVerification.quarter == quarter_num,
+        QuarterVerification.year == year
+    ).limit(1)
+
+
+# =======================
+# Summary maintenance
+# =======================
+
+def rebuild_quarter_summary(user_id, year, today, summary=None):
+    """
+    Reclassify a user's quarters and store the result.
+
+    Args:
+        user_id (int): Pensioner.
+        year (int): Year to summarise.
+        today (date): Date to classify against.
+        summary (QuarterSummary, optional): Existing row to update.
+
+    Returns:
+        QuarterSummary: Up-to-date summary row.
+    """
+    quarters = db.session.execute(quarters_query(user_id, year)).scalars().all()
+    classified = classify_quarters(quarters, today)
+    payload = json.dumps({key: classified[key] for key in ('current', 'completed', 'upcoming', 'missed')})
+
+    if summary is None:
+        summary = QuarterSummary(user_id=user_id, year=year, version=0)
+        db.session.add(summary)
+    if summary.payload != payload or summary.active != classified['active']:
+        summary.version = (summary.version or 0) + 1
+    summary.payload = payload
+    summary.active = classified['active']
+    summary.as_of = today
+    summary.updated_at = datetime.utcnow()
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request created the row concurrently; use theirs.
+        db.session.rollback()
+        summary = QuarterSummary.query.filter_by(user_id=user_id, year=year).first()
+    return summary
+
+
+def get_quarter_summary(user_id, year, today):
+    """
+    Return the stored summary, rebuilding it if it is stale or from an earlier day.
+
+    Args:
+        user_id (int): Pensioner.
+        year (int): Year to summarise.
+        today (date): Current date.
+
+    Returns:
+        QuarterSummary: Summary row for today.
+    """
+    summary = QuarterSummary.query.filter_by(user_id=user_id, year=year).first()
+    if summary is None or summary.as_of != today:
+        summary = rebuild_quarter_summary(user_id, year, today, summary)
+    return summary
+
+
+def quarter_summary_etag(summary, *extra):
+    """
+    Build a validator from the summary version and any extra fields in the response.
+
+    Args:
+        summary (QuarterSummary): Summary row.
+        *extra: Other values rendered into the response, such as the name.
+
+    Returns:
+        str: ETag value without quotes.
+    """
+    extra_crc = zlib.crc32("|".join(str(value) for value in extra).encode())
+    return f"qs-{summary.user_id}-{summary.year}-{summary.version}-{extra_crc:x}"
+
+
+def invalidate_quarter_summaries(connection, user_ids, year=None):
+    """
+    Mark summaries stale so the next read rebuilds them.
+
+    Call this after bulk statements on `quarter_verifications`, which bypass the ORM
+    events below.
+
+    Args:
+        connection: SQLAlchemy connection or session to run the UPDATE on.
+        user_ids (Iterable[int]): Affected users.
+        year (int, optional): Only this year's summaries.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    stmt = update(QuarterSummary.__table__).where(QuarterSummary.user_id.in_(user_ids)).values(as_of=None)
+    if year is not None:
+        stmt = stmt.where(QuarterSummary.year == year)
+    connection.execute(stmt)
+
+
+@event.listens_for(QuarterVerification, 'after_insert')
+@event.listens_for(QuarterVerification, 'after_update')
+@event.listens_for(QuarterVerification, 'after_delete')
+def _quarter_row_changed(mapper, connection, target):
+    invalidate_quarter_summaries(connection, [target.user_id], target.year)
+
+
+def upsert_quarter_verification(user_id, quarter_num, year, status, proof_submission_id=None, verified_at=None):
+    """
+    Create or update a user's quarter row with one INSERT ... ON CONFLICT DO UPDATE on
+    `uq_user_quarter_year`, in the current session's transaction.
+
+    Args:
+        user_id (int): Pensioner.
+        quarter_num (str): Quarter, e.g. 'Q1'.
+        year (int): Year of the quarter.
+        status (str): New status.
+        proof_submission_id (int, optional): Submission backing the status.
+        verified_at (datetime, optional): Set when given; an existing value is kept otherwise.
+
+    Returns:
+        Row: id, quarter, year, status and verified_at of the stored row.
+    """
+    values = {'status': status, 'proof_submission_id': proof_submission_id}
+    if verified_at is not None:
+        values['verified_at'] = verified_at
+
+    connection = db.session.connection()
+    table = QuarterVerification.__table__
+    stmt = dialect_insert(connection, table).values(
+        user_id=user_id,
+        quarter=quarter_num,
+        year=year,
+        due_date=calculate_quarter_due_date(quarter_num, year).date(),
+        **values
+    ).on_conflict_do_update(
+        index_elements=['user_id', 'quarter', 'year'],
+        set_=values
+    ).returning(table.c.id, table.c.quarter, table.c.year, table.c.status, table.c.verified_at)
+
+    row = connection.execute(stmt).one()
+    invalidate_quarter_summaries(connection, [user_id], year)
+    return row
+
+
+def complete_quarters(submissions, quarter_num, year, verified_at):
+    """
+    Mark many users' quarter rows completed with one multi-row upsert.
+
+    Args:
+        submissions (list): (user_id, proof_submission_id) pairs.
+        quarter_num (str): Quarter, e.g. 'Q1'.
+        year (int): Year of the quarter.
+        verified_at (datetime): Completion time.
+    """
+    if not submissions:
+        return
+    due_date = calculate_quarter_due_date(quarter_num, year).date()
+    rows = [
+        {
+            'user_id': user_id, 'quarter': quarter_num, 'year': year, 'status': 'completed',
+            'due_date': due_date, 'verified_at': verified_at, 'proof_submission_id': proof_submission_id
+        }
+        for user_id, proof_submission_id in submissions
+    ]
+
+    connection = db.session.connection()
+    stmt = dialect_insert(connection, QuarterVerification)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'quarter', 'year'],
+        set_={
+            'status': stmt.excluded.status,
+            'verified_at': stmt.excluded.verified_at,
+            'proof_submission_id': stmt.excluded.proof_submission_id
+        }
+    )
+    connection.execute(stmt, rows)
+    invalidate_quarter_summaries(connection, [user_id for user_id, _ in submissions], year)
+
+
+# =======================
+# Scheduling
+# =======================
+
+def schedule_quarters(year, batch_size=1000, echo=None):
+    """
+    Create the year's Q1-Q4 rows for every active pensioner.
+
+    Users are walked in id order and each batch is written with one multi-row INSERT that
+    skips rows already covered by `uq_user_quarter_year`, so the job can be re-run at any
+    time, e.g. to pick up pensioners who registered mid-year.
+
+    Args:
+        year (int): Year to schedule.
+        batch_size (int): Users per INSERT and commit.
+        echo (callable, optional): Progress callback taking a message string.
+
+    Returns:
+        int: Number of rows created.
+    """
+    due_dates = {quarter: calculate_quarter_due_date(quarter, year).date() for quarter in QUARTERS}
+    created = 0
+    last_id = 0
+
+    while True:
+        user_ids = db.session.execute(
+            select(User.id).where(
+                User.id > last_id,
+                User.role == 'pensioner',
+                User.is_active.is_(True)
+            ).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        rows = [
+            {'user_id': user_id, 'quarter': quarter, 'year': year, 'status': 'pending', 'due_date': due_dates[quarter]}
+            for user_id in user_ids
+            for quarter in QUARTERS
+        ]
+        connection = db.session.connection()
+        for chunk in chunked(rows, batch_size * len(QUARTERS)):
+            created += len(insert_ignore(connection, QuarterVerification, chunk, ['user_id', 'quarter', 'year']))
+        invalidate_quarter_summaries(connection, user_ids, year)
+        db.session.commit()
+
+        if echo:
+            echo(f"Scheduled up to user {last_id}: {created} rows created")
+
+    return created
+
+
+def sweep_missed_quarters(today):
+    """
+    Mark every pending quarter whose due date has passed as missed, in one UPDATE.
+
+    Args:
+        today (date): Rows due before this date are overdue.
+
+    Returns:
+        int: Number of rows marked missed.
+    """
+    stmt = update(QuarterVerification.__table__).where(
+        QuarterVerification.status == 'pending',
+        QuarterVerification.due_date < today,
+        QuarterVerification.verified_at.is_(None)
+    ).values(status='missed')
+
+    connection = db.session.connection()
+    if connection.dialect.update_returning:
+        rows = connection.execute(stmt.returning(QuarterVerification.user_id)).all()
+        swept = len(rows)
+        invalidate_quarter_summaries(connection, {row.user_id for row in rows})
+    else:
+        swept = connection.execute(stmt).rowcount
+        if swept:
+            connection.execute(update(QuarterSummary.__table__).values(as_of=None))
+    db.session.commit()
+    return swept
@@ -0,0 +1,265 @@
+"""
+Query-plan checks for the hot read paths.
+
+`seed_database` fills a scratch database with production-sized tables, and `check_plans`
+runs EXPLAIN on the queries the endpoints issue. A plan fails when it reads a table
+sequentially, sorts rows the index should already have ordered, or goes over the cost or
+time budget, so a dropped or missing index shows up before it ships. Run it with
+`flask check-query-plans`; it never touches the application database unless pointed at it.
+"""
+
+import json
+import logging
+import re
+import statistics
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, insert, select, text
+
+from app import db
+from app.bulk import chunked
+from app.identity import latest_identity_document_query, login_query
+from app.issuance import (
+    certificate_for_submission_query, certificate_history_query, certificates_by_hash_query,
+    latest_approved_submission_query
+)
+from app.models import User, ProofSubmission, QuarterVerification, Notification, IdentityDocument, DigitalCertificate
+from app.notifications import notifications_page_query, reminder_candidates_query
+from app.quarters import quarter_query, quarters_query
+from app.utils import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+PlanCheck = namedtuple('PlanCheck', 'name endpoint build')
+PlanResult = namedtuple('PlanResult', 'name endpoint plan problems cost ms')
+
+SEED_YEAR = 2025
+QUARTERS = ('Q1', 'Q2', 'Q3', 'Q4')
+
+
+def _pensioner_number(user_id):
+    return f"{user_id // 1000:03d}-{user_id % 1000:03d}-{user_id % 7}"
+
+
+# =======================
+# Hot queries
+# =======================
+
+def _hot_queries(user_id, now):
+    # Built with the same query functions the endpoints and jobs execute, so the plans
+    # checked are those of the statements that ship.
+    page = 20
+    cursor = encode_cursor(now - timedelta(days=3), 10 ** 9)
+    return [
+        PlanCheck('login', 'POST /login', lambda: login_query(
+            _pensioner_number(user_id).replace('-', '')
+        )),
+        PlanCheck('quarters_by_user_year', 'GET /api/dashboard-summary', lambda: quarters_query(
+            user_id, SEED_YEAR
+        )),
+        PlanCheck('quarter_by_user_quarter_year', 'POST /update-permissions', lambda: quarter_query(
+            user_id, 'Q2', SEED_YEAR
+        )),
+        PlanCheck('notifications_page', 'GET /notifications', lambda: notifications_page_query(
+            user_id, page, cursor
+        )),
+        PlanCheck('certificate_by_proof_submission', 'issue_certificate', lambda: certificate_for_submission_query(
+            user_id * 2
+        )),
+        PlanCheck('certificate_by_hash', 'GET /certificates/verify/<hash>', lambda: certificates_by_hash_query(
+            [f"{user_id:064x}"]
+        )),
+        PlanCheck('verification_history', 'GET /verification-history', lambda: certificate_history_query(
+            user_id, now - timedelta(days=730), page
+        )),
+        PlanCheck('latest_identity_document', 'POST /verify-images', lambda: latest_identity_document_query(
+            user_id
+        )),
+        PlanCheck('latest_approved_submission', 'POST /generate-certificate', lambda: latest_approved_submission_query(
+            user_id
+        )),
+        PlanCheck('pending_quarters_due', 'send_deadline_reminders', lambda: reminder_candidates_query(
+            now.date(), 14, 1000, (now.date(), 0)
+        )),
+    ]
+
+
+# =======================
+# Seeding
+# =======================
+
+def seed_database(engine, users, notifications_per_user=10, chunk_size=5000, echo=None):
+    """
+    Create the schema on `engine` and fill it with `users` pensioners and their rows.
+
+    Each user gets four quarters, two proof submissions (one approved), one certificate,
+    two identity documents and `notifications_per_user` notifications. Tables are analyzed
+    afterwards so the planner sees production-like statistics.
+
+    Args:
+        engine (Engine): Scratch database.
+        users (int): Number of users to create.
+        notifications_per_user (int): Notifications per user.
+        chunk_size (int): Rows per INSERT.
+        echo (callable, optional): Progress callback taking a message string.
+    """
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    due_dates = [date(SEED_YEAR, 3, 31), date(SEED_YEAR, 6, 30), date(SEED_YEAR, 9, 30), date(SEED_YEAR, 12, 31)]
+
+    def rows_for(user_ids):
+        tables = {table: [] for table in (User, ProofSubmission, QuarterVerification, IdentityDocument,
+                                          DigitalCertificate, Notification)}
+        for uid in user_ids:
+            tables[User].append({
+                'id': uid, 'pensioner_number': _pensioner_number(uid), 'username': f"user{uid}",
+                'email': f"user{uid}@example.com", 'password_hash': 'x', 'role': 'pensioner',
+                'is_active': True, 'created_at': now,
+            })
+            for n, status in ((1, 'flagged'), (2, 'approved')):
+                tables[ProofSubmission].append({
+                    'id': uid * 2 - 2 + n, 'user_id': uid, 'status': status,
+                    'submitted_at': now - timedelta(days=n), 'verified_at': now - timedelta(days=n),
+                })
+            for i, quarter in enumerate(QUARTERS):
+                tables[QuarterVerification].append({
+                    'user_id': uid, 'quarter': quarter, 'year': SEED_YEAR,
+                    'status': 'completed' if i == 0 else 'pending', 'due_date': due_dates[i],
+                })
+            for n in range(2):
+                tables[IdentityDocument].append({
+                    'user_id': uid, 'type': 'national_id', 'image_url': f"id/{uid}/{n}.jpg",
+                })
+            tables[DigitalCertificate].append({
+                'user_id': uid, 'proof_submission_id': uid * 2, 'timestamp': now - timedelta(days=uid % 700),
+                'digital_signature_hash': f"{uid:064x}", 'quarter': f"Q1-{SEED_YEAR}",
+                'content_snapshot': json.dumps({'user_id': uid}),
+            })
+            for n in range(notifications_per_user):
+                tables[Notification].append({
+                    'user_id': uid, 'type': 'deadline_reminder', 'message': 'Your verification is due',
+                    'target_quarter': f"Q{n % 4 + 1}-{SEED_YEAR}", 'sent_at': now - timedelta(hours=n),
+                    'is_read': n % 3 == 0,
+                })
+        return tables
+
+    seeded = 0
+    for user_ids in chunked(range(1, users + 1), max(1, chunk_size // (12 + notifications_per_user))):
+        with engine.begin() as connection:
+            for model, rows in rows_for(user_ids).items():
+                connection.execute(insert(model), rows)
+        seeded += len(user_ids)
+        if echo and (seeded % 10000 < len(user_ids) or seeded == users):
+            echo(f"Seeded {seeded}/{users} users")
+
+    with engine.begin() as connection:
+        connection.execute(text('ANALYZE'))
+
+
+# =======================
+# Plan checks
+# =======================
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)(\S+)')
+
+
+def _driver_statement(connection, statement):
+    # Run the query once and capture the SQL and parameters as sent to the driver, so the
+    # plan is for what actually executes (bound parameters included), not a literal rendering.
+    captured = []
+
+    def capture(conn, cursor, sql, parameters, context, executemany):
+        captured.append((sql, parameters))
+
+    event.listen(connection, 'before_cursor_execute', capture)
+    try:
+        connection.execute(statement).all()
+    finally:
+        event.remove(connection, 'before_cursor_execute', capture)
+    return captured[-1]
+
+
+def explain(connection, statement):
+    """
+    Args:
+        connection (Connection): Database connection.
+        statement (Select): Query to explain.
+
+    Returns:
+        tuple: (plan lines, problems, estimated cost or None). Cost is only reported on
+        PostgreSQL; SQLite's planner does not expose one.
+    """
+    sql, parameters = _driver_statement(connection, statement)
+
+    if connection.dialect.name == 'postgresql':
+        document = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", parameters).scalar()
+        if isinstance(document, str):
+            document = json.loads(document)
+        root = document[0]['Plan']
+        lines, problems = [], []
+
+        def walk(node, depth):
+            relation = node.get('Relation Name')
+            lines.append(f"{'  ' * depth}{node['Node Type']}{' on ' + relation if relation else ''}"
+                         f" (cost={node['Total Cost']:.2f} rows={node['Plan Rows']})")
+            if node['Node Type'] == 'Seq Scan':
+                problems.append(f"sequential scan on {relation}")
+            if node['Node Type'] in ('Sort', 'Incremental Sort'):
+                problems.append("sort not served by an index")
+            for child in node.get('Plans', ()):
+                walk(child, depth + 1)
+
+        walk(root, 0)
+        return lines, problems, root['Total Cost']
+
+    lines, problems = [], []
+    for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters):
+        detail = row[-1]
+        lines.append(detail)
+        match = _SQLITE_SCAN.match(detail)
+        if match:
+            problems.append(f"full scan of {match.group(1)}")
+        if detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            problems.append("sort not served by an index")
+    return lines, problems, None
+
+
+def check_plans(engine, user_id=None, max_cost=None, max_ms=None, repeat=5):
+    """
+    Explain and time every hot query against a seeded database.
+
+    Args:
+        engine (Engine): Seeded database.
+        user_id (int, optional): User the queries look up; defaults to the middle user.
+        max_cost (float, optional): Planner cost budget (PostgreSQL only).
+        max_ms (float, optional): Median execution time budget in milliseconds.
+        repeat (int): Executions timed per query.
+
+    Returns:
+        list: PlanResult per query; a result with `problems` is a failure.
+    """
+    results = []
+    with engine.connect() as connection:
+        if user_id is None:
+            user_id = max(1, (connection.execute(select(db.func.max(User.id))).scalar() or 2) // 2)
+        for check in _hot_queries(user_id, datetime.utcnow()):
+            statement = check.build()
+            plan, problems, cost = explain(connection, statement)
+            if max_cost is not None and cost is not None and cost > max_cost:
+                problems.append(f"cost {cost:.1f} over budget {max_cost:.1f}")
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(statement).all()
+                timings.append(1000 * (time.perf_counter() - started))
+            ms = statistics.median(timings) if timings else 0.0
+            if max_ms is not None and ms > max_ms:
+                problems.append(f"{ms:.2f} ms over budget {max_ms:.2f} ms")
+
+            if problems:
+                logger.warning("Query plan check %s failed: %s", check.name, "; ".join(problems))
+            results.append(PlanResult(check.name, check.endpoint, plan, problems, cost, ms))
+    return results
@@ -0,0 +1,173 @@
+"""
+Per-request SQL query counting and N+1 detection.
+
+Engine events record every statement executed while a request (or a `track_queries` block)
+is active: how many ran, how long they took, and how often the same statement text was
+repeated. A statement repeated at least N_PLUS_ONE_THRESHOLD times with different
+parameters is logged as a likely N+1 pattern. With QUERY_STATS_HEADERS enabled, responses
+carry X-Query-Count and X-Query-Time-Ms so tests can assert per-endpoint budgets.
+"""
+
+import contextvars
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('query_stats', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by `query_budget` when a block runs more queries than allowed."""
+
+
+class QueryStats:
+    """
+    Queries recorded for one request or block.
+
+    Attributes:
+        count (int): Statements executed.
+        seconds (float): Total time spent in the database driver.
+        executions (Counter): Statement text -> times executed.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.executions = Counter()
+        self._parameter_sets = defaultdict(set)
+
+    def record(self, statement, parameters, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.executions[statement] += 1
+        self._parameter_sets[statement].add(hash(repr(parameters)))
+
+    def repeated(self, threshold):
+        """
+        Args:
+            threshold (int): Minimum executions of the same statement.
+
+        Returns:
+            list: (statement, executions) for statements run at least `threshold` times
+            with more than one distinct parameter set, most repeated first.
+        """
+        return [
+            (statement, executions)
+            for statement, executions in self.executions.most_common()
+            if executions >= threshold and len(self._parameter_sets[statement]) > 1
+        ]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    starts = conn.info.get('query_start')
+    elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+    stats.record(statement, parameters, elapsed)
+
+
+@contextmanager
+def track_queries():
+    """
+    Record the queries run inside the block.
+
+    Yields:
+        QueryStats: Filled in as statements execute.
+    """
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def query_budget(limit, threshold=None):
+    """
+    Fail when the block runs more than `limit` queries, or repeats a statement
+    `threshold` times.
+
+    Args:
+        limit (int): Maximum statements allowed.
+        threshold (int, optional): Repetitions treated as an N+1 failure.
+
+    Yields:
+        QueryStats: Queries recorded so far.
+
+    Raises:
+        QueryBudgetExceeded: On exit, if the budget was exceeded.
+    """
+    with track_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        raise QueryBudgetExceeded(f"{stats.count} queries executed, budget is {limit}")
+    if threshold:
+        repeated = stats.repeated(threshold)
+        if repeated:
+            statement, executions = repeated[0]
+            raise QueryBudgetExceeded(f"Statement repeated {executions} times: {statement}")
+
+
+def init_query_stats(app):
+    """
+    Track queries for every request on the app.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    if not app.config.get('QUERY_STATS_ENABLED', True):
+        return
+    threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+    warn_count = app.config.get('QUERY_COUNT_WARN', 30)
+    headers = app.config.get('QUERY_STATS_HEADERS', False)
+
+    @app.before_request
+    def _start_query_stats():
+        # Inside a `track_queries` block (e.g. a test pinning an endpoint's budget) the
+        # request's queries are recorded into that block.
+        stats = _current.get() or QueryStats()
+        request.environ['app.query_stats'] = (stats, _current.set(stats))
+
+    @app.after_request
+    def _report_query_stats(response):
+        stats, _ = request.environ.get('app.query_stats', (None, None))
+        if stats is None:
+            return response
+
+        endpoint = request.endpoint or request.path
+        for statement, executions in stats.repeated(threshold):
+            logger.warning("Possible N+1 in %s: statement ran %d times: %s",
+                           endpoint, executions, " ".join(statement.split())[:300])
+        if stats.count > warn_count:
+            logger.warning("%s ran %d queries (%.1f ms)", endpoint, stats.count, stats.seconds * 1000)
+
+        if headers:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time-Ms'] = f"{stats.seconds * 1000:.2f}"
+        return response
+
+    @app.teardown_request
+    def _stop_query_stats(exc):
+        _, token = request.environ.pop('app.query_stats', (None, None))
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Torn down in a different context than it was set in; just clear it.
+                _current.set(None)
@@ -0,0 +1,273 @@
+"""
+Server-side rendering of life certificates to PNG or PDF.
+
+The static parts of the certificate (border, headings, field labels) are rasterized once per
+process into a base image. Rendering a certificate copies that image and draws only the
+per-user values, and the encoded bytes are cached by certificate id and format.
+`render_quarter_certificates` renders a whole quarter to files on a process pool.
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from cachetools import LRUCache
+from PIL import Image, ImageDraw, ImageFont
+
+from app.config import app_config
+
+# Bump when the layout changes so ETags and cached renders are not reused.
+TEMPLATE_VERSION = 1
+
+FORMATS = {
+    'png': 'image/png',
+    'pdf': 'application/pdf',
+}
+
+PAGE_SIZE = (1754, 1240)  # A4 landscape at 150 dpi
+DPI = 150
+INK = (33, 37, 41)
+ACCENT = (20, 90, 60)
+
+FIELDS = (
+    ('holder', 'Pensioner', 430),
+    ('pensioner_number', 'Pensioner Number', 530),
+    ('quarter', 'Verification Quarter', 630),
+    ('issue_date', 'Date of Issue', 730),
+    ('verification_method', 'Verification Method', 830),
+)
+VALUE_X = 700
+LABEL_X = 220
+
+
+def _font(size, bold=False):
+    name = 'DejaVuSans-Bold.ttf' if bold else 'DejaVuSans.ttf'
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+class CertificateTemplate:
+    """
+    Pre-rasterized base certificate. Loaded from CERTIFICATE_TEMPLATE_PATH when set,
+    otherwise drawn once in memory.
+    """
+
+    def __init__(self, path=None):
+        if path and os.path.exists(path):
+            self.base = Image.open(path).convert('RGB').resize(PAGE_SIZE)
+        else:
+            self.base = self._draw_base()
+        self.value_font = _font(40, bold=True)
+        self.small_font = _font(22)
+
+    @staticmethod
+    def _draw_base():
+        image = Image.new('RGB', PAGE_SIZE, 'white')
+        draw = ImageDraw.Draw(image)
+        width, height = PAGE_SIZE
+        draw.rectangle((40, 40, width - 40, height - 40), outline=ACCENT, width=12)
+        draw.rectangle((70, 70, width - 70, height - 70), outline=ACCENT, width=3)
+        draw.text((width // 2, 180), "LIFE CERTIFICATE", font=_font(84, bold=True), fill=ACCENT, anchor='mm')
+        draw.text((width // 2, 280), "This certifies that the pensioner named below has been verified as living.",
+                  font=_font(30), fill=INK, anchor='mm')
+        label_font = _font(32)
+        for _, label, y in FIELDS:
+            draw.text((LABEL_X, y), label, font=label_font, fill=INK, anchor='lm')
+            draw.line((VALUE_X, y + 30, width - 220, y + 30), fill=(200, 200, 200), width=2)
+        return image
+
+    def render(self, fields, footer, fmt):
+        """
+        Args:
+            fields (dict): Values keyed by the names in FIELDS.
+            footer (str): Certificate id, hash and key id line.
+            fmt (str): 'png' or 'pdf'.
+
+        Returns:
+            bytes: Encoded certificate.
+        """
+        image = self.base.copy()
+        draw = ImageDraw.Draw(image)
+        for key, _, y in FIELDS:
+            draw.text((VALUE_X, y), str(fields.get(key) or '-'), font=self.value_font, fill=INK, anchor='lm')
+        draw.text((PAGE_SIZE[0] // 2, PAGE_SIZE[1] - 130), footer, font=self.small_font, fill=INK, anchor='mm')
+
+        buffer = io.BytesIO()
+        if fmt == 'pdf':
+            image.save(buffer, format='PDF', resolution=DPI)
+        else:
+            image.save(buffer, format='PNG', compress_level=6)
+        return buffer.getvalue()
+
+
+_template = None
+_template_lock = threading.Lock()
+_render_cache = LRUCache(maxsize=app_config.CERTIFICATE_RENDER_CACHE_BYTES, getsizeof=len)
+_render_lock = threading.Lock()
+
+
+def get_template():
+    """
+    Returns:
+        CertificateTemplate: Process-wide template, built on first use.
+    """
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = CertificateTemplate(app_config.CERTIFICATE_TEMPLATE_PATH)
+    return _template
+
+
+def render_etag(certificate_id, fmt):
+    """
+    Args:
+        certificate_id (int): Certificate.
+        fmt (str): 'png' or 'pdf'.
+
+    Returns:
+        str: ETag value without quotes. Certificates are immutable, so the id, format and
+        template version identify the bytes.
+    """
+    return f"cert-{certificate_id}-{fmt}-t{TEMPLATE_VERSION}"
+
+
+def certificate_fields(content, certificate_id, signature_hash, key_id):
+    """
+    Pick the rendered values out of a certificate snapshot.
+
+    Args:
+        content (dict): Parsed content snapshot.
+        certificate_id (int): Certificate id.
+        signature_hash (str): SHA-256 of the snapshot.
+        key_id (str): Signing key id, if signed.
+
+    Returns:
+        tuple: (fields dict, footer line).
+    """
+    issue_date = content.get('issue_date')
+    try:
+        issue_date = datetime.fromisoformat(issue_date).strftime('%B %d, %Y')
+    except (TypeError, ValueError):
+        pass
+    fields = {
+        'holder': content.get('fullName'),
+        'pensioner_number': content.get('pensioner_number'),
+        'quarter': content.get('quarter'),
+        'issue_date': issue_date,
+        'verification_method': content.get('verification_method'),
+    }
+    footer = f"Certificate #{certificate_id}  ·  SHA-256 {signature_hash or '-'}"
+    if key_id:
+        footer += f"  ·  key {key_id}"
+    return fields, footer
+
+
+def render_certificate(certificate_id, content, signature_hash, key_id, fmt):
+    """
+    Render a certificate, reusing a cached render when there is one.
+
+    Args:
+        certificate_id (int): Certificate id, the cache key.
+        content (dict): Parsed content snapshot.
+        signature_hash (str): SHA-256 of the snapshot.
+        key_id (str): Signing key id, if signed.
+        fmt (str): 'png' or 'pdf'.
+
+    Returns:
+        bytes: Encoded certificate.
+    """
+    key = (certificate_id, fmt)
+    with _render_lock:
+        cached = _render_cache.get(key)
+    if cached is not None:
+        return cached
+
+    fields, footer = certificate_fields(content, certificate_id, signature_hash, key_id)
+    data = get_template().render(fields, footer, fmt)
+    with _render_lock:
+        if len(data) <= _render_cache.maxsize:
+            _render_cache[key] = data
+    return data
+
+
+def _render_to_file(job):
+    # Worker entry point for batch rendering: (certificate_id, content, hash, key_id, fmt, path).
+    certificate_id, content, signature_hash, key_id, fmt, path = job
+    fields, footer = certificate_fields(content, certificate_id, signature_hash, key_id)
+    data = get_template().render(fields, footer, fmt)
+    # Written under a temporary name and renamed into place, so a run killed mid-write never
+    # leaves a truncated file that a resumed run would skip.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f".certificate_{certificate_id}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return certificate_id
+
+
+def render_quarter_certificates(quarter, fmt, out_dir, workers=None, chunk_size=500, echo=None):
+    """
+    Render every certificate issued for a quarter into `out_dir`, in parallel.
+
+    Certificates are read in id order, `chunk_size` at a time, and each chunk is spread
+    over a spawn-context process pool. Files only appear once completely written and existing
+    ones are skipped, so an interrupted run can be resumed.
+
+    Args:
+        quarter (str): Quarter in 'Q1-2025' format.
+        fmt (str): 'png' or 'pdf'.
+        out_dir (str): Output directory; files are named certificate_<id>.<fmt>.
+        workers (int, optional): Worker processes; defaults to the CPU count.
+        chunk_size (int): Certificates read per query.
+        echo (callable, optional): Progress callback taking a message string.
+
+    Returns:
+        int: Number of files written.
+    """
+    from sqlalchemy import select
+    from app import db
+    from app.models import DigitalCertificate
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    last_id = 0
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers or os.cpu_count()) as pool:
+        while True:
+            rows = db.session.execute(
+                select(
+                    DigitalCertificate.id, DigitalCertificate.content_snapshot,
+                    DigitalCertificate.digital_signature_hash, DigitalCertificate.key_id
+                ).where(
+                    DigitalCertificate.quarter == quarter, DigitalCertificate.id > last_id
+                ).order_by(DigitalCertificate.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            jobs = []
+            for row in rows:
+                path = os.path.join(out_dir, f"certificate_{row.id}.{fmt}")
+                if os.path.exists(path):
+                    continue
+                try:
+                    content = json.loads(row.content_snapshot or '{}')
+                except ValueError:
+                    content = {}
+                jobs.append((row.id, content, row.digital_signature_hash, row.key_id, fmt, path))
+
+            written += sum(1 for _ in pool.imap_unordered(_render_to_file, jobs, chunksize=16))
+            if echo:
+                echo(f"Rendered {written} certificates (through id {last_id})")
+    return written
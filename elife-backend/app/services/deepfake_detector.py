@@ -1,10 +1,18 @@
+import os
+import logging
 import cv2
 import numpy as np
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import img_to_array
 
+from app.metrics import stage
+from app.tracing import traced, annotate
+
+logger = logging.getLogger(__name__)
+
 # Load the model
-deepfake_model = load_model("app/models/elife_deepfake_detector_test.keras")
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'elife_deepfake_detector_test.keras')
+deepfake_model = load_model(MODEL_PATH)
 
 # Load OpenCV Haar Cascade for face detection
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -24,13 +32,32 @@ def extract_face(image: np.ndarray) -> np.ndarray:
 
 def is_deepfake(image: np.ndarray, threshold: float = 0.2):
     try:
-        face_crop = extract_face(image)
+        with stage('haar_detection'):
+            face_crop = extract_face(image)
         resized = cv2.resize(face_crop, (128, 128))
         img_array = img_to_array(resized) / 255.0
         img_array = np.expand_dims(img_array, axis=0)
-        score = deepfake_model.predict(img_array)[0][0]
-        print(f"Deepfake model score: {score}")
+        with stage('deepfake_inference'):
+            score = deepfake_model.predict(img_array)[0][0]
+        logger.debug("Deepfake model score %.4f", score)
         return score < threshold, face_crop
     except Exception as e:
-        print(f"Deepfake detection error: {e}")
+        logger.warning("Deepfake detection failed: %s", e)
         return None, None
+
+
+def frame_input(frame: np.ndarray) -> np.ndarray:
+    """Resize and scale a full BGR frame for the frame-level deepfake score"""
+    frame = cv2.resize(frame, (128, 128)) / 255.0
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    elif frame.shape[-1] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+    return frame.astype("float32")
+
+@traced('deepfake.frame_scores')
+def frame_scores(frames: list) -> np.ndarray:
+    """Score a batch of frames in one forward pass; higher means more likely synthetic"""
+    annotate(batch_size=len(frames))
+    batch = np.stack([frame_input(frame) for frame in frames])
+    return deepfake_model.predict(batch, verbose=0)[:, 0]
@@ -0,0 +1,459 @@
+"""
+Append-only, memory-mapped store for face embeddings keyed by integer id.
+
+Layout of a store directory:
+    meta.json           dimension, row format, model-version tags and current generation
+    vectors.<gen>.bin   fixed-size rows (float16, or int8 with a float32 scale per row)
+    index.<gen>.bin     append-only log of (key, row, version) entries; row -1 deletes a key
+
+Rows are read through np.memmap, so opening a store only parses the small index log and
+vectors are never re-decoded after a restart. Writers take an flock on the index file so
+several worker processes can append to the same store. Under the lock they re-read
+meta.json, so a process that missed a `compact()` in another process moves to the new
+generation instead of appending to the deleted files.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+from app.config import app_config
+
+INDEX_DTYPE = np.dtype([('key', '<i8'), ('row', '<i8'), ('version', '<i4')])
+DELETED_ROW = -1
+
+
+def _row_dtype(dim, dtype):
+    if dtype == 'float16':
+        return np.dtype([('vec', '<f2', (dim,))])
+    if dtype == 'int8':
+        return np.dtype([('scale', '<f4'), ('vec', 'i1', (dim,))])
+    raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding store with an id -> row index.
+
+    Args:
+        path (str): Store directory, created if missing.
+        dim (int): Embedding dimension for a new store.
+        dtype (str): 'float16' or 'int8' row format for a new store.
+    """
+
+    def __init__(self, path, dim=512, dtype='float16'):
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            self.meta = self._load_meta()
+        else:
+            self.meta = {'dim': dim, 'dtype': dtype, 'versions': [], 'generation': 0}
+            for name in ('vectors', 'index'):
+                open(self._file(name), 'ab').close()
+            self._write_meta()
+
+        self.dim = self.meta['dim']
+        self.row_dtype = _row_dtype(self.dim, self.meta['dtype'])
+        self._open_generation()
+
+    # -----------------------
+    # Files
+    # -----------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.{self.meta['generation']}.bin")
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def _load_meta(self):
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            return json.load(f)
+
+    def _open_generation(self):
+        # The files of the generation named in meta.json exist until a later compaction
+        # replaces them; follow meta.json if that has already happened.
+        while not (os.path.exists(self._file('vectors')) and os.path.exists(self._file('index'))):
+            meta = self._load_meta()
+            if meta['generation'] == self.meta['generation']:
+                raise FileNotFoundError(f"Embedding store files for generation {meta['generation']} are missing")
+            self.meta = meta
+        self._slots = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._read_index_tail()
+
+    def _reopen(self):
+        """Switch to the generation currently named in meta.json."""
+        self.meta = self._load_meta()
+        self._open_generation()
+
+    def _read_index_tail(self):
+        """Apply index entries appended since the last read, by this or another process."""
+        try:
+            with open(self._file('index'), 'rb') as f:
+                f.seek(self._index_offset)
+                raw = f.read()
+        except FileNotFoundError:
+            # Another process compacted the store into a new generation.
+            self._reopen()
+            return
+        usable = len(raw) - len(raw) % INDEX_DTYPE.itemsize
+        if not usable:
+            return
+        entries = np.frombuffer(raw[:usable], dtype=INDEX_DTYPE)
+        for key, row, version in zip(entries['key'].tolist(), entries['row'].tolist(), entries['version'].tolist()):
+            if row == DELETED_ROW:
+                self._slots.pop(key, None)
+            else:
+                self._slots[key] = (row, version)
+        self._index_offset += usable
+        if entries['version'].max() >= len(self.meta['versions']):
+            # Another process registered a new model version.
+            self.meta['versions'] = self._load_meta()['versions']
+
+    def _rows(self, needed_row):
+        """
+        Return the memory map of the vector file, remapping it if it has grown.
+
+        Raises:
+            FileNotFoundError: If another process compacted the store; callers reopen and
+                look their rows up again, since compaction renumbers them.
+        """
+        if self._mmap is None or needed_row >= len(self._mmap):
+            size = os.path.getsize(self._file('vectors')) // self.row_dtype.itemsize
+            self._mmap = np.memmap(self._file('vectors'), dtype=self.row_dtype, mode='r', shape=(size,)) if size else None
+        return self._mmap
+
+    @contextmanager
+    def _locked_index(self):
+        """
+        Open the current generation's index log for appending, holding its flock.
+
+        meta.json is re-read under the lock. If a compaction in another process has started a
+        new generation, the lock is dropped and taken again on the new generation's log, so
+        writes never go to files that compaction has deleted or is about to delete.
+
+        Yields:
+            file: Index log opened for appending.
+        """
+        while True:
+            try:
+                fd = os.open(self._file('index'), os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                self._reopen()
+                continue
+            index_file = os.fdopen(fd, 'ab')
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            meta = self._load_meta()
+            if meta['generation'] == self.meta['generation']:
+                break
+            fcntl.flock(index_file, fcntl.LOCK_UN)
+            index_file.close()
+            self._reopen()
+
+        self.meta = meta
+        try:
+            yield index_file
+        finally:
+            fcntl.flock(index_file, fcntl.LOCK_UN)
+            index_file.close()
+
+    def _version_id(self, model_version):
+        """Map a model-version tag to its id. Must be called inside `_locked_index`."""
+        if model_version not in self.meta['versions']:
+            self.meta['versions'].append(model_version)
+            self._write_meta()
+        return self.meta['versions'].index(model_version)
+
+    # -----------------------
+    # Encoding
+    # -----------------------
+
+    def _encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        rows = np.zeros(len(vectors), dtype=self.row_dtype)
+        if self.meta['dtype'] == 'int8':
+            scale = np.abs(vectors).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            rows['scale'] = scale
+            rows['vec'] = np.clip(np.rint(vectors / scale[:, None]), -127, 127)
+        else:
+            rows['vec'] = vectors
+        return rows
+
+    def _decode(self, rows):
+        if self.meta['dtype'] == 'int8':
+            return rows['vec'].astype(np.float32) * rows['scale'][:, None]
+        return rows['vec'].astype(np.float32)
+
+    # -----------------------
+    # Public API
+    # -----------------------
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return int(key) in self._slots
+
+    def keys(self):
+        """
+        Returns:
+            list: Live keys in the store.
+        """
+        return list(self._slots)
+
+    def put(self, key, vector, model_version):
+        """
+        Store or replace the embedding for a key.
+
+        Args:
+            key (int): User or document id.
+            vector (np.ndarray): Embedding of shape (dim,).
+            model_version (str): Tag of the model that produced the embedding.
+        """
+        self.put_many([key], vector, model_version)
+
+    def put_many(self, keys, vectors, model_version):
+        """
+        Append embeddings in bulk.
+
+        Args:
+            keys (Sequence[int]): Ids, one per row.
+            vectors (np.ndarray): Embeddings of shape (len(keys), dim).
+            model_version (str): Tag of the model that produced the embeddings.
+        """
+        rows = self._encode(vectors)
+        if len(rows) != len(keys):
+            raise ValueError("keys and vectors must have the same length")
+
+        with self._lock:
+            with self._locked_index() as index_file, open(self._file('vectors'), 'ab') as vector_file:
+                version = self._version_id(model_version)
+                first_row = os.fstat(vector_file.fileno()).st_size // self.row_dtype.itemsize
+                vector_file.write(rows.tobytes())
+                vector_file.flush()
+
+                entries = np.zeros(len(keys), dtype=INDEX_DTYPE)
+                entries['key'] = keys
+                entries['row'] = np.arange(first_row, first_row + len(keys))
+                entries['version'] = version
+                index_file.write(entries.tobytes())
+                index_file.flush()
+            self._read_index_tail()
+
+    def delete(self, key):
+        """
+        Remove a key. The row stays on disk until the next `compact()`.
+
+        Args:
+            key (int): User or document id.
+
+        Returns:
+            bool: True if the key was present.
+        """
+        with self._lock:
+            with self._locked_index() as index_file:
+                self._read_index_tail()
+                if int(key) not in self._slots:
+                    return False
+                entry = np.zeros(1, dtype=INDEX_DTYPE)
+                entry['key'] = key
+                entry['row'] = DELETED_ROW
+                index_file.write(entry.tobytes())
+            self._read_index_tail()
+            return True
+
+    def refresh(self):
+        """Pick up entries written by other processes."""
+        with self._lock:
+            self._read_index_tail()
+
+    def changes_since(self, position):
+        """
+        Keys written or deleted since an earlier call, by this or another process. Used to
+        keep a derived index, such as the face search index, in step with the store.
+
+        Args:
+            position (tuple): Position returned by the previous call, or None.
+
+        Returns:
+            tuple: (position, keys). `keys` is None when there is no earlier position or the
+            store has been compacted since, and the caller has to reload everything.
+        """
+        with self._lock:
+            self._read_index_tail()
+            current = (self.meta['generation'], self._index_offset)
+            if position is None or position[0] != current[0]:
+                return current, None
+            if position[1] == current[1]:
+                return current, []
+            try:
+                with open(self._file('index'), 'rb') as f:
+                    f.seek(position[1])
+                    raw = f.read(current[1] - position[1])
+            except FileNotFoundError:
+                self._reopen()
+                return (self.meta['generation'], self._index_offset), None
+            keys = np.frombuffer(raw, dtype=INDEX_DTYPE)['key']
+            return current, np.unique(keys).tolist()
+
+    def model_version(self, key):
+        """
+        Args:
+            key (int): User or document id.
+
+        Returns:
+            str or None: Model-version tag of the stored embedding.
+        """
+        slot = self._slots.get(int(key))
+        return self.meta['versions'][slot[1]] if slot else None
+
+    def get(self, key):
+        """
+        Args:
+            key (int): User or document id.
+
+        Returns:
+            np.ndarray or None: float32 embedding.
+        """
+        with self._lock:
+            try:
+                return self._get(int(key))
+            except FileNotFoundError:
+                self._reopen()
+                return self._get(int(key))
+
+    def _get(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        mmap = self._rows(slot[0])
+        return self._decode(mmap[slot[0]:slot[0] + 1])[0]
+
+    def raw_rows(self):
+        """
+        Zero-copy view of every stored row, including superseded ones.
+
+        Returns:
+            np.memmap or None: Structured rows with a 'vec' field (and 'scale' for int8).
+        """
+        with self._lock:
+            try:
+                return self._rows(0)
+            except FileNotFoundError:
+                self._reopen()
+                return self._rows(0)
+
+    def live_rows(self, model_version=None):
+        """
+        Args:
+            model_version (str, optional): Only return rows written with this tag.
+
+        Returns:
+            tuple: (keys, rows) int64 arrays of live keys and their row numbers, ordered by row.
+        """
+        with self._lock:
+            self._read_index_tail()
+            if model_version is not None:
+                if model_version not in self.meta['versions']:
+                    return np.empty(0, np.int64), np.empty(0, np.int64)
+                wanted = self.meta['versions'].index(model_version)
+                items = [(key, row) for key, (row, version) in self._slots.items() if version == wanted]
+            else:
+                items = [(key, row) for key, (row, _) in self._slots.items()]
+        if not items:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        keys, rows = np.array(items, dtype=np.int64).T
+        order = np.argsort(rows)
+        return keys[order], rows[order]
+
+    def load_all(self, model_version=None):
+        """
+        Bulk-load live embeddings, e.g. to build a search index or for batch re-verification.
+
+        Args:
+            model_version (str, optional): Only load embeddings written with this tag.
+
+        Returns:
+            tuple: (keys, vectors) with vectors as a float32 matrix.
+        """
+        with self._lock:
+            try:
+                return self._load_all(model_version)
+            except FileNotFoundError:
+                self._reopen()
+                return self._load_all(model_version)
+
+    def _load_all(self, model_version):
+        keys, rows = self.live_rows(model_version)
+        if not len(rows):
+            return keys, np.empty((0, self.dim), dtype=np.float32)
+        return keys, self._decode(self._rows(int(rows[-1]))[rows])
+
+    def compact(self):
+        """
+        Rewrite the store with only live rows and start a new file generation.
+
+        Returns:
+            int: Number of rows reclaimed.
+        """
+        with self._lock:
+            with self._locked_index():
+                self._read_index_tail()
+                keys, rows = self.live_rows()
+                mmap = self._rows(int(rows[-1]) if len(rows) else 0)
+                total = len(mmap) if mmap is not None else 0
+                versions = np.array([self._slots[key][1] for key in keys.tolist()], dtype=np.int32)
+
+                old_files = [self._file('vectors'), self._file('index')]
+                self.meta['generation'] += 1
+                with open(self._file('vectors'), 'wb') as f:
+                    if len(rows):
+                        f.write(np.ascontiguousarray(mmap[rows]).tobytes())
+                entries = np.zeros(len(keys), dtype=INDEX_DTYPE)
+                entries['key'] = keys
+                entries['row'] = np.arange(len(keys))
+                entries['version'] = versions
+                with open(self._file('index'), 'wb') as f:
+                    f.write(entries.tobytes())
+                self._write_meta()
+
+            self._mmap = None
+            self._open_generation()
+            for old in old_files:
+                os.remove(old)
+            return total - len(keys)
+
+
+_embedding_store = None
+_embedding_store_lock = threading.Lock()
+
+
+def get_embedding_store():
+    """
+    Return the process-wide store of accepted ID face embeddings.
+
+    Returns:
+        EmbeddingStore: Shared store instance.
+    """
+    global _embedding_store
+    if _embedding_store is None:
+        with _embedding_store_lock:
+            if _embedding_store is None:
+                _embedding_store = EmbeddingStore(
+                    app_config.EMBEDDING_STORE_PATH,
+                    dtype=app_config.EMBEDDING_STORE_DTYPE
+                )
+    return _embedding_store
@@ -0,0 +1,339 @@
+"""
+In-memory nearest-neighbour index over FaceNet embeddings of accepted ID faces.
+
+Used to detect the same face enrolled under several pensioner numbers. Vectors are
+L2-normalized, so the inner product is the cosine similarity.
+"""
+
+import threading
+import numpy as np
+
+from app.config import app_config
+from app.services.embedding_store import get_embedding_store
+from app.tracing import traced, annotate
+
+DEFAULT_DIM = 512
+
+
+class _Partition:
+    """
+    Contiguous float32 matrix of vectors with their keys.
+
+    Rows are packed: removing a key moves the last row into the freed slot so a
+    search is always a single matrix-vector product over `vectors[:size]`.
+    """
+
+    def __init__(self, dim, capacity=1024):
+        self.keys = np.empty(capacity, dtype=np.int64)
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.size = 0
+        self.positions = {}
+
+    def _grow(self, needed):
+        capacity = max(needed, len(self.keys) * 2)
+        keys = np.empty(capacity, dtype=np.int64)
+        vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+        keys[:self.size] = self.keys[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        self.keys, self.vectors = keys, vectors
+
+    def append(self, keys, vectors):
+        count = len(keys)
+        if self.size + count > len(self.keys):
+            self._grow(self.size + count)
+        end = self.size + count
+        self.keys[self.size:end] = keys
+        self.vectors[self.size:end] = vectors
+        for offset, key in enumerate(keys):
+            self.positions[int(key)] = self.size + offset
+        self.size = end
+
+    def remove(self, key):
+        row = self.positions.pop(key)
+        last = self.size - 1
+        if row != last:
+            moved = int(self.keys[last])
+            self.keys[row] = moved
+            self.vectors[row] = self.vectors[last]
+            self.positions[moved] = row
+        self.size = last
+
+    def scores(self, query):
+        return self.keys[:self.size], self.vectors[:self.size] @ query
+
+
+class FaceIndex:
+    """
+    Top-k cosine search over face embeddings keyed by user id.
+
+    Starts as a single flat partition (vectorized brute force). Calling `train()`
+    switches to an IVF layout: vectors are clustered around `nlist` centroids and a
+    query only scans the `nprobe` closest partitions.
+
+    Args:
+        dim (int): Embedding dimension.
+        nlist (int): Number of IVF partitions used by `train()`; 0 keeps the index flat.
+        nprobe (int): Partitions scanned per query once trained.
+    """
+
+    def __init__(self, dim=DEFAULT_DIM, nlist=0, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._partitions = [_Partition(dim)]
+        self._owner = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._owner)
+
+    def __contains__(self, key):
+        return int(key) in self._owner
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _as_matrix(self, vectors):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _assign(self, matrix):
+        if self.centroids is None:
+            return np.zeros(len(matrix), dtype=np.int64)
+        return np.argmax(matrix @ self.centroids.T, axis=1)
+
+    def add(self, key, vector):
+        """
+        Insert or replace the embedding stored for a key.
+
+        Args:
+            key (int): User id.
+            vector (np.ndarray): Embedding of shape (dim,).
+        """
+        self.add_many([key], vector)
+
+    def add_many(self, keys, vectors):
+        """
+        Insert or replace embeddings in bulk.
+
+        Args:
+            keys (Sequence[int]): User ids, one per row.
+            vectors (np.ndarray): Embeddings of shape (len(keys), dim).
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        matrix = self._as_matrix(vectors)
+        if len(keys) != len(matrix):
+            raise ValueError("keys and vectors must have the same length")
+        if len(np.unique(keys)) != len(keys):
+            raise ValueError("keys must be unique")
+
+        with self._lock:
+            for key in keys:
+                if int(key) in self._owner:
+                    self.remove(int(key))
+
+            assignments = self._assign(matrix)
+            for part_id in np.unique(assignments):
+                rows = assignments == part_id
+                self._partitions[part_id].append(keys[rows], matrix[rows])
+                for key in keys[rows]:
+                    self._owner[int(key)] = int(part_id)
+
+    def remove(self, key):
+        """
+        Remove a key from the index.
+
+        Args:
+            key (int): User id.
+
+        Returns:
+            bool: True if the key was present.
+        """
+        key = int(key)
+        with self._lock:
+            part_id = self._owner.pop(key, None)
+            if part_id is None:
+                return False
+            self._partitions[part_id].remove(key)
+            return True
+
+    def search(self, vector, k=5, exclude=None):
+        """
+        Find the k most similar embeddings.
+
+        Args:
+            vector (np.ndarray): Query embedding of shape (dim,).
+            k (int): Number of neighbours to return.
+            exclude (Iterable[int], optional): Keys to leave out of the results.
+
+        Returns:
+            list: (key, cosine similarity) tuples, most similar first.
+        """
+        query = self._as_matrix(vector)[0]
+        exclude = {int(key) for key in exclude} if exclude else set()
+        wanted = k + len(exclude)
+
+        with self._lock:
+            if self.centroids is None:
+                probes = [0]
+            else:
+                nprobe = min(self.nprobe, len(self.centroids))
+                probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+            key_parts, score_parts = [], []
+            for part_id in probes:
+                keys, scores = self._partitions[part_id].scores(query)
+                key_parts.append(keys)
+                score_parts.append(scores)
+            keys = np.concatenate(key_parts).copy()
+            scores = np.concatenate(score_parts)
+
+        if len(scores) > wanted:
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+            keys, scores = keys[top], scores[top]
+        order = np.argsort(-scores)
+
+        results = []
+        for i in order:
+            if int(keys[i]) in exclude:
+                continue
+            results.append((int(keys[i]), float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+    def train(self, nlist=None, iterations=10, sample_size=None, seed=0):
+        """
+        Cluster the current vectors with spherical k-means and repartition the index.
+
+        Args:
+            nlist (int, optional): Number of partitions; defaults to the value given at construction.
+            iterations (int): k-means iterations.
+            sample_size (int, optional): Vectors used for training; defaults to 256 per partition.
+            seed (int): Random seed for centroid initialisation and sampling.
+        """
+        nlist = nlist or self.nlist
+        if not nlist:
+            raise ValueError("nlist must be set to train an IVF index")
+
+        with self._lock:
+            keys, matrix = self._export()
+            if len(matrix) < nlist:
+                raise ValueError(f"Need at least {nlist} vectors to train {nlist} partitions")
+
+            rng = np.random.default_rng(seed)
+            sample_size = min(len(matrix), sample_size or nlist * 256)
+            sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength=nlist) == 0
+                sums[empty] = centroids[empty]
+                centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+            self.nlist = nlist
+            self.centroids = centroids.astype(np.float32)
+            self._partitions = [_Partition(self.dim, capacity=max(16, len(matrix) // nlist)) for _ in range(nlist)]
+            self._owner = {}
+            if len(keys):
+                self.add_many(keys, matrix)
+
+    def _export(self):
+        keys = [part.keys[:part.size] for part in self._partitions]
+        vectors = [part.vectors[:part.size] for part in self._partitions]
+        return np.concatenate(keys), np.concatenate(vectors)
+
+
+_face_index = None
+_face_index_position = None  # embedding store position the index reflects
+_face_index_lock = threading.Lock()
+
+
+def _load_face_index(store):
+    index = FaceIndex(
+        nlist=app_config.FACE_INDEX_NLIST,
+        nprobe=app_config.FACE_INDEX_NPROBE
+    )
+    keys, vectors = store.load_all(app_config.FACENET_MODEL_VERSION)
+    if len(keys):
+        index.add_many(keys, vectors)
+    _train_when_large_enough(index)
+    return index
+
+
+def _train_when_large_enough(index):
+    # k-means over too few vectors per centroid gives unstable partitions, so the index
+    # stays flat until FACE_INDEX_MIN_TRAIN_PER_LIST vectors per partition are enrolled.
+    if index.nlist and not index.is_trained and len(index) >= index.nlist * app_config.FACE_INDEX_MIN_TRAIN_PER_LIST:
+        index.train()
+
+
+def get_face_index():
+    """
+    Return the process-wide index of accepted ID faces, loaded from the embedding store
+    on first use.
+
+    Each call applies what other processes have enrolled or deleted since, by reading the
+    tail of the store's index log, so duplicates enrolled through another worker are found.
+
+    Returns:
+        FaceIndex: Shared index instance.
+    """
+    global _face_index, _face_index_position
+    store = get_embedding_store()
+    with _face_index_lock:
+        position, changed = store.changes_since(_face_index_position)
+        if _face_index is None or changed is None:
+            # First use, or the store was compacted and its log restarted.
+            _face_index = _load_face_index(store)
+        else:
+            for key in changed:
+                if store.model_version(key) == app_config.FACENET_MODEL_VERSION:
+                    _face_index.add(key, store.get(key))
+                else:
+                    _face_index.remove(key)
+            _train_when_large_enough(_face_index)
+        _face_index_position = position
+        return _face_index
+
+
+@traced('face_index.enroll')
+def enroll_face(user_id, embedding):
+    """
+    Persist an accepted ID face embedding and add it to the search index.
+
+    Args:
+        user_id (int): Owner of the accepted ID.
+        embedding (np.ndarray): Normalized FaceNet embedding.
+    """
+    get_embedding_store().put(user_id, embedding, app_config.FACENET_MODEL_VERSION)
+    get_face_index().add(user_id, embedding)
+
+
+@traced('face_index.search')
+def find_duplicate_faces(embedding, user_id, threshold=None, k=3):
+    """
+    Look for accepted ID faces of other users that match an embedding.
+
+    Args:
+        embedding (np.ndarray): Normalized FaceNet embedding of the new ID face.
+        user_id (int): Owner of the new ID, excluded from the search.
+        threshold (float, optional): Minimum cosine similarity to report.
+        k (int): Maximum number of matches to return.
+
+    Returns:
+        list: (user_id, similarity) tuples above the threshold.
+    """
+    if threshold is None:
+        threshold = app_config.FACE_DUPLICATE_THRESHOLD
+    index = get_face_index()
+    annotate(index_size=len(index))
+    if not len(index):
+        return []
+    return [hit for hit in index.search(embedding, k=k, exclude=[user_id]) if hit[1] >= threshold]
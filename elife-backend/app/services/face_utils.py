@@ -0,0 +1,106 @@
+"""
+FaceNet embedding helpers shared by the verification endpoints and batch jobs.
+"""
+
+import cv2
+import numpy as np
+from keras_facenet import FaceNet
+
+from app.config import app_config
+from app.tracing import traced, annotate
+from app.utils import preprocess_image, l2_normalize, get_largest_face
+
+FACENET_INPUT_SIZE = (160, 160)
+
+embedder = FaceNet()
+face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+
+@traced('facenet.embed')
+def face_embedding(face_img):
+    """
+    Compute a normalized FaceNet embedding for a cropped face.
+
+    Args:
+        face_img (np.ndarray): BGR face crop.
+
+    Returns:
+        np.ndarray: float32 embedding of shape (512,).
+    """
+    resized = cv2.resize(face_img, FACENET_INPUT_SIZE)
+    embedding = embedder.embeddings(preprocess_image(resized))
+    return l2_normalize(embedding)[0].astype(np.float32)
+
+
+@traced('face.crop')
+def crop_face(img):
+    """
+    Crop the largest Haar-detected face, falling back to the whole image.
+
+    Args:
+        img (np.ndarray): BGR image.
+
+    Returns:
+        np.ndarray: Face crop resized to the FaceNet input size.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    faces = face_detector.detectMultiScale(gray, 1.1, 4)
+    if len(faces) > 0:
+        img = get_largest_face(faces, img)
+    return cv2.resize(img, FACENET_INPUT_SIZE)
+
+
+@traced('facenet.embed_batch')
+def face_embeddings(face_imgs):
+    """
+    Embed a batch of face crops in a single FaceNet call.
+
+    Args:
+        face_imgs (list): BGR face crops at the FaceNet input size.
+
+    Returns:
+        np.ndarray: Raw (unnormalized) embeddings of shape (len(face_imgs), 512).
+    """
+    annotate(batch_size=len(face_imgs))
+    batch = np.concatenate([preprocess_image(img) for img in face_imgs])
+    return embedder.embeddings(batch)
+
+
+def face_match_scores(id_embeddings, frame_embeddings):
+    """
+    Compare ID and selfie embeddings row by row.
+
+    Args:
+        id_embeddings (np.ndarray): Raw ID face embeddings, shape (N, 512).
+        frame_embeddings (np.ndarray): Raw selfie embeddings, shape (N, 512).
+
+    Returns:
+        tuple: (adjusted_cosine, euclidean_distance) arrays of shape (N,). The cosine is
+        mapped from [-1, 1] to [0, 1]; the distance is between L2-normalized embeddings.
+    """
+    id_norm = l2_normalize(np.atleast_2d(id_embeddings))
+    frame_norm = l2_normalize(np.atleast_2d(frame_embeddings))
+    raw_similarity = np.sum(id_norm * frame_norm, axis=1)
+    adjusted_cosine = (raw_similarity + 1) / 2
+    euclidean_distance = np.linalg.norm(frame_norm - id_norm, axis=1)
+    return adjusted_cosine, euclidean_distance
+
+
+def is_face_match(adjusted_cosine, euclidean_distance, cosine_threshold=None, distance_threshold=None):
+    """
+    Apply the face-match decision rule.
+
+    Args:
+        adjusted_cosine (float or np.ndarray): Similarity in [0, 1].
+        euclidean_distance (float or np.ndarray): Distance between normalized embeddings.
+        cosine_threshold (float, optional): Defaults to FACE_MATCH_COSINE_THRESHOLD.
+        distance_threshold (float, optional): Defaults to FACE_MATCH_DISTANCE_THRESHOLD.
+
+    Returns:
+        bool or np.ndarray: Match decision.
+    """
+    if cosine_threshold is None:
+        cosine_threshold = app_config.FACE_MATCH_COSINE_THRESHOLD
+    if distance_threshold is None:
+        distance_threshold = app_config.FACE_MATCH_DISTANCE_THRESHOLD
+    return (adjusted_cosine > cosine_threshold) | (euclidean_distance < distance_threshold)
@@ -1,6 +1,9 @@
 from firebase_admin import storage
 import uuid
 
+from app.tracing import traced
+
+@traced('storage.upload')
 def upload_file_to_firebase(file_stream, filename, content_type):
     bucket = storage.bucket()
     blob = bucket.blob(f"id_uploads/{uuid.uuid4()}_{filename}")
@@ -0,0 +1,303 @@
+"""
+Batch re-scoring of stored proof submissions.
+
+Used when the deepfake model or face-match thresholds change. The parent process streams
+submissions from the database and writes scores back in bulk; worker processes download
+the stored images and score a whole batch with one forward pass per model.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+import cv2
+import numpy as np
+import requests
+from sqlalchemy import select, update
+
+from app import db
+from app.models import ProofSubmission
+
+DOWNLOAD_THREADS = 8
+DOWNLOAD_TIMEOUT = 20
+
+
+# =======================
+# Worker side
+# =======================
+
+def init_worker():
+    """Load the models once per worker process."""
+    import app.services.face_utils  # noqa: F401
+    import app.services.deepfake_detector  # noqa: F401
+
+
+def fetch_image(url):
+    """
+    Download and decode a stored image.
+
+    Args:
+        url (str): Public storage URL.
+
+    Returns:
+        np.ndarray: BGR image.
+    """
+    response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    img = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not decode image at {url}")
+    return img
+
+
+def clearest_image(images):
+    """
+    Pick the sharpest image by Laplacian variance, like `select_clearest_image` does for files.
+
+    Args:
+        images (list): BGR images.
+
+    Returns:
+        np.ndarray: Sharpest image.
+    """
+    return max(images, key=lambda img: cv2.Laplacian(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var())
+
+
+def _fetch_submission(item):
+    try:
+        frames = [fetch_image(url) for url in item['image_urls']]
+        return item['id'], fetch_image(item['id_image_url']), clearest_image(frames), None
+    except Exception as e:
+        return item['id'], None, None, str(e)
+
+
+def score_batch(items, cosine_threshold=None, distance_threshold=None, deepfake_threshold=None):
+    """
+    Score a batch of submissions.
+
+    Args:
+        items (list): Dicts with 'id', 'id_image_url' and 'image_urls'.
+        cosine_threshold (float, optional): Face-match cosine threshold.
+        distance_threshold (float, optional): Face-match distance threshold.
+        deepfake_threshold (float, optional): Frame score above which a frame is synthetic.
+
+    Returns:
+        list: One result dict per submission; failed ones carry an 'error' key.
+    """
+    from app.config import app_config
+    from app.services.face_utils import crop_face, face_embeddings, face_match_scores, is_face_match
+    from app.services.deepfake_detector import frame_scores
+
+    if deepfake_threshold is None:
+        deepfake_threshold = app_config.DEEPFAKE_SCORE_THRESHOLD
+
+    with ThreadPoolExecutor(DOWNLOAD_THREADS) as executor:
+        fetched = list(executor.map(_fetch_submission, items))
+
+    results = [{'id': sub_id, 'error': error} for sub_id, _, _, error in fetched if error]
+    ready = [(sub_id, id_img, frame) for sub_id, id_img, frame, error in fetched if not error]
+    if not ready:
+        return results
+
+    cropped = []
+    for sub_id, id_img, frame in ready:
+        try:
+            cropped.append((sub_id, frame, crop_face(id_img), crop_face(frame)))
+        except Exception as e:
+            results.append({'id': sub_id, 'error': str(e)})
+
+    def score(batch):
+        deepfake_scores = frame_scores([frame for _, frame, _, _ in batch])
+        faces = []
+        for _, _, id_face, frame_face in batch:
+            faces.extend([id_face, frame_face])
+        embeddings = face_embeddings(faces)
+        similarity, distance = face_match_scores(embeddings[0::2], embeddings[1::2])
+        match = is_face_match(similarity, distance, cosine_threshold, distance_threshold)
+        return [
+            {
+                'id': sub_id,
+                'similarity_score': float(similarity[i]),
+                'face_distance': float(distance[i]),
+                'deepfake_score': float(deepfake_scores[i]),
+                'match': bool(match[i]),
+                'deepfake': bool(deepfake_scores[i] > deepfake_threshold),
+            }
+            for i, (sub_id, _, _, _) in enumerate(batch)
+        ]
+
+    if not cropped:
+        return results
+    try:
+        results.extend(score(cropped))
+    except Exception:
+        # Score one at a time so a single bad image only fails its own submission.
+        for item in cropped:
+            try:
+                results.extend(score([item]))
+            except Exception as e:
+                results.append({'id': item[0], 'error': str(e)})
+    return results
+
+
+# =======================
+# Parent side
+# =======================
+
+def parse_image_urls(value):
+    """
+    Normalize the stored `image_urls` value, which may be a JSON-encoded string.
+
+    Args:
+        value (list or str or None): Column value.
+
+    Returns:
+        list: Image URLs.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    return list(value)
+
+
+def iter_submission_chunks(start=None, end=None, after_id=0, chunk_size=500):
+    """
+    Stream re-scorable submissions in id order using keyset pagination.
+
+    Args:
+        start (datetime, optional): Earliest submitted_at, inclusive.
+        end (datetime, optional): Latest submitted_at, exclusive.
+        after_id (int): Resume after this submission id.
+        chunk_size (int): Rows per query.
+
+    Yields:
+        list: Dicts with 'id', 'id_image_url' and 'image_urls'.
+    """
+    query = select(ProofSubmission.id, ProofSubmission.id_image_url, ProofSubmission.image_urls).where(
+        ProofSubmission.image_urls.isnot(None),
+        ProofSubmission.id_image_url.isnot(None)
+    )
+    if start:
+        query = query.where(ProofSubmission.submitted_at >= start)
+    if end:
+        query = query.where(ProofSubmission.submitted_at < end)
+
+    while True:
+        rows = db.session.execute(
+            query.where(ProofSubmission.id > after_id).order_by(ProofSubmission.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        chunk = []
+        for row in rows:
+            urls = parse_image_urls(row.image_urls)
+            if urls:
+                chunk.append({'id': row.id, 'id_image_url': row.id_image_url, 'image_urls': urls})
+        after_id = rows[-1].id
+        yield after_id, chunk
+
+
+def write_scores(results, apply_status=False):
+    """
+    Write re-scored results back in one bulk UPDATE by primary key.
+
+    Args:
+        results (list): Successful results from `score_batch`.
+        apply_status (bool): Also recompute approved/flagged status.
+    """
+    now = datetime.now(timezone.utc)
+    rows = []
+    for result in results:
+        row = {
+            'id': result['id'],
+            'similarity_score': result['similarity_score'],
+            'face_distance': result['face_distance'],
+            'deepfake_score': result['deepfake_score'],
+            'scored_at': now,
+            'notes': f"Similarity: {result['similarity_score']:.2f}, "
+                     f"Deepfake Score: {result['deepfake_score']:.2f} (re-scored)",
+        }
+        if apply_status:
+            row['status'] = 'approved' if result['match'] and not result['deepfake'] else 'flagged'
+        rows.append(row)
+    if rows:
+        db.session.execute(update(ProofSubmission), rows)
+    db.session.commit()
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def save_checkpoint(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def run_reverification(start=None, end=None, workers=None, batch_size=16, chunk_size=512,
+                       checkpoint_path=None, resume=True, apply_status=False, thresholds=None, echo=print):
+    """
+    Re-score submissions in a date range with a process pool.
+
+    Args:
+        start (datetime, optional): Earliest submitted_at, inclusive.
+        end (datetime, optional): Latest submitted_at, exclusive.
+        workers (int, optional): Worker processes; defaults to the CPU count.
+        batch_size (int): Submissions per model forward pass.
+        chunk_size (int): Submissions fetched and committed per checkpoint.
+        checkpoint_path (str, optional): File recording the last committed id.
+        resume (bool): Continue from the checkpoint if it matches this range.
+        apply_status (bool): Also recompute approved/flagged status.
+        thresholds (dict, optional): Overrides passed to `score_batch`.
+        echo (callable): Progress output.
+
+    Returns:
+        dict: Totals with 'processed', 'failed' and 'seconds'.
+    """
+    import multiprocessing
+
+    scope = {'start': start.isoformat() if start else None, 'end': end.isoformat() if end else None}
+    state = load_checkpoint(checkpoint_path) if resume else None
+    if state and state.get('scope') != scope:
+        echo("Checkpoint is for a different range; starting over")
+        state = None
+    state = state or {'scope': scope, 'last_id': 0, 'processed': 0, 'failed': 0}
+    if state['last_id']:
+        echo(f"Resuming after submission {state['last_id']} ({state['processed']} already processed)")
+
+    scorer = partial(score_batch, **(thresholds or {}))
+    started = time.perf_counter()
+    processed = 0
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers or os.cpu_count(), initializer=init_worker) as pool:
+        for last_id, chunk in iter_submission_chunks(start, end, state['last_id'], chunk_size):
+            batches = [chunk[i:i + batch_size] for i in range(0, len(chunk), batch_size)]
+            results = [result for batch in pool.imap_unordered(scorer, batches) for result in batch]
+
+            failed = [result for result in results if result.get('error')]
+            write_scores([result for result in results if not result.get('error')], apply_status)
+
+            processed += len(results)
+            state.update(
+                last_id=last_id,
+                processed=state['processed'] + len(results),
+                failed=state['failed'] + len(failed)
+            )
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, state)
+
+            elapsed = time.perf_counter() - started
+            echo(f"Up to submission {last_id}: {state['processed']} processed, {state['failed']} failed, "
+                 f"{processed / elapsed:.1f} submissions/s")
+
+    return {'processed': state['processed'], 'failed': state['failed'], 'seconds': time.perf_counter() - started}
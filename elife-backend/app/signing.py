@@ -0,0 +1,203 @@
+"""
+Ed25519 signatures for digital certificates.
+
+Certificates are signed over their canonical content (sorted keys, compact separators,
+UTF-8), so anyone holding the public key can check one without re-deriving our JSON layout.
+Each signature records the id of the key that made it; old public keys stay in the keyring
+after a rotation so earlier certificates keep verifying.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from flask import current_app, has_app_context
+
+from app.config import app_config
+
+logger = logging.getLogger(__name__)
+
+
+def key_id_for(public_key):
+    """
+    Args:
+        public_key (Ed25519PublicKey): Key to identify.
+
+    Returns:
+        str: First 16 hex digits of the SHA-256 of the raw public key.
+    """
+    raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class CertificateSigner:
+    """
+    Signs with one private key and verifies against a keyring of public keys.
+
+    Args:
+        private_key (Ed25519PrivateKey): Current signing key.
+        public_keys (Iterable[Ed25519PublicKey], optional): Retired keys still accepted for
+            verification.
+    """
+
+    def __init__(self, private_key, public_keys=()):
+        self._private_key = private_key
+        self.key_id = key_id_for(private_key.public_key())
+        self.keyring = {key_id_for(key): key for key in public_keys}
+        self.keyring[self.key_id] = private_key.public_key()
+
+    def sign(self, data):
+        """
+        Args:
+            data (bytes): Canonical certificate content.
+
+        Returns:
+            tuple: (signature, key_id); the signature is unpadded URL-safe base64.
+        """
+        return _b64encode(self._private_key.sign(data)), self.key_id
+
+    def sign_many(self, items):
+        """
+        Args:
+            items (Iterable[bytes]): Canonical contents.
+
+        Returns:
+            list: Signatures, in order. All are made with `key_id`.
+        """
+        sign = self._private_key.sign
+        return [_b64encode(sign(data)) for data in items]
+
+    def verify(self, data, signature, key_id):
+        """
+        Args:
+            data (bytes): Canonical certificate content.
+            signature (str): Signature as returned by `sign`.
+            key_id (str): Id of the key that made it.
+
+        Returns:
+            bool: True if the signature is valid for a key in the keyring.
+        """
+        public_key = self.keyring.get(key_id)
+        if public_key is None or not signature:
+            return False
+        try:
+            public_key.verify(_b64decode(signature), data)
+            return True
+        except (InvalidSignature, ValueError):
+            return False
+
+    def verify_many(self, items):
+        """
+        Args:
+            items (Iterable[tuple]): (data, signature, key_id) triples.
+
+        Returns:
+            list: One bool per item, in order.
+        """
+        return [self.verify(data, signature, key_id) for data, signature, key_id in items]
+
+    def public_keys(self):
+        """
+        Returns:
+            dict: key_id -> raw public key as unpadded URL-safe base64.
+        """
+        return {
+            key_id: _b64encode(key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw))
+            for key_id, key in self.keyring.items()
+        }
+
+
+def _may_generate_key():
+    # Only a development or test server may invent its own key; every production host must
+    # sign with the provisioned one or its certificates fail verification elsewhere.
+    if has_app_context():
+        return current_app.debug or current_app.testing
+    return bool(getattr(app_config, 'DEBUG', False) or getattr(app_config, 'TESTING', False))
+
+
+def _generate_private_key(path):
+    logger.warning("Certificate signing key %s not found; generating a new one", path)
+    key = Ed25519PrivateKey.generate()
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # Written to a temporary file and linked into place, so a concurrent worker either loses
+    # the race and loads the winner's key, or never sees a half-written PEM.
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pem)
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+
+
+def _load_private_key(path):
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        if not _may_generate_key():
+            raise FileNotFoundError(
+                f"Certificate signing key {path} not found; provision it or set CERTIFICATE_SIGNING_KEY_PATH"
+            )
+        _generate_private_key(path)
+        f = open(path, 'rb')
+    with f:
+        key = serialization.load_pem_private_key(f.read(), password=None)
+    if not isinstance(key, Ed25519PrivateKey):
+        raise ValueError(f"{path} is not an Ed25519 private key")
+    return key
+
+
+def _load_public_keys(paths):
+    keys = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            key = serialization.load_pem_public_key(f.read())
+        if not isinstance(key, Ed25519PublicKey):
+            raise ValueError(f"{path} is not an Ed25519 public key")
+        keys.append(key)
+    return keys
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer():
+    """
+    Return the process-wide signer, loading keys from CERTIFICATE_SIGNING_KEY_PATH and
+    CERTIFICATE_VERIFY_KEY_PATHS on first use. A missing signing key is only generated on
+    a debug or testing app.
+
+    Returns:
+        CertificateSigner: Shared signer.
+
+    Raises:
+        FileNotFoundError: If the signing key is missing outside debug and testing.
+    """
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = CertificateSigner(
+                    _load_private_key(app_config.CERTIFICATE_SIGNING_KEY_PATH),
+                    _load_public_keys(app_config.CERTIFICATE_VERIFY_KEY_PATHS)
+                )
+    return _signer
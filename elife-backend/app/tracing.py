@@ -0,0 +1,398 @@
+"""
+Lightweight request tracing with span waterfalls written to a local JSON-lines file.
+
+Every request gets a root span. Database queries, verification stages (see
+`app.metrics.stage`) and functions decorated with `traced` open child spans under whichever
+span is current. Spans are recorded for every request because the decision to keep a trace is
+made when it finishes. A trace is exported when it was head-sampled (TRACE_SAMPLE_RATE, or
+a `traceparent` header with the sampled flag) or when it ran longer than TRACE_SLOW_MS, so
+slow requests during deadline surges are always captured.
+
+Each exported line is one trace: its id, the root name and duration, and a flat list of
+spans with parent ids, start offsets and durations in milliseconds, ready to draw as a
+waterfall. A background thread writes the file and rotates it at TRACE_MAX_BYTES.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Spans beyond this many in one trace are counted but not kept.
+MAX_SPANS = 2000
+
+_trace = contextvars.ContextVar('trace', default=None)
+_span = contextvars.ContextVar('span', default=None)
+
+
+def _new_id(bits=64):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """
+    One timed operation within a trace.
+
+    Attributes:
+        name (str): Operation name, e.g. 'db.query' or 'facenet'.
+        span_id (str): 16 hex digits.
+        parent_id (str): Enclosing span, None for the root.
+        attributes (dict): Extra details such as image size or batch size.
+    """
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attributes')
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = attributes or {}
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+
+class _NoopSpan:
+    # Returned outside a trace so callers can set attributes unconditionally.
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    Spans recorded for one request.
+
+    Args:
+        name (str): Root span name.
+        trace_id (str, optional): Id to continue, e.g. from a traceparent header.
+        sampled (bool): Export regardless of duration.
+    """
+
+    def __init__(self, name, trace_id=None, sampled=False, attributes=None):
+        self.trace_id = trace_id or _new_id(128)
+        self.sampled = sampled
+        self.wall_start = time.time()
+        self.root = Span(name, attributes=attributes)
+        self.spans = []
+        self.dropped_spans = 0
+
+    def add(self, span):
+        """Record a finished span."""
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    @property
+    def duration_ms(self):
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return 1000 * (end - self.root.start)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: JSON-serializable trace with span offsets relative to the root start.
+        """
+        origin = self.root.start
+
+        def encode(span):
+            end = span.end if span.end is not None else time.perf_counter()
+            return {
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start_ms': round(1000 * (span.start - origin), 3),
+                'duration_ms': round(1000 * (end - span.start), 3),
+                'attributes': span.attributes,
+            }
+
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'timestamp': self.wall_start,
+            'duration_ms': round(self.duration_ms, 3),
+            'sampled': self.sampled,
+            'dropped_spans': self.dropped_spans,
+            'spans': [encode(self.root)] + [encode(span) for span in sorted(self.spans, key=lambda s: s.start)],
+        }
+
+
+def current_trace():
+    """
+    Returns:
+        Trace: Trace of the current request, or None.
+    """
+    return _trace.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the block as a child of the current span. Does nothing outside a trace.
+
+    Args:
+        name (str): Span name.
+        **attributes: Initial attributes.
+
+    Yields:
+        Span: The open span, for adding attributes.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    parent = _span.get() or trace.root
+    current = Span(name, parent.span_id, attributes)
+    token = _span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        current.finish()
+        _span.reset(token)
+        trace.add(current)
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if tracing."""
+    trace = _trace.get()
+    if trace is not None:
+        (_span.get() or trace.root).set(**attributes)
+
+
+def traced(name):
+    """
+    Decorator running the function inside a span.
+
+    Args:
+        name (str): Span name.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if _trace.get() is None:
+                return f(*args, **kwargs)
+            with span(name):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+# =======================
+# Database spans
+# =======================
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_span(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    if trace is None:
+        return
+    parent = _span.get() or trace.root
+    # Parameters are left out: they can carry personal data.
+    conn.info.setdefault('trace_spans', []).append(Span(
+        'db.query', parent.span_id, {'statement': " ".join(statement.split())[:300], 'executemany': executemany}
+    ))
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_query_span(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    spans = conn.info.get('trace_spans')
+    if trace is None or not spans:
+        return
+    current = spans.pop()
+    current.finish()
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        current.attributes['rowcount'] = cursor.rowcount
+    trace.add(current)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_query_span(context):
+    trace = _trace.get()
+    spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+    if trace is None or not spans:
+        return
+    current = spans.pop()
+    current.finish()
+    current.attributes['error'] = type(context.original_exception).__name__
+    trace.add(current)
+
+
+# =======================
+# Export
+# =======================
+
+class TraceExporter:
+    """
+    Appends finished traces to a JSON-lines file from a background thread.
+
+    Traces are dropped, not blocked on, when the queue is full.
+
+    Args:
+        path (str): Output file.
+        max_bytes (int): Size at which the file is rotated to `<path>.1`.
+        max_queue (int): Traces waiting to be written.
+    """
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, max_queue=1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so each worker process owns its thread.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def export(self, trace):
+        """
+        Queue a finished trace for writing.
+
+        Args:
+            trace (Trace): Finished trace.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(trace.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout=2.0):
+        """Write whatever is queued and stop the thread."""
+        if self._pid != os.getpid() or self._queue is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [json.dumps(trace, default=str, separators=(',', ':')) + '\n' for trace in batch if trace]
+            try:
+                self._write(lines)
+            except OSError:
+                logger.exception("Could not write %d traces to %s", len(lines), self.path)
+            if stop:
+                return
+
+    def _write(self, lines):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, self.path + '.1')
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+
+def _parse_traceparent(header):
+    # W3C traceparent: version-traceid-parentid-flags
+    parts = (header or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32:
+        return None, False
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None, False
+    return parts[1], sampled
+
+
+def init_tracing(app):
+    """
+    Trace every request on the app and export sampled or slow ones.
+
+    Args:
+        app (Flask): Application instance.
+    """
+    if not app.config.get('TRACING_ENABLED', True):
+        return
+    sample_rate = app.config.get('TRACE_SAMPLE_RATE', 0.01)
+    slow_ms = app.config.get('TRACE_SLOW_MS', 1000)
+    exporter = TraceExporter(
+        app.config.get('TRACE_PATH') or os.path.join(os.getcwd(), 'data', 'traces.jsonl'),
+        max_bytes=app.config.get('TRACE_MAX_BYTES', 100 * 1024 * 1024),
+        max_queue=app.config.get('TRACE_QUEUE_SIZE', 1000),
+    )
+    app.extensions['trace_exporter'] = exporter
+
+    @app.before_request
+    def _start_trace():
+        trace_id, sampled = _parse_traceparent(request.headers.get('traceparent'))
+        trace = Trace(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            trace_id=trace_id,
+            sampled=sampled or random.random() < sample_rate,
+            attributes={'http.method': request.method, 'http.path': request.path,
+                        'http.request_bytes': request.content_length or 0},
+        )
+        request.environ['app.trace'] = (trace, _trace.set(trace), _span.set(None))
+
+    @app.after_request
+    def _tag_trace(response):
+        trace, _, _ = request.environ.get('app.trace', (None, None, None))
+        if trace is not None:
+            trace.root.set(**{'http.status': response.status_code, 'endpoint': request.endpoint})
+            if trace.sampled:
+                response.headers['X-Trace-Id'] = trace.trace_id
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exc):
+        trace, trace_token, span_token = request.environ.pop('app.trace', (None, None, None))
+        if trace is None:
+            return
+        if exc is not None:
+            trace.root.set(error=type(exc).__name__)
+        trace.root.finish()
+        try:
+            _span.reset(span_token)
+            _trace.reset(trace_token)
+        except ValueError:
+            # Torn down in a different context than it was set in; just clear it.
+            _span.set(None)
+            _trace.set(None)
+        if trace.sampled or trace.duration_ms >= slow_ms:
+            exporter.export(trace)
@@ -2,27 +2,34 @@
 Utility functions for authentication, image processing, date parsing, and verification.
 """
 
+import logging
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g, make_response
 import jwt
 import numpy as np
 import cv2
 import re
+import base64
+import zlib
 from datetime import datetime, timezone, timedelta
 from dateutil.parser import parse
-from app.models import User
 from app.config import app_config
+from app.identity import resolve_identity, revocations
+from app.tracing import traced, annotate
+
+logger = logging.getLogger(__name__)
 
 # =======================
 # Authentication Utilities
 # =======================
 
-def generate_token(user_id):
+def generate_token(user_id, session_id=None):
     """
     Generate JWT token for user authentication.
     
     Args:
         user_id (int): The ID of the user.
+        session_id (str, optional): Token id of the LoginSession the token belongs to, used for logout.
         
     Returns:
         str: Encoded JWT token.
@@ -31,6 +38,8 @@ def generate_token(user_id):
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(hours=app_config.JWT_EXPIRATION_HOURS)
     }
+    if session_id is not None:
+        payload['sid'] = session_id
     return jwt.encode(payload, app_config.JWT_SECRET_KEY, algorithm='HS256')
 
 
@@ -38,6 +47,9 @@ def token_required(f):
     """
     Flask decorator to protect routes using JWT authentication.
 
+    Tokens carrying a session id are rejected once that session has logged out. The
+    session id is exposed to the handler as `g.session_id`.
+
     Args:
         f (function): Route handler function.
 
@@ -57,7 +69,11 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, app_config.JWT_SECRET_KEY, algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            session_id = data.get('sid')
+            if session_id is not None and revocations.is_revoked(session_id):
+                return jsonify({'message': 'Token has been revoked'}), 401
+
+            current_user = resolve_identity(data['user_id'])
 
             if current_user is None:
                 return jsonify({'message': 'User not found'}), 401
@@ -69,11 +85,132 @@ def token_required(f):
         except Exception:
             return jsonify({'message': 'Token is invalid or expired'}), 401
 
+        g.session_id = session_id
         return f(current_user, *args, **kwargs)
 
     return decorated
 
 
+# =======================
+# Pagination Utilities
+# =======================
+
+def encode_cursor(timestamp, row_id):
+    """
+    Encode a keyset pagination position.
+
+    Args:
+        timestamp (datetime): Sort timestamp of the last row returned.
+        row_id (int): ID of the last row returned, to break ties.
+
+    Returns:
+        str: Opaque URL-safe cursor.
+    """
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Args:
+        cursor (str): Opaque cursor from a previous page.
+
+    Returns:
+        tuple: (timestamp, row_id).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def page_limit(default=50, maximum=200):
+    """
+    Read the `limit` query parameter, clamped to [1, maximum].
+
+    Args:
+        default (int): Value when the parameter is missing or invalid.
+        maximum (int): Largest page size allowed.
+
+    Returns:
+        int: Page size.
+    """
+    limit = request.args.get('limit', default, type=int) or default
+    return max(1, min(limit, maximum))
+
+
+# =======================
+# Conditional Request Utilities
+# =======================
+
+def make_etag(prefix, *parts):
+    """
+    Build a validator from version markers such as ids, counters and update timestamps.
+
+    Args:
+        prefix (str): Resource kind, e.g. 'profile'.
+        *parts: Markers that change whenever the response would.
+
+    Returns:
+        str: ETag value without quotes.
+    """
+    marker = "|".join('' if part is None else str(part) for part in parts)
+    return f"{prefix}-{zlib.crc32(marker.encode()):08x}"
+
+
+def not_modified(etag, cache_control='private, no-cache'):
+    """
+    Args:
+        etag (str): Current validator for the resource.
+        cache_control (str): Cache-Control header for the 304.
+
+    Returns:
+        tuple or None: A 304 response if the request's If-None-Match matches, else None.
+    """
+    # Weak comparison: compressed responses carry the same validator marked weak.
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    return None
+
+
+def conditional(etag_fn, cache_control='private, no-cache'):
+    """
+    Decorator for token-protected GET handlers that answers If-None-Match before the
+    handler runs. Apply below `token_required`.
+
+    Args:
+        etag_fn (function): Called with the handler's arguments; returns the current ETag,
+            or None to skip validation.
+        cache_control (str): Cache-Control header for 200 and 304 responses.
+
+    Returns:
+        function: Decorator.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            etag = etag_fn(*args, **kwargs)
+            if etag is not None:
+                cached = not_modified(etag, cache_control)
+                if cached is not None:
+                    return cached
+
+            response = make_response(f(*args, **kwargs))
+            if etag is not None and response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return decorated
+    return decorator
+
+
 # =======================
 # Document Utilities
 # =======================
@@ -173,6 +310,29 @@ def calculate_quarter_due_date(quarter_num, year, current_date=None):
     return due_dates.get(quarter_num, datetime(year, 1, 15))
 
 
+def quarter_date_range(quarter):
+    """
+    Calendar range covered by a quarter string.
+
+    Args:
+        quarter (str): Quarter in 'Q1-2025' format.
+
+    Returns:
+        tuple: (start, end) datetimes, end exclusive.
+
+    Raises:
+        ValueError: If the quarter string is malformed.
+    """
+    quarter_num, year = quarter.split('-')
+    index = int(quarter_num.upper().lstrip('Q'))
+    if not 1 <= index <= 4:
+        raise ValueError(f"Invalid quarter: {quarter}")
+    year = int(year)
+    start = datetime(year, 3 * (index - 1) + 1, 1)
+    end = datetime(year + 1, 1, 1) if index == 4 else datetime(year, 3 * index + 1, 1)
+    return start, end
+
+
 # =======================
 # Face Image Utilities
 # =======================
@@ -190,6 +350,7 @@ def l2_normalize(x):
     return x / np.sqrt(np.sum(np.square(x), axis=1, keepdims=True))
 
 
+@traced('images.select_clearest')
 def select_clearest_image(image_paths):
     """
     Select clearest image based on Laplacian variance (sharpness).
@@ -202,6 +363,7 @@ def select_clearest_image(image_paths):
     """
     if not image_paths:
         return None
+    annotate(image_count=len(image_paths))
 
     clearest = None
     max_var = -1
@@ -218,7 +380,7 @@ def select_clearest_image(image_paths):
                 max_var = var
                 clearest = path
         except Exception as e:
-            print(f"[ImageError] {path}: {e}")
+            logger.warning("Could not read image %s: %s", path, e)
             continue
 
     return clearest
@@ -229,13 +391,14 @@ def get_largest_face(faces, img):
     Get the largest face region from a list of face detections.
 
     Args:
-        faces (list): Face bounding boxes [(x, y, w, h)].
+        faces (list or np.ndarray): Face bounding boxes [(x, y, w, h)], e.g. as returned by
+            `detectMultiScale`.
         img (np.ndarray): Original image.
 
     Returns:
         np.ndarray: Cropped face image.
     """
-    if not faces:
+    if len(faces) == 0:
         return img
 
     largest = max(faces, key=lambda b: b[2] * b[3])
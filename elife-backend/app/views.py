@@ -1,8 +1,7 @@
-import hashlib
-import traceback
-from flask import Blueprint, json, request, jsonify, current_app
+import logging
+from flask import Blueprint, json, request, jsonify, current_app, g, send_file
 from flask_login import login_user, logout_user, login_required, current_user
-from app.models import User, UserDetails, LoginSession, ProofSubmission, QuarterVerification, Notification, IdentityDocument, DigitalCertificate
+from app.models import User, UserDetails, LoginSession, ProofSubmission, Notification, IdentityDocument, DigitalCertificate
 from app import db, login_manager
 from datetime import datetime, timezone
 from app import csrf
@@ -10,6 +9,7 @@ from functools import wraps
 from app.config import app_config
 import jwt
 import datetime as dt
+from sqlalchemy import func, select
 import cv2        
 from fuzzywuzzy import fuzz            
 import numpy as np     
@@ -18,26 +18,38 @@ import uuid
 from firebase_admin import storage
 import re
 from dateutil.parser import parse       
-from tensorflow.keras.models import load_model
-from sklearn.metrics.pairwise import cosine_similarity
 import shutil
 import tempfile
 import os
 import mediapipe as mp 
-from keras_facenet import FaceNet
 
 # Import utility functions from utils modules
 from app.utils import token_required, generate_token
-from app.utils import calculate_quarter_due_date
-from app.utils import select_clearest_image, get_largest_face, preprocess_image
-from app.utils import detect_id_type, extract_expiry_date, l2_normalize
+from app.identity import invalidate_identity, end_session, login_query, latest_identity_document_query
+from app.audit import audit_writer
+from app.passwords import PasswordHasherBusy
+from app.quarters import get_quarter_summary, quarter_summary_etag, upsert_quarter_verification, quarter_query
+from app.issuance import current_quarter, parse_quarter, issue_certificate
+from app.issuance import certificate_history_query, latest_approved_submission_query
+from app.issuance import parsed_snapshot, verify_certificate_hash, verify_certificate_hashes, SIGNATURE_HASH_PATTERN
+from app.signing import get_signer
+from app.metrics import stage, outcome
+from app.tracing import annotate
+from app.rendering import render_certificate, render_etag, FORMATS as RENDER_FORMATS
+from app.notifications import list_notifications, unread_counter, mark_read
+from app.utils import select_clearest_image
+from app.utils import detect_id_type, extract_expiry_date
+from app.utils import page_limit, encode_cursor
+from app.utils import make_etag, not_modified, conditional
+from app.services.face_utils import face_embedding, crop_face, face_embeddings, face_match_scores, is_face_match
+from app.services.face_index import enroll_face, find_duplicate_faces
 
 
 
 auth = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 mp_face_mesh = mp.solutions.face_mesh
-embedder = FaceNet()
 
 JWT_SECRET_KEY = app_config.JWT_SECRET_KEY
 JWT_EXPIRATION_HOURS = app_config.JWT_EXPIRATION_HOURS
@@ -58,27 +70,30 @@ def login():
     if not pensioner_number or not password:
         return jsonify({'message': 'Missing pensioner_number or password'}), 400
 
-    print("Normalized login attempt:", pensioner_number)
+    user = db.session.execute(login_query(pensioner_number)).scalar()
 
-    all_users = User.query.all()
-    for u in all_users:
-        print(f"👤 Comparing with DB entry: {u.pensioner_number} → normalized: {u.pensioner_number.replace('-', '').strip()}")
-
-    user = next(
-        (u for u in all_users if u.pensioner_number.replace("-", "").strip() == pensioner_number),
-        None
-    )
-
-    if user and user.check_password(password):
-        session = LoginSession(
+    try:
+        password_ok = user is not None and user.check_password(password)
+    except PasswordHasherBusy:
+        return jsonify({'message': 'Too many login attempts in progress, please retry shortly'}), 503, {'Retry-After': '1'}
+
+    if password_ok:
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
+            invalidate_identity(user.id)
+
+        session_token_id = uuid.uuid4().hex
+        audit_writer.add(
+            LoginSession,
+            token_id=session_token_id,
             user_id=user.id,
+            login_time=datetime.utcnow(),
             ip_address=request.remote_addr,
             user_agent=request.user_agent.string
         )
-        db.session.add(session)
-        db.session.commit()
 
-        token = generate_token(user.id)
+        token = generate_token(user.id, session_token_id)
 
         return jsonify({
             'message': 'Login successful',
@@ -92,7 +107,7 @@ def login():
             }
         }), 200
     else:
-        print("Login failed for:", pensioner_number)
+        logger.info("Login failed", extra={'pensioner_number': pensioner_number})
         return jsonify({'message': 'Invalid pensioner_number or password'}), 401
 
 
@@ -100,20 +115,32 @@ def login():
 @token_required
 def logout(current_user):
     """API endpoint for user logout"""
-    session = LoginSession.query.filter_by(
-        user_id=current_user.id, 
-        logout_time=None
-    ).order_by(LoginSession.login_time.desc()).first()
-    
-    if session:
-        session.logout_time = datetime.utcnow()
-        db.session.commit()
+    logout_time = datetime.utcnow()
+
+    if g.session_id is not None:
+        end_session(g.session_id, current_user.id, logout_time)
+    else:
+        # Tokens issued before sessions were embedded in the JWT
+        session = LoginSession.query.filter_by(
+            user_id=current_user.id, 
+            logout_time=None
+        ).order_by(LoginSession.login_time.desc()).first()
+        
+        if session:
+            session.logout_time = logout_time
+            db.session.commit()
     
     return jsonify({'message': 'Logout successful'}), 200
 
 
+def _profile_etag(current_user):
+    details = current_user.user_details
+    return make_etag('profile', current_user.id, current_user.updated_at, details and details.updated_at)
+
+
 @auth.route("/profile", methods=["GET"])
 @token_required
+@conditional(_profile_etag)
 def get_profile(current_user):
     """API endpoint to get user profile data"""
     user_details = current_user.user_details
@@ -173,6 +200,7 @@ def update_profile(current_user):
         current_user.email = new_email
     
     db.session.commit()
+    invalidate_identity(current_user.id)
     return jsonify({'message': 'Profile updated successfully'}), 200
 
 
@@ -182,48 +210,25 @@ def dashboard_summary(current_user):
     today = datetime.utcnow().date()
     year = today.year
 
-    all_quarters = QuarterVerification.query.filter_by(
-        user_id=current_user.id, year=year
-    ).order_by(QuarterVerification.due_date).all()
-
-    current = None
-    upcoming = []
-    completed = []
-    missed = []
-
-    for q in all_quarters:
-        entry = {
-            "quarter": q.quarter,
-            "year": q.year,
-            "status": q.status,
-            "due_date": q.due_date.strftime('%Y-%m-%d'),
-            "verified_at": q.verified_at.strftime('%Y-%m-%d') if q.verified_at else None,
-            "ref": q.proof_submission_id
-        }
-
-        if q.status == 'completed':
-            completed.append(entry)
-        elif q.status == 'missed':
-            missed.append(entry)
-        elif q.due_date >= today and not current:
-            current = entry
-        elif q.due_date > today:
-            upcoming.append(entry)
-        elif q.due_date < today and not q.verified_at:
-            missed.append(entry)
+    summary = get_quarter_summary(current_user.id, year, today)
+    user_details = current_user.user_details
+    full_name = f"{user_details.firstname} {user_details.lastname}"
 
-    full_name = f"{current_user.user_details.firstname} {current_user.user_details.lastname}"
+    etag = quarter_summary_etag(summary, full_name, user_details.trn)
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    return jsonify({
+    response = jsonify({
         "year": year,
         "name": full_name,
-        "trn": current_user.user_details.trn,
-        "active": not missed,
-        "current": current,
-        "completed": completed,
-        "upcoming": upcoming,
-        "missed": missed
+        "trn": user_details.trn,
+        "active": summary.active,
+        **json.loads(summary.payload)
     })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @auth.route("/validate-token", methods=["GET"])
 @token_required
@@ -235,12 +240,28 @@ def validate_token(current_user):
         'username': current_user.username
     }), 200
 
+def _notifications_etag(current_user):
+    counter = unread_counter(current_user.id)
+    return make_etag('notifications', current_user.id, counter.version, request.args.get('cursor'), page_limit())
+
+
 @csrf.exempt
 @auth.route("/notifications", methods=["GET"])
 @token_required
+@conditional(_notifications_etag)
 def get_notifications(current_user):
-    notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.sent_at.desc()).all()
-    return jsonify([
+    """
+    Returns one page of notifications, newest first. Pass the `X-Next-Cursor`
+    response header back as `?cursor=` to fetch the next page.
+    """
+    try:
+        notifications, next_cursor = list_notifications(
+            current_user.id, page_limit(), request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    response = jsonify([
         {
             'id': n.id,
             'type': n.type,
@@ -249,39 +270,87 @@ def get_notifications(current_user):
             'is_read': n.is_read
         }
         for n in notifications
-    ]), 200
+    ])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+
+@auth.route("/notifications/unread-count", methods=["GET"])
+@token_required
+def get_unread_notification_count(current_user):
+    return jsonify({'unread': unread_counter(current_user.id).unread}), 200
 
 
 @csrf.exempt
 @auth.route("/notifications/<int:notification_id>/read", methods=["POST"])
 @token_required
 def mark_notification_read(current_user, notification_id):
-    notification = Notification.query.filter_by(id=notification_id, user_id=current_user.id).first()
+    if not mark_read(current_user.id, ids=[notification_id]):
+        exists = db.session.query(Notification.id).filter_by(id=notification_id, user_id=current_user.id).first()
+        if not exists:
+            return jsonify({'message': 'Notification not found'}), 404
 
-    if not notification:
-        return jsonify({'message': 'Notification not found'}), 404
+    return jsonify({'message': 'Notification marked as read'}), 200
 
-    notification.is_read = True
-    db.session.commit()
 
-    return jsonify({'message': 'Notification marked as read'}), 200
+@csrf.exempt
+@auth.route("/notifications/read", methods=["POST"])
+@token_required
+def mark_notifications_read(current_user):
+    """
+    Bulk mark-read. Body: {"ids": [...]} for specific notifications,
+    {"up_to_id": id} for that notification and everything older, or {} for all.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    up_to_id = data.get('up_to_id')
+
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return jsonify({'message': 'ids must be a list of integers'}), 400
+
+    updated = mark_read(current_user.id, ids=ids, up_to_id=up_to_id)
+    return jsonify({'message': 'Notifications marked as read', 'updated': updated}), 200
+
+def _verification_history_etag(current_user):
+    # Certificates are insert-only, so the newest id and the count identify the set;
+    # the date covers the two-year window moving forward.
+    newest, count = db.session.execute(
+        select(func.max(DigitalCertificate.id), func.count(DigitalCertificate.id))
+        .where(DigitalCertificate.user_id == current_user.id)
+    ).one()
+    return make_etag(
+        'history', current_user.id, newest, count, datetime.utcnow().date(),
+        request.args.get('cursor'), page_limit()
+    )
+
 
 @auth.route("/verification-history", methods=["GET"])
 @token_required
+@conditional(_verification_history_etag)
 def get_verification_history(current_user):
     """
-    Returns all verified Digital Certificates for the current user in the past 2 years.
+    Returns verified Digital Certificates for the current user from the past 2 years,
+    newest first, one page at a time. Pass the `X-Next-Cursor` response header back
+    as `?cursor=` to fetch the next page.
     """
     from datetime import timedelta
 
     two_years_ago = datetime.utcnow() - timedelta(days=730)
+    limit = page_limit()
 
-    certificates = (
-        current_user.certificates
-        if current_user.certificates else []
-    )
+    try:
+        query = certificate_history_query(current_user.id, two_years_ago, limit, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    certificates = db.session.execute(query).all()
+    next_cursor = None
+    if len(certificates) > limit:
+        certificates = certificates[:limit]
+        next_cursor = encode_cursor(certificates[-1].timestamp, certificates[-1].id)
 
-    recent_verified = [
+    response = jsonify([
         {
             "id": cert.id,
             "date": cert.timestamp.strftime("%B %d, %Y"),
@@ -289,10 +358,10 @@ def get_verification_history(current_user):
             "quarter": cert.quarter,
         }
         for cert in certificates
-        if cert.timestamp >= two_years_ago
-    ]
-
-    return jsonify(recent_verified), 200
+    ])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
 
 
 @csrf.exempt
@@ -360,8 +429,7 @@ def detect_face(current_user):
             })
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Face mesh detection failed")
         return jsonify({
             "error": "Face mesh detection failed",
             "details": str(e)
@@ -381,7 +449,7 @@ def verify_id_upload(current_user):
     """
     
     try:
-        print("Received ID upload request from:", current_user.username)
+        logger.info("ID upload received", extra={'user_id': current_user.id})
 
         if 'id_image' not in request.files:
             return jsonify({'message': 'No file uploaded'}), 400
@@ -390,42 +458,54 @@ def verify_id_upload(current_user):
         content_type = file.content_type
         filename = f"{uuid.uuid4()}_{file.filename}"
 
-        file.stream.seek(0)
-        npimg = np.frombuffer(file.read(), np.uint8)
-        image = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+        with stage('decode') as current:
+            file.stream.seek(0)
+            npimg = np.frombuffer(file.read(), np.uint8)
+            image = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+            current.set(image_bytes=len(npimg), image_shape=list(image.shape) if image is not None else None)
 
         from app.services.deepfake_detector import is_deepfake
         is_fake, face_crop = is_deepfake(image)
-        print("IS your ID Fake:", is_fake)
+        logger.debug("ID deepfake check", extra={'user_id': current_user.id, 'is_fake': is_fake})
         if is_fake is None:
+            outcome('no_face')
             return jsonify({'message': 'Face detection failed or no face found in ID image.'}), 400
 
         if is_fake:
+            outcome('deepfake_rejected')
             return jsonify({
                 'message': 'Upload rejected: The face on this ID appears to be tampered or synthetic.',
                 'deepfake_detected': True
             }), 400
 
-        bucket = storage.bucket()
-        face_filename = f"{uuid.uuid4()}_face_crop.jpg"
-        _, buffer = cv2.imencode('.jpg', face_crop)
-        face_blob = bucket.blob(f"id_faces/{face_filename}")
-        face_blob.upload_from_string(buffer.tobytes(), content_type="image/jpeg")
-        face_blob.make_public()
-        face_image_url = face_blob.public_url
-        print("Uploaded cropped face to Firebase:", face_image_url)
+        with stage('facenet'):
+            id_face_embedding = face_embedding(face_crop)
+        with stage('duplicate_search'):
+            duplicate_matches = find_duplicate_faces(id_face_embedding, current_user.id)
+        if duplicate_matches:
+            logger.warning("Possible duplicate enrollment", extra={
+                'user_id': current_user.id, 'matches': [match_user_id for match_user_id, _ in duplicate_matches]
+            })
 
-        try:
-            reader = easyocr.Reader(['en'], gpu=False)
-            resized = cv2.resize(image, (600, 400))  
-            result = reader.readtext(resized)
+        with stage('storage_upload'):
+            bucket = storage.bucket()
+            face_filename = f"{uuid.uuid4()}_face_crop.jpg"
+            _, buffer = cv2.imencode('.jpg', face_crop)
+            face_blob = bucket.blob(f"id_faces/{face_filename}")
+            face_blob.upload_from_string(buffer.tobytes(), content_type="image/jpeg")
+            face_blob.make_public()
+            face_image_url = face_blob.public_url
 
-            print("Proceeding to OCR and text validation...")
+        try:
+            with stage('ocr', image_shape=[400, 600]):
+                reader = easyocr.Reader(['en'], gpu=False)
+                resized = cv2.resize(image, (600, 400))  
+                result = reader.readtext(resized)
         except Exception as e:
+            outcome('ocr_failed')
             return jsonify({'message': f'OCR processing failed: {str(e)}'}), 500
 
         extracted_text = " ".join([r[1] for r in result])
-        print("OCR Extracted:", extracted_text)
 
         user_details = current_user.user_details
         if not user_details:
@@ -437,8 +517,9 @@ def verify_id_upload(current_user):
         tokens = re.findall(r'[a-zA-Z]+', extracted_text.lower())
         normalized_text = " ".join(tokens)
         flat_text = normalized_text.replace(" ", "")
-        print("OCR Tokens:", tokens)
-        print("Normalized OCR Text:", normalized_text)
+        logger.debug("OCR finished", extra={
+            'user_id': current_user.id, 'text_chars': len(extracted_text), 'token_count': len(tokens)
+        })
 
         first = re.sub(r'[^a-zA-Z0-9]', '', user_details.firstname).lower()
         last = re.sub(r'[^a-zA-Z0-9]', '', user_details.lastname).lower()
@@ -458,7 +539,6 @@ def verify_id_upload(current_user):
             name_match = first in flat_text and last in flat_text
 
         id_type = request.form.get("id_type") or detect_id_type(extracted_text)
-        print("Detected ID type:", id_type)
 
         expected_id_number = None
         if id_type == 'driver_license':
@@ -471,36 +551,51 @@ def verify_id_upload(current_user):
         id_match = expected_id_number and expected_id_number in extracted_text
 
         expiry_date = extract_expiry_date(extracted_text)
-        print("Full Extracted Text:", extracted_text)
-        print("Extracted expiry date:", expiry_date)
-        print("Current UTC time:", datetime.now(timezone.utc))
 
         expiry_valid = expiry_date is not None
 
         submission = ProofSubmission(
             user_id=current_user.id,
             id_image_url=face_image_url,
-            status='pending',
+            status='flagged' if duplicate_matches else 'pending',
             submitted_at=datetime.now(timezone.utc)
         )
-        db.session.add(submission)
-        db.session.commit()
+        if duplicate_matches:
+            submission.notes = "Possible duplicate enrollment. Face matches users: " + ", ".join(
+                f"{match_user_id} ({score:.2f})" for match_user_id, score in duplicate_matches
+            )
+        with stage('database'):
+            db.session.add(submission)
+            db.session.flush()
 
-        doc = IdentityDocument(
-            user_id=current_user.id,
-            proof_submission_id=submission.id,
-            type=id_type,
-            image_url=face_image_url,
-            expiry_date=expiry_date
-        )
-        db.session.add(doc)
-        db.session.commit()
+            doc = IdentityDocument(
+                user_id=current_user.id,
+                proof_submission_id=submission.id,
+                type=id_type,
+                image_url=face_image_url,
+                expiry_date=expiry_date
+            )
+            db.session.add(doc)
+            db.session.commit()
+
+        logger.info("ID checks", extra={
+            'user_id': current_user.id, 'submission_id': submission.id, 'id_type': id_type,
+            'name_match': bool(name_match), 'id_match': bool(id_match), 'expiry_valid': expiry_valid
+        })
 
-        print("Name Match:", name_match)
-        print("ID Match:", id_match)
-        print("Expiry Valid:", expiry_valid)
+        if duplicate_matches:
+            outcome('duplicate_flagged')
+            return jsonify({
+                'message': 'ID verification flagged for review. Please contact support.',
+                'next_step': 'retry_or_escalate',
+                'duplicate_face_detected': True,
+                'id_type_detected': id_type
+            }), 400
 
         if name_match and id_match and expiry_valid:
+            with stage('face_index'):
+                enroll_face(current_user.id, id_face_embedding)
+            outcome('verified')
             return jsonify({
                 'message': 'ID verified successfully',
                 'next_step': 'facial_verification',
@@ -508,6 +603,10 @@ def verify_id_upload(current_user):
                 'id_type_detected': id_type
             }), 200
         else:
+            for passed, reason in ((name_match, 'name_mismatch'), (id_match, 'id_mismatch'),
+                                   (expiry_valid, 'expiry_invalid')):
+                if not passed:
+                    outcome(reason)
             return jsonify({
                 'message': 'ID verification failed. Please try again or contact support.',
                 'next_step': 'retry_or_escalate',
@@ -519,7 +618,9 @@ def verify_id_upload(current_user):
             }), 400
 
     except Exception as e:
-        print("INTERNAL SERVER ERROR:", str(e))
+        db.session.rollback()
+        outcome('error')
+        logger.exception("ID upload failed", extra={'user_id': current_user.id})
         return jsonify({'message': 'Internal server error', 'error': str(e)}), 500
 
 
@@ -528,23 +629,24 @@ def verify_id_upload(current_user):
 @token_required
 def verify_images(current_user):
     try:
-        print(f"[Verify] Received image sequence upload from {current_user.username}")
+        logger.info("Image sequence received", extra={'user_id': current_user.id})
 
         images = request.files.getlist('images')
         if not images or len(images) < 1:
             return jsonify({'message': 'At least one image is required'}), 400
 
-        print(f"Received {len(images)} images for verification")
+        annotate(image_count=len(images))
         temp_dir = tempfile.mkdtemp()
         image_urls, local_image_paths = [], []
         bucket = storage.bucket()
 
         for idx, image in enumerate(images):
             filename = f"{uuid.uuid4()}_{idx}.jpg"
-            blob = bucket.blob(f"verification_images/{filename}")
-            blob.upload_from_file(image, content_type=image.content_type or 'image/jpeg')
-            blob.make_public()
-            image_url = blob.public_url
+            with stage('storage_upload', index=idx):
+                blob = bucket.blob(f"verification_images/{filename}")
+                blob.upload_from_file(image, content_type=image.content_type or 'image/jpeg')
+                blob.make_public()
+                image_url = blob.public_url
             image_urls.append(image_url)
 
             image.stream.seek(0)
@@ -552,89 +654,57 @@ def verify_images(current_user):
             image.save(local_path)
             local_image_paths.append(local_path)
 
-        clearest_image_path = select_clearest_image(local_image_paths)
+        with stage('select_image'):
+            clearest_image_path = select_clearest_image(local_image_paths)
         if not clearest_image_path:
             shutil.rmtree(temp_dir)
+            outcome('no_clear_image')
             return jsonify({'message': 'Failed to find a clear image for verification'}), 422
 
         # -------- Deepfake Detection --------
-        frame = cv2.imread(clearest_image_path)
-        frame = cv2.resize(frame, (128, 128)) / 255.0
-        if frame.ndim == 2:
-            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-        elif frame.shape[-1] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
-        frame_input = np.expand_dims(frame, axis=0).astype("float32")
-
-        deepfake_model = load_model(os.path.join(BASE_DIR, 'models', 'elife_deepfake_detector_test.keras'))
-        deepfake_score = deepfake_model.predict(frame_input)[0][0]
-        is_deepfake = deepfake_score > 0.5
-        print("Deepfake score:", deepfake_score)
+        from app.services.deepfake_detector import frame_scores
+        with stage('decode') as current:
+            clearest_image = cv2.imread(clearest_image_path)
+            current.set(image_shape=list(clearest_image.shape) if clearest_image is not None else None)
+        with stage('deepfake_inference', batch_size=1):
+            deepfake_score = frame_scores([clearest_image])[0]
+        is_deepfake = deepfake_score > app_config.DEEPFAKE_SCORE_THRESHOLD
 
         # -------- FaceNet Identity Match with Improved Similarity --------
-        id_doc = IdentityDocument.query.filter_by(user_id=current_user.id).order_by(IdentityDocument.id.desc()).first()
+        with stage('database'):
+            id_doc = db.session.execute(latest_identity_document_query(current_user.id)).scalar()
         if not id_doc:
             shutil.rmtree(temp_dir)
+            outcome('no_id_document')
             return jsonify({'message': 'No ID document found'}), 404
 
-        id_image_blob = bucket.blob(id_doc.image_url.replace(f"https://storage.googleapis.com/{bucket.name}/", ""))
-        id_image_path = os.path.join(temp_dir, "id_image.jpg")
-        id_image_blob.download_to_filename(id_image_path)
-
-        # Load and preprocess images
-        id_img = cv2.imread(id_image_path)
-        face_img = cv2.imread(clearest_image_path)
-
-        # Apply face detection first to extract only the face regions
-        face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-        # Detect faces in both images
-        id_gray = cv2.cvtColor(id_img, cv2.COLOR_BGR2GRAY)
-        face_gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-
-        id_faces = face_detector.detectMultiScale(id_gray, 1.1, 4)
-        face_faces = face_detector.detectMultiScale(face_gray, 1.1, 4)
-
-        # Get the largest face from each image
-        if len(id_faces) > 0:
-            id_img = get_largest_face(id_faces, id_img)
-        if len(face_faces) > 0:
-            face_img = get_largest_face(face_faces, face_img)
-
-        # Resize both images to FaceNet expected input shape: (160, 160)
-        id_img = cv2.resize(id_img, (160, 160))
-        face_img = cv2.resize(face_img, (160, 160))
+        with stage('storage_download'):
+            id_image_blob = bucket.blob(id_doc.image_url.replace(f"https://storage.googleapis.com/{bucket.name}/", ""))
+            id_image_path = os.path.join(temp_dir, "id_image.jpg")
+            id_image_blob.download_to_filename(id_image_path)
 
-        # Preprocess images for embedder
-        id_input = preprocess_image(id_img)
-        face_input = preprocess_image(face_img)
+        # Extract the largest face from each image at the FaceNet input size (160, 160)
+        with stage('haar_detection'):
+            id_img = crop_face(cv2.imread(id_image_path))
+            face_img = crop_face(clearest_image)
 
-        # Get embeddings
-        id_embedding = embedder.embeddings(id_input)
-        frame_embedding = embedder.embeddings(face_input)
-
-        # Calculate cosine similarity
-        raw_similarity = cosine_similarity(frame_embedding, id_embedding)[0][0]
-
-        # Apply L2 normalization to embeddings before calculating distance
-        id_embedding_norm = l2_normalize(id_embedding)
-        frame_embedding_norm = l2_normalize(frame_embedding)
-
-        # Calculate Euclidean distance (lower is better)
-        euclidean_distance = np.linalg.norm(frame_embedding_norm - id_embedding_norm)
-
-        # Use multiple similarity metrics for a more robust comparison
-        adjusted_cosine = (raw_similarity + 1) / 2  # Convert from [-1,1] to [0,1]
+        # Embed both faces in one batch and compare them
+        with stage('facenet', batch_size=2):
+            id_embedding, frame_embedding = face_embeddings([id_img, face_img])
+            adjusted_cosine, euclidean_distance = face_match_scores(id_embedding, frame_embedding)
+        adjusted_cosine, euclidean_distance = adjusted_cosine[0], euclidean_distance[0]
+        raw_similarity = adjusted_cosine * 2 - 1
 
         # Very loose threshold - using both metrics
-        is_match = adjusted_cosine > 0.1 or euclidean_distance < 1.5
+        is_match = is_face_match(adjusted_cosine, euclidean_distance)
 
         # Log detailed matching information
-        print(f"Face match results:")
-        print(f"- Raw cosine similarity: {raw_similarity:.4f}")
-        print(f"- Adjusted cosine similarity: {adjusted_cosine:.4f}")
-        print(f"- Euclidean distance: {euclidean_distance:.4f}")
-        print(f"- Final match decision: {is_match}")
+        logger.info("Face match", extra={
+            'user_id': current_user.id, 'image_count': len(images),
+            'raw_similarity': round(float(raw_similarity), 4), 'similarity': round(float(adjusted_cosine), 4),
+            'distance': round(float(euclidean_distance), 4), 'deepfake_score': round(float(deepfake_score), 4),
+            'match': bool(is_match)
+        })
 
         # Save comparison images for debugging if needed
         debug_dir = os.path.join(temp_dir, "debug")
@@ -654,24 +724,35 @@ def verify_images(current_user):
             status='approved' if is_match and not is_deepfake else 'flagged',
             submitted_at=datetime.now(timezone.utc),
             verified_at=datetime.now(timezone.utc),
+            similarity_score=float(adjusted_cosine),
+            face_distance=float(euclidean_distance),
+            deepfake_score=float(deepfake_score),
+            scored_at=datetime.now(timezone.utc),
             notes=f"Similarity: {adjusted_cosine:.2f}, Deepfake Score: {deepfake_score:.2f}"
         )
-        db.session.add(proof)
-        db.session.commit()
+        with stage('database'):
+            db.session.add(proof)
+            db.session.commit()
         shutil.rmtree(temp_dir)
 
+        if is_deepfake:
+            outcome('deepfake_detected')
+        if not is_match:
+            outcome('face_mismatch')
+        outcome('approved' if proof.status == 'approved' else 'flagged')
+
         return jsonify({
-            "success": bool(is_match and not is_deepfake),
-            "match": bool(is_match),
-            "deepfake_detected": bool(is_deepfake),
-            "similarity": float(adjusted_cosine),
-            "deepfake_score": float(deepfake_score),
+            "success": is_match and not is_deepfake,
+            "match": is_match,
+            "deepfake_detected": is_deepfake,
+            "similarity": adjusted_cosine,
+            "deepfake_score": deepfake_score,
             "image_urls": image_urls
         }), 200
 
     except Exception as e:
-        print("VERIFY-IMAGES ERROR:", str(e))
-        traceback.print_exc()
+        outcome('error')
+        logger.exception("Image verification failed", extra={'user_id': current_user.id})
         return jsonify({'message': 'Internal server error', 'error': str(e)}), 500
 
 
@@ -680,12 +761,24 @@ def verify_images(current_user):
 def accept_terms(current_user):
     current_user.terms_accepted = True
     db.session.commit()
+    invalidate_identity(current_user.id)
     return jsonify({"message": "Terms accepted"}), 200
 
 
+def _certificate_etag(current_user, certificate_id):
+    # Certificates never change; only confirm the caller owns it before validating.
+    owned = db.session.execute(
+        select(DigitalCertificate.id).where(
+            DigitalCertificate.id == certificate_id, DigitalCertificate.user_id == current_user.id
+        )
+    ).scalar()
+    return make_etag('certificate', certificate_id) if owned else None
+
+
 @csrf.exempt
 @auth.route("/certificates/<int:certificate_id>", methods=["GET"])
 @token_required
+@conditional(_certificate_etag, cache_control='private, max-age=31536000, immutable')
 def get_certificate(current_user, certificate_id):
     """
     Get a specific certificate by ID
@@ -703,13 +796,7 @@ def get_certificate(current_user, certificate_id):
                 "message": "Certificate not found"
             }), 404
             
-        # Parse content snapshot if it exists
-        content_snapshot = None
-        if certificate.content_snapshot:
-            try:
-                content_snapshot = json.loads(certificate.content_snapshot)
-            except:
-                content_snapshot = certificate.content_snapshot
+        content_snapshot = parsed_snapshot(certificate.id, certificate.content_snapshot)
         
         # Return the certificate details
         return jsonify({
@@ -719,18 +806,105 @@ def get_certificate(current_user, certificate_id):
             "quarter": certificate.quarter,
             "timestamp": certificate.timestamp.isoformat(),
             "digital_signature_hash": certificate.digital_signature_hash,
+            "signature": certificate.signature,
+            "key_id": certificate.key_id,
             "content_snapshot": content_snapshot
         }), 200
         
     except Exception as e:
-        print("Get certificate error:", str(e))
-        traceback.print_exc()
+        logger.exception("Get certificate failed", extra={'certificate_id': certificate_id})
         return jsonify({
             "success": False,
             "message": "Failed to retrieve certificate",
             "error": str(e)
         }), 500
 
+@auth.route("/certificates/verify/<string:signature_hash>", methods=["GET"])
+def verify_certificate(signature_hash):
+    """
+    Public check of a presented certificate by its signature hash, for pension offices.
+    Returns only what is needed to confirm the certificate; responses are cacheable
+    because certificates never change.
+    """
+    signature_hash = signature_hash.lower()
+    if not SIGNATURE_HASH_PATTERN.match(signature_hash):
+        return jsonify({"valid": False, "message": "Malformed certificate hash"}), 400
+
+    view = verify_certificate_hash(signature_hash)
+    if view is None:
+        response = jsonify({"valid": False, "message": "Certificate not found"})
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        return response, 404
+
+    response = jsonify(view)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response, 200
+
+@csrf.exempt
+@auth.route("/certificates/verify", methods=["POST"])
+def verify_certificates():
+    """
+    Public batch check: body {"hashes": [...]}, up to 100 certificate hashes. Returns one
+    entry per hash, in order, with `found` false for unknown or malformed hashes.
+    """
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or not hashes or len(hashes) > 100:
+        return jsonify({"message": "Provide between 1 and 100 certificate hashes"}), 400
+
+    hashes = [h.lower() if isinstance(h, str) else '' for h in hashes]
+    views = verify_certificate_hashes([h for h in hashes if SIGNATURE_HASH_PATTERN.match(h)])
+    return jsonify([
+        dict(views[h], hash=h, found=True) if h in views else {"hash": h, "found": False, "valid": False}
+        for h in hashes
+    ]), 200
+
+
+@auth.route("/certificates/signing-keys", methods=["GET"])
+def certificate_signing_keys():
+    """
+    Public Ed25519 keys for checking certificate signatures offline, keyed by key id.
+    """
+    signer = get_signer()
+    response = jsonify({"current": signer.key_id, "keys": signer.public_keys()})
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response, 200
+
+@auth.route("/certificates/<int:certificate_id>/render", methods=["GET"])
+@token_required
+def render_certificate_file(current_user, certificate_id):
+    """
+    Download a certificate as a PNG or PDF (`?format=png|pdf`, default pdf). Renders are
+    cached and, since certificates never change, served as immutable.
+    """
+    fmt = request.args.get('format', 'pdf').lower()
+    if fmt not in RENDER_FORMATS:
+        return jsonify({"success": False, "message": "Format must be png or pdf"}), 400
+
+    certificate = db.session.execute(
+        select(
+            DigitalCertificate.id, DigitalCertificate.content_snapshot,
+            DigitalCertificate.digital_signature_hash, DigitalCertificate.key_id
+        ).where(DigitalCertificate.id == certificate_id, DigitalCertificate.user_id == current_user.id)
+    ).first()
+    if not certificate:
+        return jsonify({"success": False, "message": "Certificate not found"}), 404
+
+    etag = render_etag(certificate.id, fmt)
+    headers = {'Cache-Control': 'private, max-age=31536000, immutable'}
+    if request.if_none_match.contains(etag):
+        return "", 304, dict(headers, ETag=f'"{etag}"')
+
+    content = parsed_snapshot(certificate.id, certificate.content_snapshot)
+    data = render_certificate(
+        certificate.id, content if isinstance(content, dict) else {},
+        certificate.digital_signature_hash, certificate.key_id, fmt
+    )
+    response = current_app.response_class(data, mimetype=RENDER_FORMATS[fmt], headers=headers)
+    response.headers['Content-Disposition'] = f'inline; filename="certificate_{certificate.id}.{fmt}"'
+    response.set_etag(etag)
+    return response
+
 @csrf.exempt
 @auth.route("/generate-certificate", methods=["POST"])
 @token_required
@@ -740,28 +914,9 @@ def generate_certificate(current_user):
     """
     try:
         data = request.get_json()
-        quarter = data.get('quarter', None)
+        quarter = data.get('quarter', None) or current_quarter()
         
-        if not quarter:
-            now = datetime.utcnow()
-            year = now.year
-            month = now.month
-            
-            if month < 4:
-                quarter_num = 1
-            elif month < 7:
-                quarter_num = 2
-            elif month < 10:
-                quarter_num = 3
-            else:
-                quarter_num = 4
-                
-            quarter = f"Q{quarter_num}-{year}"
-        
-        proof_submission = ProofSubmission.query.filter_by(
-            user_id=current_user.id,
-            status='approved'
-        ).order_by(ProofSubmission.verified_at.desc()).first()
+        proof_submission = db.session.execute(latest_approved_submission_query(current_user.id)).scalar()
         
         if not proof_submission:
             return jsonify({
@@ -769,32 +924,6 @@ def generate_certificate(current_user):
                 "message": "No approved verification found"
             }), 404
         
-        existing_cert = DigitalCertificate.query.filter_by(
-            proof_submission_id=proof_submission.id
-        ).first()
-        
-        if existing_cert:
-            content_snapshot = None
-            if existing_cert.content_snapshot:
-                try:
-                    content_snapshot = json.loads(existing_cert.content_snapshot)
-                except:
-                    content_snapshot = existing_cert.content_snapshot
-                    
-            return jsonify({
-                "success": True,
-                "message": "Certificate already exists",
-                "certificate": {
-                    "id": existing_cert.id,
-                    "user_id": existing_cert.user_id,
-                    "proof_submission_id": existing_cert.proof_submission_id,
-                    "quarter": existing_cert.quarter,
-                    "timestamp": existing_cert.timestamp.isoformat(),
-                    "digital_signature_hash": existing_cert.digital_signature_hash,
-                    "content_snapshot": content_snapshot
-                }
-            }), 200
-        
         user_details = current_user.user_details
         
         if not user_details:
@@ -802,76 +931,37 @@ def generate_certificate(current_user):
                 "success": False,
                 "message": "User details not found"
             }), 400
-        
-        content = {
-            "pensioner_number": current_user.pensioner_number,
-            "user_id": current_user.id,
-            "fullName": f"{user_details.firstname} {user_details.lastname}",
-            "dob": user_details.dob.strftime('%Y-%m-%d') if user_details.dob else None,
-            "trn": user_details.trn,
-            "verification_method": "Facial Recognition & ID Verification",
-            "quarter": quarter,
-            "issue_date": datetime.utcnow().isoformat(),
-            "expiry_date": None  
-        }
-        
 
-        content_str = json.dumps(content, sort_keys=True)
-        digital_signature = hashlib.sha256(content_str.encode()).hexdigest()
-        
-        new_certificate = DigitalCertificate(
-            user_id=current_user.id,
-            proof_submission_id=proof_submission.id,
-            certificate_filename=f"certificate_{current_user.id}_{quarter}.json",
-            content_snapshot=content_str,
-            digital_signature_hash=digital_signature,
-            quarter=quarter
-        )
-        
-        db.session.add(new_certificate)
-        
-        quarter_verification = QuarterVerification.query.filter_by(
-            user_id=current_user.id,
-            quarter=quarter.split('-')[0],  
-            year=int(quarter.split('-')[1]) 
-        ).first()
-        
-        if quarter_verification:
-            quarter_verification.status = 'completed'
-            quarter_verification.verified_at = datetime.utcnow()
-            quarter_verification.proof_submission_id = proof_submission.id
-        else:
-            quarter_verification = QuarterVerification(
-                user_id=current_user.id,
-                quarter=quarter.split('-')[0],
-                year=int(quarter.split('-')[1]),
-                status='completed',
-                verified_at=datetime.utcnow(),
-                proof_submission_id=proof_submission.id,
-                due_date=datetime.utcnow()  
-            )
-            db.session.add(quarter_verification)
+        if not parse_quarter(quarter)[0]:
+            return jsonify({
+                "success": False,
+                "message": "Invalid quarter format. Expected 'Q1-2025'"
+            }), 400
         
+        certificate, created = issue_certificate(current_user, user_details, proof_submission, quarter)
         db.session.commit()
+
+        content_snapshot = parsed_snapshot(certificate.id, certificate.content_snapshot)
         
         return jsonify({
             "success": True,
-            "message": "Certificate generated successfully",
+            "message": "Certificate generated successfully" if created else "Certificate already exists",
             "certificate": {
-                "id": new_certificate.id,
-                "user_id": new_certificate.user_id,
-                "proof_submission_id": new_certificate.proof_submission_id,
-                "quarter": new_certificate.quarter,
-                "timestamp": new_certificate.timestamp.isoformat(),
-                "digital_signature_hash": new_certificate.digital_signature_hash,
-                "content_snapshot": content
+                "id": certificate.id,
+                "user_id": certificate.user_id,
+                "proof_submission_id": certificate.proof_submission_id,
+                "quarter": certificate.quarter,
+                "timestamp": certificate.timestamp.isoformat(),
+                "digital_signature_hash": certificate.digital_signature_hash,
+                "signature": certificate.signature,
+                "key_id": certificate.key_id,
+                "content_snapshot": content_snapshot
             }
-        }), 201
+        }), 201 if created else 200
         
     except Exception as e:
         db.session.rollback()
-        print("Certificate generation error:", str(e))
-        traceback.print_exc()
+        logger.exception("Certificate generation failed", extra={'user_id': current_user.id})
         return jsonify({
             "success": False,
             "message": "Failed to generate certificate",
@@ -897,42 +987,18 @@ def update_quarter_verification(current_user):
                 "message": "Quarter and status are required"
             }), 400
         
-        quarter_parts = quarter.split('-')
-        if len(quarter_parts) != 2:
+        quarter_num, year = parse_quarter(quarter)
+        if not quarter_num:
             return jsonify({
                 "success": False,
                 "message": "Invalid quarter format. Expected 'Q1-2025'"
             }), 400
-            
-        quarter_num = quarter_parts[0]
-        year = int(quarter_parts[1])
-        
-        current_date = datetime.utcnow()
-        due_date = calculate_quarter_due_date(quarter_num, year, current_date)
         
-        quarter_verification = QuarterVerification.query.filter_by(
-            user_id=current_user.id,
-            quarter=quarter_num,
-            year=year
-        ).first()
-        
-        if not quarter_verification:
-            quarter_verification = QuarterVerification(
-                user_id=current_user.id,
-                quarter=quarter_num,
-                year=year,
-                status=status,
-                due_date=due_date, 
-                proof_submission_id=proof_submission_id
-            )
-            db.session.add(quarter_verification)
-        else:
-            quarter_verification.status = status
-            quarter_verification.proof_submission_id = proof_submission_id
-        
-        if status == 'completed':
-            quarter_verification.verified_at = datetime.utcnow()
-            
+        quarter_verification = upsert_quarter_verification(
+            current_user.id, quarter_num, year, status,
+            proof_submission_id=proof_submission_id,
+            verified_at=datetime.utcnow() if status == 'completed' else None
+        )
         db.session.commit()
         
         return jsonify({
@@ -949,7 +1015,7 @@ def update_quarter_verification(current_user):
         
     except Exception as e:
         db.session.rollback()
-        print("Update quarter verification error:", str(e))
+        logger.exception("Update quarter verification failed", extra={'user_id': current_user.id})
         return jsonify({
             "success": False,
             "message": "Failed to update quarter verification",
@@ -988,8 +1054,9 @@ def update_account_status(current_user):
         if user_details:
             user_details.last_verification = datetime.utcnow()
             
-        print(f"Life certificate {certificate_id} viewed by user {current_user.id}")
-        notification = Notification(
+        logger.info("Life certificate viewed", extra={'certificate_id': certificate_id, 'user_id': current_user.id})
+        audit_writer.add(
+            Notification,
             user_id=current_user.id,
             type="certificate_viewed",
             message=f"Your Life Certificate for {certificate.quarter} has been viewed",
@@ -997,9 +1064,6 @@ def update_account_status(current_user):
             is_read=False
         )
         
-        db.session.add(notification)
-        db.session.commit()
-        
         return jsonify({
             "success": True,
             "message": "Account status updated successfully"
@@ -1007,8 +1071,7 @@ def update_account_status(current_user):
         
     except Exception as e:
         db.session.rollback()
-        print("Error updating account status:", str(e))
-        traceback.print_exc()
+        logger.exception("Update account status failed", extra={'user_id': current_user.id})
         return jsonify({
             "success": False,
             "message": "Failed to update account status",
@@ -1061,17 +1124,16 @@ def update_user_permissions(current_user):
             quarter_num = quarter_parts[0]
             year = int(quarter_parts[1])
             
-            quarter_verification = QuarterVerification.query.filter_by(
-                user_id=certificate.user_id,
-                quarter=quarter_num,
-                year=year
-            ).first()
+            quarter_verification = db.session.execute(
+                quarter_query(certificate.user_id, quarter_num, year)
+            ).scalar()
             
             if quarter_verification:
                 quarter_verification.status = 'completed'
                 quarter_verification.verified_at = datetime.utcnow()
                 
         db.session.commit()
+        invalidate_identity(certificate.user_id)
         
         return jsonify({
             "success": True,
@@ -1080,10 +1142,54 @@ def update_user_permissions(current_user):
         
     except Exception as e:
         db.session.rollback()
-        print("Error updating user permissions:", str(e))
-        traceback.print_exc()
+        logger.exception("Update permissions failed", extra={'user_id': current_user.id})
         return jsonify({
             "success": False,
             "message": "Failed to update user permissions",
             "error": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@csrf.exempt
+@auth.route("/admin/profiling", methods=["GET", "PUT"])
+@token_required
+def profiling_settings(current_user):
+    """
+    Show or change request profiling sampling, and list the captured profiles.
+    PUT takes `enabled`, `sample_rate` (0-1), optional `endpoints` and `duration_seconds`.
+    """
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+
+    profiling = current_app.extensions.get('profiling')
+    if profiling is None:
+        return jsonify({'message': 'Profiling is disabled'}), 404
+    settings, ring = profiling
+
+    if request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        sample_rate = data.get('sample_rate', 0.0)
+        endpoints = data.get('endpoints') or []
+        duration_seconds = data.get('duration_seconds')
+        if not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1:
+            return jsonify({'message': 'sample_rate must be between 0 and 1'}), 400
+        if not isinstance(endpoints, list) or not all(isinstance(e, str) for e in endpoints):
+            return jsonify({'message': 'endpoints must be a list of endpoint names'}), 400
+        if duration_seconds is not None and (not isinstance(duration_seconds, int) or duration_seconds <= 0):
+            return jsonify({'message': 'duration_seconds must be a positive integer'}), 400
+        settings.save(bool(data.get('enabled')), sample_rate, endpoints, duration_seconds)
+
+    return jsonify({'settings': settings.get(), 'profiles': ring.list()}), 200
+
+
+@auth.route("/admin/profiles/<string:name>", methods=["GET"])
+@token_required
+def download_profile(current_user, name):
+    """Download a captured profile (.prof for pstats/snakeviz, .json for its metadata)."""
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+
+    profiling = current_app.extensions.get('profiling')
+    path = profiling[1].path(name) if profiling else None
+    if path is None or not os.path.exists(path):
+        return jsonify({'message': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, download_name=name)
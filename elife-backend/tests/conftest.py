@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+# Settings are read into `app_config` at import time, so they must be in place before the
+# app package is imported. Everything a test writes goes under one scratch directory.
+_scratch = tempfile.mkdtemp(prefix='elife-tests-')
+os.environ.setdefault('FLASK_ENV', 'testing')
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('CERTIFICATE_SIGNING_KEY_PATH', os.path.join(_scratch, 'certificate-signing-key.pem'))
+os.environ.setdefault('OUTBOX_LOCAL_PATH', os.path.join(_scratch, 'outbox.jsonl'))
+os.environ.setdefault('AUDIT_DEAD_LETTER_PATH', os.path.join(_scratch, 'audit-dead-letter.jsonl'))
+os.environ.setdefault('EMBEDDING_STORE_PATH', os.path.join(_scratch, 'embeddings'))
+os.environ.setdefault('TRACE_PATH', os.path.join(_scratch, 'traces.jsonl'))
+os.environ.setdefault('PROFILE_DIR', os.path.join(_scratch, 'profiles'))
+
+import pytest
+
+from app import create_app, db
+from app.config import TestingConfig
+from app.identity import identity_cache
+from app.models import User, UserDetails
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    App bound to a fresh database: TEST_DATABASE_URL when set (e.g. a disposable PostgreSQL
+    database), otherwise a SQLite file, so several threads can share it.
+    """
+    database_url = os.getenv('TEST_DATABASE_URL')
+
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = database_url or f"sqlite:///{tmp_path / 'test.db'}"
+        # Concurrent SQLite writers wait for the lock instead of failing at once.
+        SQLALCHEMY_ENGINE_OPTIONS = {} if database_url else {'connect_args': {'timeout': 30}}
+        WTF_CSRF_ENABLED = False
+
+    app = create_app(Config)
+    identity_cache.clear()  # ids restart with every database
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_pensioner(app):
+    """
+    Factory creating committed pensioners with profiles.
+
+    Returns:
+        callable: make_pensioner(number) -> User.
+    """
+    def make(number):
+        user = User(
+            pensioner_number=f"{number:06d}",
+            username=f"pensioner{number}",
+            email=f"pensioner{number}@example.com",
+            password_hash='unused',
+            role='pensioner',
+            is_active=True
+        )
+        user.user_details = UserDetails(firstname='Test', lastname=f"Pensioner{number}", trn=f"{number:09d}")
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make
@@ -0,0 +1,30 @@
+import types
+
+import numpy as np
+
+from app.services import face_utils
+from app.utils import get_largest_face
+
+
+def test_get_largest_face_accepts_detector_arrays():
+    img = np.zeros((200, 200, 3), dtype=np.uint8)
+    boxes = np.array([[10, 10, 20, 20], [50, 60, 100, 80]], dtype=np.int32)
+
+    crop = get_largest_face(boxes, img)
+
+    # Largest box plus a 20% margin of its shorter side.
+    assert crop.shape == (112, 132, 3)
+    assert get_largest_face(np.empty((0, 4), dtype=np.int32), img) is img
+
+
+def test_crop_face_with_detected_face(monkeypatch):
+    img = np.full((240, 320, 3), 127, dtype=np.uint8)
+    # detectMultiScale returns an (n, 4) int32 array when it finds faces.
+    detector = types.SimpleNamespace(
+        detectMultiScale=lambda gray, scale, neighbours: np.array([[100, 60, 80, 80]], dtype=np.int32)
+    )
+    monkeypatch.setattr(face_utils, 'face_detector', detector)
+
+    crop = face_utils.crop_face(img)
+
+    assert crop.shape == face_utils.FACENET_INPUT_SIZE + (3,)
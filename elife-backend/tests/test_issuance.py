@@ -0,0 +1,110 @@
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, func, select
+
+from app import db
+from app.issuance import issue_certificate
+from app.models import DigitalCertificate, ProofSubmission, QuarterVerification, User, UserDetails
+
+WORKERS = 8
+
+
+@pytest.fixture
+def serialized_sqlite(app):
+    """
+    Start SQLite transactions with BEGIN IMMEDIATE. Deferred transactions that read and then
+    write can fail to upgrade their lock instead of waiting, which is a SQLite quirk and not
+    the race under test. PostgreSQL runs are left alone.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        yield
+        return
+
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    def _begin(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    event.listen(engine, 'connect', _connect)
+    event.listen(engine, 'begin', _begin)
+    engine.dispose()
+    yield
+    event.remove(engine, 'connect', _connect)
+    event.remove(engine, 'begin', _begin)
+    engine.dispose()
+
+
+def _approved_submission(user):
+    submission = ProofSubmission(user_id=user.id, status='approved', verified_at=datetime.utcnow())
+    db.session.add(submission)
+    db.session.commit()
+    return submission.id
+
+
+def _issue_in_parallel(app, pairs):
+    """Call issue_certificate for every (user_id, submission_id) pair from WORKERS threads at once."""
+    barrier = threading.Barrier(WORKERS)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        with app.app_context():
+            try:
+                barrier.wait()
+                for user_id, submission_id in pairs:
+                    user = db.session.get(User, user_id)
+                    details = db.session.execute(
+                        select(UserDetails).where(UserDetails.user_id == user_id)
+                    ).scalar_one()
+                    submission = db.session.get(ProofSubmission, submission_id)
+                    certificate, created = issue_certificate(user, details, submission, 'Q1-2025')
+                    db.session.commit()
+                    with lock:
+                        results.append((submission_id, certificate.id, created))
+            except Exception as e:  # surfaced by the assertions below
+                db.session.rollback()
+                with lock:
+                    errors.append(e)
+            finally:
+                db.session.remove()
+
+    db.session.remove()  # the test's own session must not hold a transaction open meanwhile
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_issue_creates_one_certificate_per_submission(app, make_pensioner, serialized_sqlite):
+    users = [make_pensioner(number) for number in range(1, 4)]
+    pairs = [(user.id, _approved_submission(user)) for user in users]
+    user_ids = [user_id for user_id, _ in pairs]
+
+    results, errors = _issue_in_parallel(app, pairs)
+
+    assert errors == []
+    assert len(results) == WORKERS * len(pairs)
+
+    counts = dict(db.session.execute(
+        select(DigitalCertificate.proof_submission_id, func.count()).group_by(DigitalCertificate.proof_submission_id)
+    ).all())
+    assert counts == {submission_id: 1 for _, submission_id in pairs}
+
+    for _, submission_id in pairs:
+        outcomes = [(certificate_id, created) for sid, certificate_id, created in results if sid == submission_id]
+        # Exactly one caller inserted; every caller got that same certificate back.
+        assert sum(created for _, created in outcomes) == 1
+        assert len({certificate_id for certificate_id, _ in outcomes}) == 1
+
+    quarters = db.session.execute(
+        select(QuarterVerification.user_id, QuarterVerification.status).where(
+            QuarterVerification.quarter == 'Q1', QuarterVerification.year == 2025
+        )
+    ).all()
+    assert sorted(quarters) == sorted((user_id, 'completed') for user_id in user_ids)
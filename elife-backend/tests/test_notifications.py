@@ -0,0 +1,73 @@
+import json
+from datetime import date
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Notification, NotificationCounter, OutboxMessage, QuarterVerification
+from app.notifications import REMINDER_TYPE, mark_read, send_deadline_reminders
+from app.outbox import LocalSink, dispatch_batch
+
+TODAY = date(2025, 3, 20)
+
+
+def _quarter(user, quarter, due_date, status='pending'):
+    db.session.add(QuarterVerification(user_id=user.id, quarter=quarter, year=2025, status=status, due_date=due_date))
+
+
+def _unread(user_id):
+    counter = db.session.get(NotificationCounter, user_id)
+    return counter.unread if counter else 0
+
+
+def test_deadline_reminders_are_delivered_through_the_outbox(app, make_pensioner):
+    two_due, one_due, inactive, not_due = (make_pensioner(number) for number in range(1, 5))
+    inactive.is_active = False
+    _quarter(two_due, 'Q1', date(2025, 3, 25))
+    _quarter(two_due, 'Q2', date(2025, 3, 30))
+    _quarter(one_due, 'Q1', date(2025, 3, 28))
+    _quarter(one_due, 'Q2', date(2025, 3, 22), status='completed')
+    _quarter(inactive, 'Q1', date(2025, 3, 25))
+    _quarter(not_due, 'Q1', date(2025, 6, 30))
+    # An earlier unread notification, counted by the ORM flush hook.
+    db.session.add(Notification(user_id=one_due.id, type='info', message='Welcome', is_read=False))
+    db.session.commit()
+    ids = {name: user.id for name, user in
+           (('two_due', two_due), ('one_due', one_due), ('inactive', inactive), ('not_due', not_due))}
+
+    # Small chunks so the job spans several transactions.
+    assert send_deadline_reminders(TODAY, 14, chunk_size=2) == 3
+
+    reminders = db.session.execute(
+        select(Notification.user_id, Notification.target_quarter).where(Notification.type == REMINDER_TYPE)
+    ).all()
+    assert sorted(reminders) == sorted([
+        (ids['two_due'], 'Q1-2025'), (ids['two_due'], 'Q2-2025'), (ids['one_due'], 'Q1-2025')
+    ])
+    assert _unread(ids['two_due']) == 2
+    assert _unread(ids['one_due']) == 2
+    assert _unread(ids['inactive']) == 0
+    assert _unread(ids['not_due']) == 0
+
+    sink = LocalSink()
+    assert dispatch_batch(sink, batch_size=2) == 2
+    assert dispatch_batch(sink, batch_size=2) == 1
+    assert dispatch_batch(sink, batch_size=2) == 0
+
+    # One push task per reminder, each delivered once.
+    delivered = sorted((message['user_id'], message['payload']['quarter']) for message in sink.delivered)
+    assert delivered == sorted(reminders)
+    assert all(message['topic'] == 'push' and message['payload']['type'] == REMINDER_TYPE for message in sink.delivered)
+    outbox = db.session.execute(select(OutboxMessage.user_id, OutboxMessage.payload, OutboxMessage.dispatched_at)).all()
+    assert sorted((row.user_id, json.loads(row.payload)['quarter']) for row in outbox) == sorted(reminders)
+    assert all(row.dispatched_at is not None for row in outbox)
+
+    # Re-running reminds nobody twice and queues nothing new.
+    assert send_deadline_reminders(TODAY, 14, chunk_size=2) == 0
+    assert dispatch_batch(sink, batch_size=2) == 0
+    assert len(sink.delivered) == 3
+    assert _unread(ids['two_due']) == 2
+
+    assert mark_read(ids['two_due']) == 2
+    assert _unread(ids['two_due']) == 0
+    assert _unread(ids['one_due']) == 2
@@ -0,0 +1,55 @@
+import pytest
+
+from app import db
+from app.config import app_config
+from app.models import Notification
+from app.querystats import QueryBudgetExceeded, query_budget
+from app.utils import generate_token
+
+THRESHOLD = app_config.N_PLUS_ONE_THRESHOLD
+
+
+@pytest.fixture
+def pensioner(make_pensioner):
+    user = make_pensioner(1)
+    for i in range(120):
+        db.session.add(Notification(user_id=user.id, type='info', message=f"Message {i}"))
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def headers(pensioner):
+    return {'Authorization': f"Bearer {generate_token(pensioner.id)}"}
+
+
+def test_notifications_budget(client, headers):
+    # Identity, unread counter for the ETag, one page.
+    with query_budget(3, threshold=THRESHOLD):
+        response = client.get('/notifications?limit=50', headers=headers)
+    assert response.status_code == 200
+    assert len(response.json) == 50
+
+    # Following the cursor reuses the cached identity; page size does not add queries.
+    cursor = response.headers['X-Next-Cursor']
+    with query_budget(2, threshold=THRESHOLD):
+        response = client.get(f"/notifications?limit=200&cursor={cursor}", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json) == 70
+
+
+def test_dashboard_summary_budget(client, headers):
+    # The first request of the day builds the summary row: identity, summary lookup,
+    # quarter rows, the INSERT, then reloading the user, details and summary the commit expired.
+    with query_budget(7, threshold=THRESHOLD):
+        assert client.get('/api/dashboard-summary', headers=headers).status_code == 200
+    # After that it is a single lookup.
+    with query_budget(1, threshold=THRESHOLD):
+        assert client.get('/api/dashboard-summary', headers=headers).status_code == 200
+
+
+def test_query_budget_catches_n_plus_one(app, pensioner):
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(200, threshold=THRESHOLD):
+            for notification_id in range(1, THRESHOLD + 1):
+                db.session.get(Notification, notification_id)
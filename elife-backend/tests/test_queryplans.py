@@ -0,0 +1,14 @@
+from sqlalchemy import create_engine
+
+from app.queryplans import check_plans, seed_database
+
+
+def test_hot_queries_use_indexes(app, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    seed_database(engine, users=300, notifications_per_user=5)
+
+    results = check_plans(engine, repeat=1)
+
+    assert len(results) == 10
+    assert {result.name: result.problems for result in results if result.problems} == {}
+    engine.dispose()
@@ -0,0 +1,44 @@
+import sys
+import types
+
+import numpy as np
+
+from app.services import reverification
+
+
+def _fake_models(monkeypatch, crop_face):
+    face_utils = types.SimpleNamespace(
+        crop_face=crop_face,
+        face_embeddings=lambda faces: np.ones((len(faces), 4), dtype=np.float32),
+        face_match_scores=lambda a, b: (np.ones(len(a)), np.zeros(len(a))),
+        is_face_match=lambda similarity, distance, *thresholds: similarity > 0.5,
+    )
+    deepfake_detector = types.SimpleNamespace(frame_scores=lambda frames: np.zeros(len(frames)))
+    # score_batch imports the model modules lazily; stand-ins keep the weights out of the test.
+    monkeypatch.setitem(sys.modules, 'app.services.face_utils', face_utils)
+    monkeypatch.setitem(sys.modules, 'app.services.deepfake_detector', deepfake_detector)
+
+
+def test_score_batch_isolates_a_bad_image(monkeypatch):
+    good = np.zeros((10, 10, 3), dtype=np.uint8)
+    bad = np.zeros((1, 1, 3), dtype=np.uint8)
+    images = {'good': good, 'bad': bad}
+    monkeypatch.setattr(reverification, 'fetch_image', lambda url: images[url.split('/')[0]])
+
+    def crop_face(img):
+        if img is bad:
+            raise ValueError("no usable face")
+        return img
+
+    _fake_models(monkeypatch, crop_face)
+    items = [
+        {'id': 1, 'id_image_url': 'good/id', 'image_urls': ['good/frame']},
+        {'id': 2, 'id_image_url': 'bad/id', 'image_urls': ['good/frame']},
+        {'id': 3, 'id_image_url': 'good/id', 'image_urls': ['good/frame']},
+    ]
+
+    results = {result['id']: result for result in reverification.score_batch(items)}
+
+    assert results[2] == {'id': 2, 'error': 'no usable face'}
+    assert results[1]['match'] and results[3]['match']
+    assert 'error' not in results[1] and 'error' not in results[3]